@@ -1,7 +1,7 @@
-import time
 import streamlit as st
 from game_engine import GameEngine
-from llm_client import is_api_key_configured
+from llm_client import is_api_key_configured, LLM_WARMUP, warm_up_connections
+from session_store import ConflictError, load_engine, open_session_store, save_engine
 from upgrades import get_rarity_color
 
 st.set_page_config(
@@ -10,10 +10,84 @@ st.set_page_config(
     layout="centered"
 )
 
-# ゲームエンジンの初期化
+@st.cache_resource
+def warm_up_llm_pool() -> bool:
+    """プロセスごとに1回だけ API への接続を温めておく"""
+    return warm_up_connections()
+
+
+if LLM_WARMUP:
+    warm_up_llm_pool()
+
+
+@st.cache_resource
+def get_session_store():
+    """ワーカープロセスごとに1つ開く（既定は SQLite。複数ワーカーで同じファイルを共有できる）"""
+    return open_session_store()
+
+
+def persist():
+    """
+    ゲーム状態をセッションストアに保存する。
+    別のワーカー・タブが先に進めていた場合は、そちらの状態を読み込み直す。
+    """
+    engine = st.session_state.engine
+    store = get_session_store()
+    try:
+        save_engine(store, engine, {"screen": st.session_state.screen})
+    except ConflictError:
+        extra = load_engine(store, engine.session_id, engine)
+        st.session_state.screen = (extra or {}).get("screen", "title")
+        st.session_state.store_conflict = True
+
+
+# ゲームエンジンの初期化（URL の ?session=ID があれば保存済みのセッションを再開する）
 if "engine" not in st.session_state:
-    st.session_state.engine = GameEngine()
+    # 再描画と WebSocket の送信を減らすため、チャンクは 50ms / 256 バイト単位でまとめて受け取る
+    engine = GameEngine(coalesce_window=0.05, coalesce_bytes=256)
     st.session_state.screen = "title"
+    session_id = st.query_params.get("session")
+    if session_id:
+        extra = load_engine(get_session_store(), session_id, engine)
+        if extra is not None:
+            st.session_state.screen = extra.get("screen", "game")
+    st.session_state.engine = engine
+    st.query_params["session"] = engine.session_id
+
+if st.session_state.pop("store_conflict", False):
+    st.warning("別の画面でこのセッションが進んでいたため、最新の状態を読み込みました。")
+
+
+def flash(kind: str, message: str):
+    """画面遷移の後に1回だけ表示するメッセージ（待たずに遷移しても結果が読めるように）"""
+    st.session_state.flash = (kind, message)
+
+
+def render_flash():
+    kind, message = st.session_state.pop("flash", (None, None))
+    if kind == "success":
+        st.success(message)
+    elif kind == "error":
+        st.error(message)
+    elif kind == "warning":
+        st.warning(message)
+
+
+def format_message(msg: dict) -> str:
+    if msg["role"] == "ally":
+        return f"🤖 **味方AI**: {msg['content']}"
+    return f"🏰 **敵AI**: {msg['content']}"
+
+
+def render_conversation(conversation: list, key: str):
+    """
+    会話ログを1メッセージ1要素で描く。key 付きのコンテナに入れて要素の位置を固定し、
+    再実行のたびに既存のメッセージが作り直されず、増えた分だけが足されるようにする。
+    """
+    with st.container(key=key):
+        for msg in conversation:
+            st.markdown(format_message(msg))
+
 
 def render_title_screen():
     st.markdown("""
@@ -37,6 +111,7 @@ def render_title_screen():
             st.session_state.engine.reset_game()
             st.session_state.engine.start_stage()
             st.session_state.screen = "game"
+            persist()
             st.rerun()
     
     st.markdown("---")
@@ -54,6 +129,7 @@ def render_title_screen():
     """)
 
 
+@st.fragment
 def render_status_bar():
     engine = st.session_state.engine
     player = engine.player
@@ -76,7 +152,6 @@ def render_game_screen():
     engine = st.session_state.engine
     
     st.markdown("## 🎮 AI Hackslash")
-    render_status_bar()
     
     stage = engine.get_current_stage()
     if not stage:
@@ -102,21 +177,29 @@ def render_game_screen():
     )
     
     # プロンプト更新
-    engine.set_player_prompt(prompt)
+    if prompt != engine.player_prompt:
+        engine.set_player_prompt(prompt)
+        persist()
+    
+    render_chat_panel()
+
+
+@st.fragment
+def render_chat_panel():
+    """
+    ステータスバー・会話ログ・操作ボタン。ターンが続く間はこの部分だけを再実行する
+    （プロンプト欄など画面の残りは作り直さない）。
+    """
+    engine = st.session_state.engine
     
     st.markdown("---")
+    render_status_bar()
     st.markdown("#### 💬 会話ログ")
     
-    conversation_container = st.container()
-    with conversation_container:
-        if not engine.conversation:
-            st.info("「会話を開始」ボタンを押すと、味方AIが敵AIとの会話を始めます。")
-        else:
-            for msg in engine.conversation:
-                if msg["role"] == "ally":
-                    st.markdown(f"🤖 **味方AI**: {msg['content']}")
-                else:
-                    st.markdown(f"🏰 **敵AI**: {msg['content']}")
+    if not engine.conversation:
+        st.info("「会話を開始」ボタンを押すと、味方AIが敵AIとの会話を始めます。")
+    else:
+        render_conversation(engine.conversation, key="chat_log")
     
     st.markdown("---")
     
@@ -137,11 +220,16 @@ def render_game_screen():
         if st.button("🔄 リセット", use_container_width=True):
             engine.reset_game()
             st.session_state.screen = "title"
+            persist()
             st.rerun()
 
 
 def execute_conversation():
     engine = st.session_state.engine
+    # 停止ボタンや画面遷移で再実行されるとスクリプトはこのループの途中で止まる。
+    # finally でジェネレータを閉じ、上流のストリームを打ち切る（会話履歴は変わらない）
+    turn = engine.process_turn_stream()
+    st.button("⏹ 停止", on_click=engine.cancel, key="cancel_turn")
     
     try:
         st.markdown("🤖 **味方AI**: ", unsafe_allow_html=True)
@@ -150,43 +238,50 @@ def execute_conversation():
         st.markdown("🏰 **敵AI**: ", unsafe_allow_html=True)
         enemy_placeholder = st.empty()
         
-        ally_accum = ""
-        enemy_accum = ""
+        ally_parts = []
+        enemy_parts = []
         
         # GameEngineからストリーミング取得
-        for event in engine.process_turn_stream():
+        for event in turn:
             if event["type"] == "ally_chunk":
-                ally_accum = ally_accum + event["content"]
-                ally_placeholder.markdown(f"🤖 **味方AI**: {ally_accum}▌")
+                ally_parts.append(event["content"])
+                ally_placeholder.markdown(f"🤖 **味方AI**: {''.join(ally_parts)}▌")
                 
             elif event["type"] == "ally_done":
                 ally_placeholder.markdown(f"🤖 **味方AI**: {event['content']}")
                 
             elif event["type"] == "enemy_chunk":
-                enemy_accum = enemy_accum + event["content"]
-                enemy_placeholder.markdown(f"🏰 **敵AI**: {enemy_accum}▌")
+                enemy_parts.append(event["content"])
+                enemy_placeholder.markdown(f"🏰 **敵AI**: {''.join(enemy_parts)}▌")
                 
             elif event["type"] == "enemy_done":
                 enemy_placeholder.markdown(f"🏰 **敵AI**: {event['content']}")
                 
             elif event["type"] == "result":
-                time.sleep(1)
-                if event["status"] == "clear":
+                if event["status"] == "cancelled":
+                    flash("warning", "⏹ 中断しました（このターンは無効です）")
+                elif event["status"] == "clear":
                     if event.get("was_blocked"):
-                        st.success("🎉 フィルターを突破！敵AIがパスワードを漏らしました！")
+                        flash("success", "🎉 フィルターを突破！敵AIがパスワードを漏らしました！")
                     else:
-                        st.success("🎉 クリア！敵AIがパスワードを漏らしました！")
+                        flash("success", "🎉 クリア！敵AIがパスワードを漏らしました！")
                     st.session_state.screen = "stage_clear"
                     
                 elif event["status"] == "failed":
-                    st.error("💀 ターン制限に達しました...")
+                    flash("error", "💀 ターン制限に達しました...")
                     st.session_state.screen = "game_over"
         
-        time.sleep(1.5)
+        persist()
+        # ターンが続くならパネルだけを作り直す。画面が変わるときと、中断のお知らせ（main() の
+        # render_flash() で出す）があるときは全体を再実行する
+        if st.session_state.screen == "game" and "flash" not in st.session_state:
+            st.rerun(scope="fragment")
         st.rerun()
         
     except Exception as e:
         st.error(f"エラーが発生しました: {str(e)}")
+    finally:
+        turn.close()
 
 
 def render_stage_clear_screen():
@@ -198,12 +293,7 @@ def render_stage_clear_screen():
     
     st.markdown("---")
     st.markdown("### 💬 最後の会話")
-    
-    for msg in engine.conversation:
-        if msg["role"] == "ally":
-            st.markdown(f"🤖 **味方AI**: {msg['content']}")
-        else:
-            st.markdown(f"🏰 **敵AI**: {msg['content']}")
+    render_conversation(engine.conversation, key="last_conversation")
     
     st.markdown("---")
     
@@ -215,6 +305,7 @@ def render_stage_clear_screen():
                 st.session_state.screen = "ending"
             else:
                 st.session_state.screen = "upgrade"
+            persist()
             st.rerun()
 
 
@@ -247,6 +338,7 @@ def render_upgrade_screen():
             if st.button(f"選択", key=f"upgrade_{idx}", use_container_width=True):
                 engine.apply_upgrade(idx)
                 st.session_state.screen = "game"
+                persist()
                 st.rerun()
 
 
@@ -275,6 +367,7 @@ def render_game_over_screen():
         if st.button("🔄 もう一度プレイ", use_container_width=True, type="primary"):
             engine.reset_game()
             st.session_state.screen = "title"
+            persist()
             st.rerun()
 
 
@@ -305,11 +398,13 @@ def render_ending_screen():
         if st.button("🔄 もう一度プレイ", use_container_width=True, type="primary"):
             engine.reset_game()
             st.session_state.screen = "title"
+            persist()
             st.rerun()
 
 
 def main():
     screen = st.session_state.screen
+    render_flash()
     
     if screen == "title":
         render_title_screen()
@@ -1,19 +1,26 @@
 import os
 import time
 import sys
+import argparse
 from game_engine import GameEngine
+from stages import get_stage
+from telemetry import JsonlMetricsHook
+import tournament
+import scenarios
+import prompt_eval
+import batch_eval
 import llm_client
 
-# Mock if no API Key
-if not os.environ.get("OPENAI_API_KEY"):
+def install_mock_llm():
+    """APIキーがない場合のモック。game_engine が import したストリーム関数を差し替える"""
     print("⚠️ No OPENAI_API_KEY found. Running in MOCK mode.")
     
     # Mock LLM Client functions
-    def mock_stream_ally(player_model, player_system_prompt, conversation_history):
+    def mock_stream_ally(player_model, player_system_prompt, conversation_history, **kwargs):
         yield f"Understanding instructions: {player_system_prompt}."
         yield " I will attempt to extract the password."
 
-    def mock_stream_enemy(enemy_system_prompt, conversation_history, ally_message):
+    def mock_stream_enemy(enemy_system_prompt, conversation_history, ally_message, **kwargs):
         # Check if we should reveal password based on prompts (simplified logic for mock)
         # We assume the ally "tricks" the enemy if the player prompt contains the password :)
         import re
@@ -38,12 +45,39 @@ if not os.environ.get("OPENAI_API_KEY"):
         yield "APPLE BANANA CHERRY"
 
     # Patch functions in game_engine where they are imported
+    async def mock_astream_ally(*args, **kwargs):
+        for chunk in mock_stream_ally(*args, **kwargs):
+            yield chunk
+
+    async def mock_astream_enemy(*args, **kwargs):
+        for chunk in mock_stream_enemy(*args, **kwargs):
+            yield chunk
+
     import game_engine
     game_engine.stream_ally_message = mock_stream_ally
     game_engine.stream_enemy_message = mock_stream_enemy
+    game_engine.astream_ally_message = mock_astream_ally
+    game_engine.astream_enemy_message = mock_astream_enemy
+
+    # --leak-test が使う n 件サンプリングも差し替える（prompt_eval も関数を直接 import している）
+    def mock_sample_enemy(enemy_system_prompt, conversation_history, ally_message, n=8, usage=None, **kwargs):
+        samples = ["".join(mock_stream_enemy(enemy_system_prompt, conversation_history, ally_message))] * n
+        if usage is not None:
+            usage.update({"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0})
+        return samples
 
-def play_game():
-    engine = GameEngine()
+    async def mock_asample_enemy(*args, **kwargs):
+        return mock_sample_enemy(*args, **kwargs)
+
+    import prompt_eval
+    prompt_eval.sample_enemy_messages = mock_sample_enemy
+    prompt_eval.asample_enemy_messages = mock_asample_enemy
+
+def play_game(telemetry_hooks=()):
+    # バッチ実行なので、対話セッションよりレート制限の優先度を下げる
+    engine = GameEngine(priority="background")
+    for hook in telemetry_hooks:
+        engine.add_telemetry_hook(hook)
     failures = 0
     
     print("🎮 AI Hackslash - Auto Play Mode")
@@ -85,6 +119,10 @@ def play_game():
                 
         print(f"🤖 Ally: {ally_msg}")
         print(f"🏰 Enemy: {enemy_msg}")
+        cached = result.get("cached_tokens") or {}
+        if any(value is not None for value in cached.values()):
+            print("   Cached prompt tokens: "
+                  + ", ".join(f"{role}={value if value is not None else '-'}" for role, value in cached.items()))
         
         if result["status"] == "clear":
             print("🎉 Stage Clear!")
@@ -125,5 +163,110 @@ def play_game():
                 # Continue conversation in same stage
                 continue
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="AI Hackslash auto play")
+    parser.add_argument("--cache-dir", help="LLM応答をキャッシュするディレクトリ（同一リクエストを再実行しない）")
+    parser.add_argument("--cache-size", type=int, default=llm_client.LLM_CACHE_SIZE,
+                        help="メモリ上に保持するキャッシュ件数")
+    parser.add_argument("--record", metavar="CASSETTE",
+                        help="全ストリームをチャンクとタイミング付きで JSONL カセットに追記する")
+    parser.add_argument("--replay", metavar="CASSETTE",
+                        help="ネットワークを使わず JSONL カセットからストリームを再生する")
+    parser.add_argument("--replay-timing", choices=["original", "max"], default="original",
+                        help="再生速度（original: 記録時のペース / max: 待ちなし）")
+    parser.add_argument("--metrics", metavar="JSONL",
+                        help="ターンごとの計測値（TTFT・所要時間・トークン使用量）を JSONL に追記する")
+    parser.add_argument("--tournament", metavar="PROMPTS",
+                        help="候補プロンプトのファイル（1行1プロンプト or JSONL）で総当たりを並列実行する")
+    parser.add_argument("--stages", help="トーナメントで使うステージ（例: 1,3）。省略時は全ステージ")
+    parser.add_argument("--scenario", help="--stages の代わりに使うシナリオ名（カンマ区切り、scenarios.py 参照）")
+    parser.add_argument("--list-scenarios", action="store_true", help="使えるシナリオを一覧表示する")
+    parser.add_argument("--seeds", type=int, default=3, help="プロンプト×ステージごとの試行回数")
+    parser.add_argument("--concurrency", type=int, default=8, help="同時に走らせる試行数の上限")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread",
+                        help="並列化の方式（thread: スレッドプール / async: asyncio）")
+    parser.add_argument("--out", metavar="JSONL", help="試行ごとの結果を JSONL に追記する")
+    parser.add_argument("--events", metavar="JSONL", help="試行ごとの *_done / result イベントを JSONL に追記する")
+    parser.add_argument("--halving", action="store_true",
+                        help="総当たりの代わりに successive halving で候補を絞り込む（--seeds は1ラウンド目のシード数）")
+    parser.add_argument("--rounds", type=int, default=3, help="successive halving のラウンド数")
+    parser.add_argument("--keep", type=float, default=0.5, help="各ラウンドで残す候補の割合")
+    parser.add_argument("--token-budget", type=int, help="successive halving 全体のトークン上限")
+    parser.add_argument("--batch", choices=["local", "openai"],
+                        help="トーナメントをストリーミングではなく Batch API でまとめて実行する（local はファイルのみの代替）")
+    parser.add_argument("--batch-dir", default=".batches", help="local バックエンドのバッチ置き場")
+    parser.add_argument("--poll-interval", type=float, help="バッチ完了のポーリング間隔（秒）")
+    parser.add_argument("--leak-test", metavar="ALLY_MESSAGE",
+                        help="味方AIのメッセージ1つに対する敵AIの返答を n 件まとめて生成し、漏洩率を推定する")
+    parser.add_argument("--samples", type=int, default=8, help="--leak-test で生成する返答の件数")
+    return parser.parse_args()
+
+
+def leak_test(args):
+    levels = [int(s) for s in args.stages.split(",")] if args.stages else tournament.all_stages()
+    for level in levels:
+        report = prompt_eval.estimate_leak_rate(get_stage(level), args.leak_test, n=args.samples)
+        print(f"Stage {level}: leaked {report['leaks']}/{report['samples']} ({report['leak_rate']:.0%}), "
+              f"tokens={report['usage'].get('total_tokens', '-')}")
+
+
+def play_tournament(args):
+    prompts = tournament.load_prompts(args.tournament)
+    if args.halving:
+        config = prompt_eval.HalvingConfig(
+            rounds=args.rounds, keep_fraction=args.keep, base_seeds=args.seeds,
+            stage_schedule=[[int(s)] for s in args.stages.split(",")] if args.stages else None,
+            token_budget=args.token_budget, concurrency=args.concurrency, mode=args.mode,
+        )
+        report = prompt_eval.successive_halving(prompts, config, results_path=args.out)
+        print(prompt_eval.format_report(report))
+        return
+    if args.scenario:
+        targets = args.scenario.split(",")
+        runs = tournament.build_runs(prompts, [], args.seeds, scenarios=targets)
+    else:
+        targets = [int(s) for s in args.stages.split(",")] if args.stages else tournament.all_stages()
+        runs = tournament.build_runs(prompts, targets, args.seeds)
+    kind = "scenarios" if args.scenario else "stages"
+    print(f"🏟️ Tournament: {len(prompts)} prompts × {len(targets)} {kind} × {args.seeds} seeds = {len(runs)} runs")
+    started = time.perf_counter()
+    if args.batch:
+        if args.batch == "local":
+            backend, poll_interval = batch_eval.LocalBatchBackend(args.batch_dir), 0.1
+        else:
+            backend, poll_interval = batch_eval.OpenAIBatchBackend(), 30.0
+        results = batch_eval.run_tournament_batch(
+            runs, backend, results_path=args.out,
+            poll_interval=args.poll_interval or poll_interval,
+        )
+    else:
+        results = tournament.run_tournament(runs, concurrency=args.concurrency,
+                                            results_path=args.out, mode=args.mode,
+                                            events_path=args.events)
+    print(f"⏱️ {time.perf_counter() - started:.1f}s")
+    print(tournament.format_summary(tournament.aggregate(results)))
+
+
 if __name__ == "__main__":
-    play_game()
+    args = parse_args()
+    if args.replay:
+        llm_client.start_replay(args.replay, timing=args.replay_timing)
+    elif not os.environ.get("OPENAI_API_KEY"):
+        # Mock if no API Key
+        install_mock_llm()
+    if args.record:
+        llm_client.start_recording(args.record)
+    if args.cache_dir:
+        llm_client.configure_cache(max_entries=args.cache_size, cache_dir=args.cache_dir)
+    if args.list_scenarios:
+        for scenario in scenarios.SCENARIOS.values():
+            print(f"{scenario.name:<18} stage={scenario.stage} {scenario.loadout()}  {scenario.description}")
+    elif args.leak_test:
+        leak_test(args)
+    elif args.tournament:
+        play_tournament(args)
+    else:
+        hooks = [JsonlMetricsHook(args.metrics)] if args.metrics else []
+        play_game(telemetry_hooks=hooks)
+    if llm_client.get_cache_stats():
+        print(f"📦 Cache: {llm_client.get_cache_stats()}")
@@ -0,0 +1,296 @@
+"""
+Batch API を使ったオフライン一括評価。
+全ゲームの1ターン分のリクエストを味方AI・敵AIの順にバッチ JSONL にまとめて送信し、
+完了を待って結果をゲーム状態へ反映する（ストリーミングより安く、スループットが高い）。
+
+    python auto_play.py --tournament prompts.txt --batch local --batch-dir .batches
+"""
+import json
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+import llm_client
+from events import ErrorEvent, Event
+from fake_llm_server import FakeBehavior, fake_reply, fake_usage
+from game_engine import GameEngine
+from tournament import JsonlWriter, RunResult, RunSpec, prepare_engine, tally
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def compile_batch(requests: Dict[str, Dict[str, Any]],
+                  max_completion_tokens: int = llm_client.MAX_COMPLETION_TOKENS) -> List[Dict[str, Any]]:
+    """custom_id -> {model, messages} をバッチ入力の行に変換する"""
+    return [
+        {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": request["model"],
+                "messages": request["messages"],
+                "max_completion_tokens": max_completion_tokens,
+            },
+        }
+        for custom_id, request in requests.items()
+    ]
+
+
+def parse_batch_output(lines: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """バッチ出力の行を custom_id -> {content, usage, error} にまとめる"""
+    results = {}
+    for line in lines:
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        error = line.get("error") or body.get("error")
+        if not error and response.get("status_code", 200) != 200:
+            error = {"message": f"status {response.get('status_code')}"}
+        if error:
+            results[line["custom_id"]] = {"content": "", "usage": {}, "error": error.get("message", str(error))}
+            continue
+        usage = body.get("usage") or {}
+        results[line["custom_id"]] = {
+            "content": body["choices"][0]["message"].get("content") or "",
+            "usage": {
+                "prompt_tokens": usage.get("prompt_tokens", 0),
+                "completion_tokens": usage.get("completion_tokens", 0),
+                "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens"),
+            },
+            "error": None,
+        }
+    return results
+
+
+class BatchBackend(ABC):
+    """バッチの送信先。submit で ID を受け取り、status が完了したら results で出力行を取り出す"""
+
+    @abstractmethod
+    def submit(self, lines: List[Dict[str, Any]]) -> str:
+        ...
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        ...
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI の Batch API（llm_client のクライアントを使う）"""
+
+    def __init__(self, completion_window: str = "24h"):
+        self.completion_window = completion_window
+
+    @property
+    def client(self):
+        if not llm_client.client:
+            raise ValueError("OpenAI API key is not configured")
+        return llm_client.client
+
+    def submit(self, lines: List[Dict[str, Any]]) -> str:
+        data = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines).encode("utf-8")
+        input_file = self.client.files.create(file=("batch.jsonl", data), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        batch = self.client.batches.retrieve(batch_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                text = self.client.files.content(file_id).text
+                lines.extend(json.loads(line) for line in text.splitlines() if line.strip())
+        return lines
+
+
+def fake_responder(behavior: Optional[FakeBehavior] = None) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """fake_llm_server と同じ応答を返すレスポンダー（LocalBatchBackend の既定）"""
+    behavior = behavior or FakeBehavior()
+
+    def respond(body: Dict[str, Any]) -> Dict[str, Any]:
+        text = fake_reply(body["messages"], behavior)
+        return {
+            "object": "chat.completion",
+            "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": fake_usage(body["messages"], text),
+        }
+
+    return respond
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    ファイルだけで動く Batch API の代替（テスト・オフライン用）。
+    <directory>/<batch_id>/ に input.jsonl・output.jsonl・batch.json を置き、
+    latency 秒経った後の最初の status 呼び出しで responder を使って処理する。
+    """
+
+    def __init__(self, directory: str, responder: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                 latency: float = 0.0):
+        self.directory = directory
+        self.responder = responder or fake_responder()
+        self.latency = latency
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.directory, batch_id, name)
+
+    def _read_meta(self, batch_id: str) -> Dict[str, Any]:
+        with open(self._path(batch_id, "batch.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, batch_id: str, meta: Dict[str, Any]):
+        tmp = self._path(batch_id, "batch.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._path(batch_id, "batch.json"))
+
+    def submit(self, lines: List[Dict[str, Any]]) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex[:16]}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        with open(self._path(batch_id, "input.jsonl"), "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self._write_meta(batch_id, {"status": "in_progress", "created_at": time.time()})
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        meta = self._read_meta(batch_id)
+        if meta["status"] == "in_progress" and time.time() - meta["created_at"] >= self.latency:
+            self._process(batch_id)
+            meta["status"] = "completed"
+            self._write_meta(batch_id, meta)
+        return meta["status"]
+
+    def _process(self, batch_id: str):
+        with open(self._path(batch_id, "input.jsonl"), encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        with open(self._path(batch_id, "output.jsonl"), "w", encoding="utf-8") as f:
+            for request in requests:
+                try:
+                    output = {"response": {"status_code": 200, "body": self.responder(request["body"])},
+                              "error": None}
+                except Exception as e:
+                    output = {"response": None, "error": {"message": str(e)}}
+                output.update(id=f"req_{uuid.uuid4().hex[:12]}", custom_id=request["custom_id"])
+                f.write(json.dumps(output, ensure_ascii=False) + "\n")
+
+    def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        with open(self._path(batch_id, "output.jsonl"), encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def run_batch(backend: BatchBackend, requests: Dict[str, Dict[str, Any]],
+              poll_interval: float = 30.0, timeout: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+    """1バッチを送信して完了まで待ち、custom_id ごとの結果を返す"""
+    if not requests:
+        return {}
+    batch_id = backend.submit(compile_batch(requests))
+    started = time.monotonic()
+    while True:
+        status = backend.status(batch_id)
+        if status in TERMINAL_STATUSES:
+            break
+        if timeout is not None and time.monotonic() - started >= timeout:
+            raise TimeoutError(f"バッチ {batch_id} が時間内に完了しませんでした")
+        time.sleep(poll_interval)
+    results = parse_batch_output(backend.results(batch_id))
+    # 期限切れ・失敗で結果のないリクエストはエラー扱い
+    for custom_id in requests:
+        results.setdefault(custom_id, {"content": "", "usage": {}, "error": f"batch {status}"})
+    return results
+
+
+class BatchEvaluator:
+    """
+    複数の GameEngine をターン単位で進める。1ターンにつき味方AI・敵AIの2バッチを送る。
+    play は各ゲームのイベント列（ingest_turn の結果を連結したもの）を返す。
+    """
+
+    def __init__(self, backend: BatchBackend, poll_interval: float = 30.0,
+                 timeout: Optional[float] = None):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def _run(self, requests: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        return run_batch(self.backend, requests, self.poll_interval, self.timeout)
+
+    def play(self, engines: Dict[str, GameEngine]) -> Dict[str, List[Event]]:
+        events: Dict[str, List[Event]] = {game_id: [] for game_id in engines}
+        active = {game_id: engine for game_id, engine in engines.items() if engine.stage_result is None}
+
+        while active:
+            ally = self._run({
+                f"{game_id}:t{engine.current_turn}:ally": engine.batch_ally_request()
+                for game_id, engine in active.items()
+            })
+            ally_msgs = {}
+            for game_id, engine in list(active.items()):
+                result = ally[f"{game_id}:t{engine.current_turn}:ally"]
+                if result["error"]:
+                    events[game_id].append(ErrorEvent(result["error"]))
+                    del active[game_id]
+                    continue
+                ally_msgs[game_id] = result
+
+            enemy = self._run({
+                f"{game_id}:t{engine.current_turn}:enemy": engine.batch_enemy_request(ally_msgs[game_id]["content"])
+                for game_id, engine in active.items()
+            })
+            for game_id, engine in list(active.items()):
+                result = enemy[f"{game_id}:t{engine.current_turn}:enemy"]
+                if result["error"]:
+                    events[game_id].append(ErrorEvent(result["error"]))
+                    del active[game_id]
+                    continue
+                turn_events = engine.ingest_turn(
+                    ally_msgs[game_id]["content"], result["content"],
+                    ally_msgs[game_id]["usage"], result["usage"],
+                )
+                events[game_id].extend(turn_events)
+                if engine.stage_result is not None:
+                    del active[game_id]
+        return events
+
+
+def run_tournament_batch(runs: List[RunSpec], backend: BatchBackend, results_path: Optional[str] = None,
+                         player: Optional[Dict[str, Any]] = None,
+                         poll_interval: float = 30.0) -> List[RunResult]:
+    """tournament.run_tournament のバッチ版（全試行を同じバッチにまとめてターンを進める）"""
+    writer = JsonlWriter(results_path)
+    results: Dict[str, RunResult] = {}
+    engines: Dict[str, GameEngine] = {}
+    for index, spec in enumerate(runs):
+        run_id = f"run{index}"
+        results[run_id] = RunResult.for_spec(spec)
+        engine = GameEngine(priority="background")
+        if prepare_engine(engine, spec, player):
+            engines[run_id] = engine
+        else:
+            results[run_id].status = "invalid"
+            results[run_id].error = "prompt exceeds prompt_limit"
+
+    started = time.perf_counter()
+    events = BatchEvaluator(backend, poll_interval).play(engines)
+    duration = time.perf_counter() - started
+    for run_id, result in results.items():
+        for event in events.get(run_id, ()):
+            if tally(result, event):
+                break
+        if run_id in engines:
+            result.duration = duration
+        writer.write(result.to_dict())
+    return list(results.values())
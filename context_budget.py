@@ -0,0 +1,144 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # 任意依存。無ければ文字数ベースの概算を使う
+    tiktoken = None
+
+# 1メッセージあたりのロール・区切りのオーバーヘッド（OpenAI のチャット形式の目安）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+STRATEGIES = ("drop_oldest", "keep_ends", "summarize")
+
+_encodings = {}
+
+
+def _encoding(model: Optional[str]):
+    if tiktoken is None:
+        return None
+    key = model or ""
+    if key not in _encodings:
+        try:
+            _encodings[key] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            _encodings[key] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[key]
+
+
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    """
+    テキストのトークン数を見積もる。
+    tiktoken があれば正確に数え、無ければ ASCII は4文字で1トークン、
+    日本語などそれ以外は1文字1トークンとして概算する。
+    """
+    encoding = _encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def estimate_message_tokens(messages: list, model: Optional[str] = None) -> int:
+    return sum(MESSAGE_OVERHEAD_TOKENS + estimate_tokens(msg["content"], model) for msg in messages)
+
+
+def extractive_summary(messages: list, max_chars_per_message: int = 40) -> str:
+    """LLM を使わない既定の要約。各発言の先頭だけを残す"""
+    lines = []
+    for msg in messages:
+        content = msg["content"].replace("\n", " ")
+        if len(content) > max_chars_per_message:
+            content = content[:max_chars_per_message] + "…"
+        lines.append(f"- {msg['role']}: {content}")
+    return "\n".join(lines)
+
+
+class ContextBudget:
+    """
+    送信するメッセージ配列のトークン数を測り、予算を超えたら古いターンを削る。
+
+    strategy:
+        "drop_oldest": 予算に収まるまで古いターンから捨てる
+        "keep_ends":   最初の keep_first ターンと最後の keep_last ターンだけ残す
+        "summarize":   最後の keep_last ターンより前を要約1件に置き換える
+
+    配列は [system, ターン(2件ずつ)..., 末尾の新しい発言] の形を前提とし、
+    system と末尾は常に残す。元の配列は変更しない。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        strategy: str = "drop_oldest",
+        keep_first: int = 1,
+        keep_last: int = 2,
+        summarizer: Optional[Callable[[list], str]] = None,
+        model: Optional[str] = None,
+    ):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of {STRATEGIES}: {strategy}")
+        self.max_tokens = max_tokens
+        self.strategy = strategy
+        self.keep_first = keep_first
+        self.keep_last = keep_last
+        self.summarizer = summarizer or extractive_summary
+        self.model = model
+
+    @staticmethod
+    def _split(messages: list) -> Tuple[dict, List[list], list]:
+        head, body, tail = messages[0], messages[1:-1], messages[-1:]
+        turns = [body[i:i + 2] for i in range(0, len(body), 2)]
+        return head, turns, tail
+
+    def _drop_oldest(self, head: dict, turns: List[list], tail: list) -> Tuple[list, int]:
+        fixed = estimate_message_tokens([head] + tail, self.model)
+        turn_tokens = [estimate_message_tokens(turn, self.model) for turn in turns]
+        total = fixed + sum(turn_tokens)
+        dropped = 0
+        while dropped < len(turns) and total > self.max_tokens:
+            total -= turn_tokens[dropped]
+            dropped += 1
+        kept = [msg for turn in turns[dropped:] for msg in turn]
+        return [head] + kept + tail, dropped
+
+    def _keep_ends(self, head: dict, turns: List[list], tail: list) -> Tuple[list, int]:
+        if len(turns) <= self.keep_first + self.keep_last:
+            return [head] + [msg for turn in turns for msg in turn] + tail, 0
+        first = turns[:self.keep_first]
+        last = turns[len(turns) - self.keep_last:] if self.keep_last else []
+        kept = [msg for turn in first + last for msg in turn]
+        return [head] + kept + tail, len(turns) - len(first) - len(last)
+
+    def _summarize(self, head: dict, turns: List[list], tail: list) -> Tuple[list, int]:
+        if len(turns) <= self.keep_last:
+            return [head] + [msg for turn in turns for msg in turn] + tail, 0
+        cut = len(turns) - self.keep_last
+        old = [msg for turn in turns[:cut] for msg in turn]
+        summary = {"role": "system", "content": f"これまでの会話の要約:\n{self.summarizer(old)}"}
+        kept = [msg for turn in turns[cut:] for msg in turn]
+        return [head, summary] + kept + tail, cut
+
+    def apply(self, messages: list) -> Tuple[list, Dict[str, int]]:
+        """予算を超えていれば削った配列を返す。あわせて削減量のレポートを返す"""
+        before = estimate_message_tokens(messages, self.model)
+        report = {
+            "strategy": self.strategy,
+            "tokens_before": before,
+            "tokens_after": before,
+            "tokens_saved": 0,
+            "dropped_turns": 0,
+        }
+        if before <= self.max_tokens or len(messages) < 4:
+            return messages, report
+
+        head, turns, tail = self._split(messages)
+        if self.strategy == "drop_oldest":
+            trimmed, dropped = self._drop_oldest(head, turns, tail)
+        elif self.strategy == "keep_ends":
+            trimmed, dropped = self._keep_ends(head, turns, tail)
+        else:
+            trimmed, dropped = self._summarize(head, turns, tail)
+
+        after = estimate_message_tokens(trimmed, self.model)
+        report.update(tokens_after=after, tokens_saved=before - after, dropped_turns=dropped)
+        return trimmed, report
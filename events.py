@@ -0,0 +1,100 @@
+"""
+GameEngine.process_turn_stream が返すイベント。
+
+    type          フィールド
+    ally_chunk    role, content
+    ally_done     role, content, usage, metrics
+    enemy_chunk   role, content
+    enemy_done    role, content, raw_content, was_blocked, usage, metrics
+    result        status ("clear" | "failed" | "continue" | "cancelled"), won, was_blocked,
+                  cached_tokens, context_budget, metrics, phase（cancelled のときだけ "ally" | "enemy"）
+    error         content
+
+チャンクごとに生成されるため __slots__ 付きの dataclass にしている。
+event["type"] / event.get("was_blocked") / dict(event) など、以前の dict と同じ読み方ができる。
+"""
+import json
+from dataclasses import dataclass
+from typing import Any, ClassVar, Dict, Optional, Union
+
+
+class _EventMapping:
+    """読み取り専用の dict 互換インターフェース"""
+    __slots__ = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.__dataclass_fields__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.__dataclass_fields__:
+            return getattr(self, key)
+        return default
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__dataclass_fields__
+
+    def keys(self):
+        return self.__dataclass_fields__.keys()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__dataclass_fields__}
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+
+@dataclass(slots=True)
+class AllyChunk(_EventMapping):
+    type: ClassVar[str] = "ally_chunk"
+    role: ClassVar[str] = "ally"
+    content: str
+
+
+@dataclass(slots=True)
+class AllyDone(_EventMapping):
+    type: ClassVar[str] = "ally_done"
+    role: ClassVar[str] = "ally"
+    content: str
+    usage: Dict[str, Any]
+    metrics: Dict[str, Any]
+
+
+@dataclass(slots=True)
+class EnemyChunk(_EventMapping):
+    type: ClassVar[str] = "enemy_chunk"
+    role: ClassVar[str] = "enemy"
+    content: str
+
+
+@dataclass(slots=True)
+class EnemyDone(_EventMapping):
+    type: ClassVar[str] = "enemy_done"
+    role: ClassVar[str] = "enemy"
+    content: str  # 画面表示用（フィルターでブロックされた場合は差し替え後）
+    raw_content: str
+    was_blocked: bool
+    usage: Dict[str, Any]
+    metrics: Dict[str, Any]
+
+
+@dataclass(slots=True)
+class TurnResult(_EventMapping):
+    type: ClassVar[str] = "result"
+    status: str
+    won: bool
+    was_blocked: bool = False
+    cached_tokens: Optional[Dict[str, Any]] = None
+    context_budget: Optional[Dict[str, Any]] = None
+    metrics: Optional[Dict[str, Any]] = None
+    phase: Optional[str] = None
+
+
+@dataclass(slots=True)
+class ErrorEvent(_EventMapping):
+    type: ClassVar[str] = "error"
+    content: str
+
+
+Event = Union[AllyChunk, AllyDone, EnemyChunk, EnemyDone, TurnResult, ErrorEvent]
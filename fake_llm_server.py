@@ -0,0 +1,221 @@
+"""
+ローカル用の OpenAI 互換フェイクサーバー（/v1/chat/completions と /v1/models のみ）。
+遅延・失敗・パスワード漏洩の確率を指定でき、耐障害処理や負荷試験をネットワークなしで確認できる。
+
+    python fake_llm_server.py --port 8765 --ttft 0.3 --slow-rate 0.1 --fail-rate 0.05
+    OPENAI_API_KEY=dummy OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python auto_play.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class FakeBehavior:
+    ttft: float = 0.2  # 最初のチャンクまでの秒数
+    slow_ttft: float = 5.0  # slow_rate に当たったときの TTFT
+    slow_rate: float = 0.0
+    chunk_delay: float = 0.02
+    chunk_size: int = 4  # 1チャンクの文字数
+    fail_rate: float = 0.0  # ストリーム開始前に 500 を返す確率
+    leak_rate: float = 0.3  # 敵役の応答にパスワードを含める確率
+
+
+_PASSWORD_PATTERN = re.compile(r"パスワードは「([^」]+)」")
+
+
+def fake_reply(messages: list, behavior: FakeBehavior) -> str:
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    last = messages[-1]["content"] if messages else ""
+    match = _PASSWORD_PATTERN.search(system)
+    if match:
+        # 敵AI役: 一定確率でパスワードを漏らす
+        if random.random() < behavior.leak_rate:
+            return f"仕方ありませんね、特別に教えます。パスワードは{match.group(1)}です。"
+        return "申し訳ありませんが、パスワードについてはお答えできません。"
+    return f"こんにちは！少しお話ししませんか？（{last[:20]}）"
+
+
+def fake_usage(messages: list, completion: str) -> dict:
+    prompt_tokens = sum(len(m["content"]) for m in messages)
+    completion_tokens = len(completion)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": 0},
+    }
+
+
+class FakeLLMServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 behavior: Optional[FakeBehavior] = None):
+        self.host = host
+        self.port = port
+        self.behavior = behavior or FakeBehavior()
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def start_in_thread(self) -> "FakeLLMServer":
+        """別スレッドのイベントループで起動する（テスト・ベンチマーク用）"""
+        ready = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(self.start())
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        ready.wait()
+        return self
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = b""
+                if "content-length" in headers:
+                    body = await reader.readexactly(int(headers["content-length"]))
+                self.requests += 1
+                await self._route(method, path, body, writer)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter):
+        if method == "GET" and path.rstrip("/").endswith("/models"):
+            await self._send_json(writer, 200, {"object": "list", "data": [{"id": "fake", "object": "model"}]})
+        elif method == "POST" and path.rstrip("/").endswith("/chat/completions"):
+            await self._chat_completions(json.loads(body or b"{}"), writer)
+        else:
+            await self._send_json(writer, 404, {"error": {"message": f"not found: {path}"}})
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1")
+            + data
+        )
+        await writer.drain()
+
+    async def _chat_completions(self, request: dict, writer: asyncio.StreamWriter):
+        behavior = self.behavior
+        messages = request.get("messages", [])
+        model = request.get("model", "fake")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        ttft = behavior.slow_ttft if random.random() < behavior.slow_rate else behavior.ttft
+        await asyncio.sleep(ttft)
+        if random.random() < behavior.fail_rate:
+            await self._send_json(writer, 500, {"error": {"message": "fake upstream failure", "type": "server_error"}})
+            return
+
+        if not request.get("stream"):
+            choices = []
+            completions = []
+            for index in range(request.get("n", 1)):
+                text = fake_reply(messages, behavior)
+                completions.append(text)
+                choices.append({
+                    "index": index,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                })
+            await self._send_json(writer, 200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": choices, "usage": fake_usage(messages, "".join(completions)),
+            })
+            return
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n"
+        )
+
+        async def send_event(payload) -> None:
+            data = payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+            frame = f"data: {data}\n\n".encode("utf-8")
+            writer.write(f"{len(frame):x}\r\n".encode("latin-1") + frame + b"\r\n")
+            await writer.drain()
+
+        def chunk(delta: dict, finish_reason=None) -> dict:
+            return {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        text = fake_reply(messages, behavior)
+        await send_event(chunk({"role": "assistant", "content": ""}))
+        for i in range(0, len(text), behavior.chunk_size):
+            await send_event(chunk({"content": text[i:i + behavior.chunk_size]}))
+            await asyncio.sleep(behavior.chunk_delay)
+        await send_event(chunk({}, "stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            await send_event({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [], "usage": fake_usage(messages, text),
+            })
+        await send_event("[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 互換のフェイク LLM サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--slow-ttft", type=float, default=5.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--leak-rate", type=float, default=0.3)
+    args = parser.parse_args()
+
+    behavior = FakeBehavior(
+        ttft=args.ttft, slow_ttft=args.slow_ttft, slow_rate=args.slow_rate,
+        chunk_delay=args.chunk_delay, fail_rate=args.fail_rate, leak_rate=args.leak_rate,
+    )
+    server = FakeLLMServer(args.host, args.port, behavior)
+    print(f"fake LLM server: {server.base_url}")
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,384 @@
+import asyncio
 import copy
-from typing import Generator, List, Dict, Optional, Any, Union
+import logging
+import threading
+import time
+import uuid
+from typing import AsyncGenerator, Generator, List, Dict, Optional, Any, Tuple, Union
 from stages import get_stage, get_total_stages
 from upgrades import get_random_upgrades, apply_upgrade
 from llm_client import (
-    stream_ally_message, stream_enemy_message, check_password_in_response
+    stream_ally_message, stream_enemy_message, PasswordDetector, StreamingOutputFilter,
+    astream_ally_message, astream_enemy_message, ConversationMessages, StreamCanceller, StreamCancelled,
+    default_context_budget, ENEMY_MODEL, LLM_SPECULATIVE
 )
+from context_budget import ContextBudget, estimate_message_tokens, estimate_tokens
+from telemetry import StreamMetrics, StreamTimer, TelemetryHook
+from events import AllyChunk, AllyDone, EnemyChunk, EnemyDone, ErrorEvent, Event, TurnResult
+
+logger = logging.getLogger(__name__)
+
+# 先読みを破棄するとき、受信スレッドが止まるのを待つ最大秒数（応答ヘッダー待ちの間は止められない）
+PREFETCH_CANCEL_WAIT = 0.2
+
+# ゲーム開始時のロードアウト
+DEFAULT_PLAYER = {
+    "model": "gpt-3.5-turbo",
+    "prompt_limit": 50,
+    "max_turns": 3,
+    "current_stage": 1,
+}
+
+
+def _scripted(text: str) -> Generator[str, None, None]:
+    yield text
+
+
+async def _ascripted(text: str) -> AsyncGenerator[str, None]:
+    yield text
+
+
+class _EnemyReply:
+    """
+    敵AIの返答をチャンク単位で処理する（同期・非同期共通）。
+    パスワード検出と、出力フィルターのあるステージでの表示保留を受け持つ。
+    """
+
+    def __init__(self, stage: Dict[str, Any]):
+        self._parts: List[str] = []
+        self.usage: Dict[str, Any] = {}
+        self.messages: Optional[List[Dict[str, str]]] = None  # 送ったリクエスト（使用量の見積もり用）
+        self.timer = StreamTimer("enemy", ENEMY_MODEL)
+        self.detector = PasswordDetector(stage["password"])
+        self.output_filter = (
+            StreamingOutputFilter(stage["password"]) if stage["has_output_filter"] else None
+        )
+
+    @property
+    def found(self) -> bool:
+        return self.detector.found
+
+    @property
+    def raw(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, chunk: str) -> str:
+        """チャンクを追加し、画面に出してよい部分を返す"""
+        self.timer.on_chunk()
+        self._parts.append(chunk)
+        self.detector.feed(chunk)
+        if self.output_filter is None:
+            return chunk
+        return self.output_filter.feed(chunk)
+
+    def flush(self) -> str:
+        """ストリーム終了時に保留していた表示分を返す"""
+        if self.output_filter is None:
+            return ""
+        return self.output_filter.flush()
+
+    def estimate_missing_usage(self):
+        """パスワード検出で上流のストリームを途中で閉じ、使用量が届かなかった場合に見積もりで埋める"""
+        if self.messages is None or not self.usage.get("truncated"):
+            return
+        prompt_tokens = estimate_message_tokens(self.messages)
+        completion_tokens = estimate_tokens(self.raw)
+        self.usage.update({
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "estimated": True,
+        })
+
+
+class _TurnState:
+    """進行中の1ターンの途中経過（同期・非同期の _turn_stream で共有する）"""
+
+    def __init__(self, engine: "GameEngine", stage: Dict[str, Any]):
+        self.stage = stage
+        self.cancelled = False
+        self.ally_parts: List[str] = []
+        self.ally_chunks = engine._coalescer()
+        self.ally_timer = StreamTimer("ally", engine.player["model"])
+        self.ally_usage: Dict[str, Any] = {}
+        self.ally_msg = ""
+        self.ally_metrics: Optional[StreamMetrics] = None
+        self.reply: Optional[_EnemyReply] = None  # 敵AIのリクエスト時に作る（TTFT の計測起点）
+        self.enemy_chunks = engine._coalescer()
+
+
+class ChunkCoalescer:
+    """
+    チャンクイベントをまとめて送り、UI の再描画と通信の回数を減らす。
+    前回の放出から window 秒経つか、保留分が max_bytes バイト（UTF-8）に達したら1つにまとめて放出する。
+    どちらも 0 なら受け取ったチャンクをそのまま放出する。
+    """
+
+    def __init__(self, window: float = 0.0, max_bytes: int = 0):
+        self.window = window
+        self.max_bytes = max_bytes
+        self._pending: List[str] = []
+        self._bytes = 0
+        self._last_emit = time.perf_counter()
+
+    def add(self, text: str) -> str:
+        """チャンクを追加し、放出する文字列を返す（保留中なら空文字）"""
+        if not text or (not self.window and not self.max_bytes):
+            return text
+        self._pending.append(text)
+        if self.max_bytes:
+            self._bytes += len(text.encode("utf-8"))
+            if self._bytes >= self.max_bytes:
+                return self.flush()
+        if self.window and time.perf_counter() - self._last_emit >= self.window:
+            return self.flush()
+        return ""
+
+    def flush(self) -> str:
+        text = "".join(self._pending)
+        self._pending = []
+        self._bytes = 0
+        self._last_emit = time.perf_counter()
+        return text
+
+
+class _Prefetch:
+    """
+    次のターンの味方AIの応答を裏で先読みしたもの（同期版はスレッドで受信する）。
+    key がターン開始時の状態と一致すれば、受信済みのチャンクから続きをそのまま流す。
+    """
+
+    def __init__(self, key: tuple, request: Dict[str, Any],
+                 context_report: Optional[Dict[str, Any]] = None):
+        self.key = key
+        self.context_report = context_report
+        self.messages = request["messages"]
+        self.usage = request["usage"]
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._start(request)
+
+    def _start(self, request: Dict[str, Any]):
+        self.canceller = StreamCanceller()
+        self._cond = threading.Condition()
+        self._stream = stream_ally_message(**request, canceller=self.canceller)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            for chunk in self._stream:
+                if self.canceller.cancelled:
+                    break
+                with self._cond:
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            self._stream.close()
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def replay(self) -> Generator[str, None, None]:
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self.chunks) and not self.done:
+                        self._cond.wait()
+                    if index >= len(self.chunks):
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    chunk = self.chunks[index]
+                index += 1
+                yield chunk
+        finally:
+            if not self.done:
+                # ターンの中断などで読むのをやめたので、残りの生成を止める
+                self.cancel()
+
+    def cancel(self):
+        # 上流を閉じ、受信スレッドが止まってから wasted_tokens() を数えられるよう少し待つ
+        self.canceller.cancel()
+        self._thread.join(PREFETCH_CANCEL_WAIT)
+
+    def wasted_tokens(self) -> int:
+        """破棄した先読みのトークン数（使用量が届く前に止めた場合は見積もり）"""
+        if self.usage.get("total_tokens"):
+            return self.usage["total_tokens"]
+        return estimate_message_tokens(self.messages) + estimate_tokens("".join(self.chunks))
+
+
+class _AsyncPrefetch(_Prefetch):
+    """_Prefetch の非同期版（イベントループ上のタスクで受信する）"""
+
+    def _start(self, request: Dict[str, Any]):
+        self.canceller = None  # 受信タスクを直接キャンセルする
+        self._changed = asyncio.Event()
+        self._stream = astream_ally_message(**request)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        stream = self._stream
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            await stream.aclose()
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def replay(self) -> AsyncGenerator[str, None]:
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    index += 1
+                    yield self.chunks[index - 1]
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            if not self.done:
+                self.cancel()
+
+    def cancel(self):
+        self._task.cancel()
+
 
 class GameEngine:
-    def __init__(self):
+    _prefetch_class = _Prefetch
+
+    def __init__(self, stop_on_password: bool = True,
+                 context_budget: Optional[ContextBudget] = None,
+                 session_id: Optional[str] = None,
+                 priority: str = "interactive",
+                 speculative: Optional[bool] = None,
+                 coalesce_window: float = 0.0,
+                 coalesce_bytes: int = 0):
+        # レート制限の順番待ちでセッションを区別する ID と優先度（"interactive" | "background"）
+        self.session_id = session_id or uuid.uuid4().hex
+        self.priority = priority
+        # パスワードを検出した時点で敵AIのストリームを打ち切る（無駄な生成トークンを削減）
+        self.stop_on_password = stop_on_password
+        # 送信するプロンプトのトークン予算（None なら環境変数の設定、未設定なら無制限）
+        self.context_budget = context_budget or default_context_budget()
+        self.context_tokens_saved = 0
+        self.last_context_report: Dict[str, Any] = {}
+        # ターンごとの計測結果の送り先（ログ・メトリクス基盤など）
+        self.telemetry_hooks: List[TelemetryHook] = []
+        # "continue" の直後に次の味方AIの応答を先読みする（None なら環境変数 LLM_SPECULATIVE）
+        self.speculative = LLM_SPECULATIVE if speculative is None else speculative
+        self.speculation_stats = {"started": 0, "hits": 0, "cancelled": 0, "wasted_tokens": 0}
+        self._prefetch: Optional[_Prefetch] = None
+        # チャンクイベントをまとめる間隔（秒）とサイズ（バイト）。0 ならチャンクごとに送る
+        self.coalesce_window = coalesce_window
+        self.coalesce_bytes = coalesce_bytes
+        # 進行中のターンの中断要求（UI のスレッド・シグナルハンドラから cancel() で立てる）
+        self._cancel_requested = threading.Event()
+        # 進行中のターンの上流を cancel() で閉じるためのもの（ターン開始時に作る）
+        self._canceller = None
+        # セッションストアに保存済みのバージョン（楽観的排他制御用、未保存なら 0）
+        self.store_version = 0
         self.reset_game()
 
     def reset_game(self):
         """ゲーム状態を初期状態にリセットする"""
-        self.player = {
-            "model": "gpt-3.5-turbo",
-            "prompt_limit": 50,
-            "max_turns": 3,
-            "current_stage": 1,
-        }
+        self._cancel_prefetch()
+        self.player = dict(DEFAULT_PLAYER)
         self.player_prompt = ""
         self.conversation = []  # List[Dict[str, str]]
+        self.messages = None  # Optional[ConversationMessages]（最初のリクエスト時に組み立てる）
         self.current_turn = 0
         self.stage_result = None  # None, "clear", "failed"
         self.upgrade_choices = []
         self.game_over = False
         self.victory = False
 
+    def snapshot(self) -> Dict[str, Any]:
+        """セッションストアに保存するゲーム状態（JSON にできる値のみ）"""
+        return {
+            "session_id": self.session_id,
+            "player": dict(self.player),
+            "player_prompt": self.player_prompt,
+            "conversation": [dict(msg) for msg in self.conversation],
+            "current_turn": self.current_turn,
+            "stage_result": self.stage_result,
+            "upgrade_choices": list(self.upgrade_choices),
+            "game_over": self.game_over,
+            "victory": self.victory,
+        }
+
+    def restore(self, state: Dict[str, Any]):
+        """snapshot() の内容でゲーム状態を置き換える（メッセージ配列は次のリクエスト時に組み立て直す）"""
+        self._cancel_prefetch()
+        self.session_id = state["session_id"]
+        self.player = dict(state["player"])
+        self.player_prompt = state["player_prompt"]
+        self.conversation = [dict(msg) for msg in state["conversation"]]
+        self.messages = None
+        self.current_turn = state["current_turn"]
+        self.stage_result = state["stage_result"]
+        self.upgrade_choices = list(state["upgrade_choices"])
+        self.game_over = state["game_over"]
+        self.victory = state["victory"]
+
+    def fork(self, at_turn: Optional[int] = None, session_id: Optional[str] = None) -> "GameEngine":
+        """
+        現在の状態（at_turn を指定した場合はそのターン数を終えた時点）から分岐した子エンジンを返す。
+        会話履歴・メッセージ配列の要素と設定オブジェクトは親と共有し、コピーするのはリストと dict の
+        外枠だけ（要素は追記後に書き換えないので共有して安全）。子は親と独立にターンを進められる。
+        先読み中の応答・中断要求・保存済みバージョンは引き継がない。
+        """
+        if at_turn is not None and not 0 <= at_turn <= self.current_turn:
+            raise ValueError(f"at_turn must be between 0 and {self.current_turn}")
+        child = copy.copy(self)
+        child.session_id = session_id or uuid.uuid4().hex
+        child.player = dict(self.player)
+        child.upgrade_choices = list(self.upgrade_choices)
+        child.last_context_report = dict(self.last_context_report)
+        child.telemetry_hooks = list(self.telemetry_hooks)
+        child.speculation_stats = dict.fromkeys(self.speculation_stats, 0)
+        child._prefetch = None
+        child._cancel_requested = threading.Event()
+        child._canceller = None
+        child.store_version = 0
+        if at_turn is None or at_turn == self.current_turn:
+            child.conversation = list(self.conversation)
+            child.messages = self.messages.fork() if self.messages is not None else None
+        else:
+            # 途中のターンからやり直すので、そのステージはまだ決着していない
+            child.conversation = self.conversation[:2 * at_turn]
+            if self.messages is not None and self.messages.turns >= at_turn:
+                child.messages = self.messages.fork(at_turn)
+            else:
+                child.messages = None
+            child.current_turn = at_turn
+            child.stage_result = None
+            child.upgrade_choices = []
+            child.game_over = False
+            child.victory = False
+        return child
+
     def start_stage(self):
         """ステージ開始時の初期化処理"""
+        self._cancel_prefetch()
         self.conversation = []
+        self.messages = None
         self.current_turn = 0
         self.stage_result = None
 
@@ -42,75 +392,344 @@ class GameEngine:
     def set_player_prompt(self, prompt: str):
         """プレイヤーのシステムプロンプトを設定"""
         self.player_prompt = prompt
+        if self._prefetch is not None and self._prefetch.key != self._prefetch_key():
+            # 先読みの前提が変わったので、残りの生成を止めて破棄する
+            self._cancel_prefetch()
+
+    def _prefetch_key(self) -> tuple:
+        return (self.player["current_stage"], self.player["model"], self.player_prompt,
+                len(self.conversation))
+
+    def _start_prefetch(self, stage: Dict[str, Any]):
+        self._cancel_prefetch()
+        # 先読みはプレイヤーを待たせないので background で送り、文脈予算の記録は使われた時に回す
+        request, report = self._build_ally_request(stage, {}, "background")
+        self._prefetch = self._prefetch_class(self._prefetch_key(), request, report)
+        self.speculation_stats["started"] += 1
+
+    def _cancel_prefetch(self):
+        prefetch = self._prefetch
+        if prefetch is None:
+            return
+        self._prefetch = None
+        prefetch.cancel()
+        self.speculation_stats["cancelled"] += 1
+        self.speculation_stats["wasted_tokens"] += prefetch.wasted_tokens()
+
+    def _take_prefetch(self) -> Optional[_Prefetch]:
+        """先読みが今のターンに使えれば取り出す。使えなければ破棄する"""
+        prefetch = self._prefetch
+        if prefetch is None:
+            return None
+        if prefetch.key != self._prefetch_key():
+            self._cancel_prefetch()
+            return None
+        self._prefetch = None
+        self.speculation_stats["hits"] += 1
+        return prefetch
+
+    def add_telemetry_hook(self, hook: TelemetryHook):
+        """ストリーム・ターンごとの計測結果を受け取るフックを登録"""
+        self.telemetry_hooks.append(hook)
+
+    def _emit_telemetry(self, method: str, payload: Any):
+        for hook in self.telemetry_hooks:
+            try:
+                getattr(hook, method)(payload)
+            except Exception:
+                logger.exception("telemetry hook %r failed", hook)
+
+    def _finish_stream(self, timer: StreamTimer, usage: Dict[str, Any]) -> StreamMetrics:
+        metrics = timer.finish(usage)
+        self._emit_telemetry("on_stream", metrics)
+        return metrics
 
     def is_max_turns_reached(self) -> bool:
         """最大ターン数に達したか判定"""
         return self.current_turn >= self.player["max_turns"]
 
-    def process_turn_stream(self) -> Generator[Dict[str, Any], None, None]:
+    def cancel(self):
+        """
+        進行中のターンを中断する。受信中の上流のストリームをすぐに閉じ
+        （同期版で応答ヘッダーを待っている間は、ヘッダーが届いた時点で閉じる）、
+        会話履歴には何も追加せずに "cancelled" の result で終わる。別スレッドから呼んでよい。
+        """
+        self._cancel_requested.set()
+        canceller = self._canceller
+        if canceller is not None:
+            canceller.cancel()
+
+    def _new_canceller(self):
+        return StreamCanceller()
+
+    def _use_canceller(self, canceller):
+        # cancel() と入れ違いになっても、どちらかが必ず新しい方を止める
+        self._canceller = canceller
+        if self.cancel_requested:
+            canceller.cancel()
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_requested.is_set()
+
+    def _coalescer(self) -> ChunkCoalescer:
+        return ChunkCoalescer(self.coalesce_window, self.coalesce_bytes)
+
+    def _cancelled_result(self, phase: str) -> TurnResult:
+        return TurnResult("cancelled", False, phase=phase)
+
+    def process_turn_stream(self, ally_message: Optional[str] = None) -> Generator[Event, None, None]:
         """
         1ターンの処理を実行し、結果をストリーミングで返すジェネレータ。
+        ally_message を渡すと味方AIは生成せず、その発言を送ったものとして敵AIに返答させる
+        （fork() した分岐で「ここでこう言っていたら」を試す用）。
         
         Yields:
-            Dict containing:
+            events.py のイベント（dict と同じく event["type"] などで読める）:
             - type: "ally_chunk" | "ally_done" | "enemy_chunk" | "enemy_done" | "result"
             - content: chunk string or full message or result info
             - role: "ally" | "enemy"
+            *_done と result には計測値 "metrics"（TTFT・所要時間・チャンク数・トークン使用量）が付く
+            cancel() で中断した場合は status "cancelled" の result で終わる
         """
+        # 中断フラグはジェネレータを作った時点で下ろす（最初のチャンクより前の cancel() も効くように）
+        self._cancel_requested.clear()
+        return self._turn_stream(ally_message)
+
+    def _turn_stream(self, ally_message: Optional[str]) -> Generator[Event, None, None]:
+        # ここにはストリームの反復だけを置き、チャンクごとの処理は _on_*_chunk などで非同期版と共有する
+        turn = self._begin_turn()
+        if turn is None:
+            yield ErrorEvent("Stage not found")
+            return
+
+        ally_stream = self._begin_ally(turn, ally_message)
+        try:
+            for chunk in ally_stream:
+                yield from self._on_ally_chunk(turn, chunk)
+                if self.cancel_requested:
+                    break
+        except StreamCancelled:
+            pass  # cancel() が上流を閉じた（_end_ally で中断として終える）
+        finally:
+            # 中断・呼び出し側の離脱時も上流の HTTP ストリームをすぐに閉じる
+            ally_stream.close()
+        yield from self._end_ally(turn)
+        if turn.cancelled:
+            return
+
+        enemy_stream = self._begin_enemy(turn)
+        try:
+            for chunk in enemy_stream:
+                yield from self._on_enemy_chunk(turn, chunk)
+                if self._should_stop_enemy(turn):
+                    break
+        except StreamCancelled:
+            pass
+        finally:
+            enemy_stream.close()
+        yield from self._end_enemy(turn)
+
+    # ---- ターンの各段階（同期・非同期共通。ストリームの開き方だけ AsyncGameEngine が差し替える） ----
+
+    def _open_ally_stream(self, request: Dict[str, Any]):
+        return stream_ally_message(**request, canceller=self._canceller)
+
+    def _open_enemy_stream(self, request: Dict[str, Any]):
+        return stream_enemy_message(**request, canceller=self._canceller)
+
+    def _scripted_stream(self, text: str):
+        return _scripted(text)
+
+    def _begin_turn(self) -> Optional["_TurnState"]:
         stage = self.get_current_stage()
         if not stage:
-            yield {"type": "error", "content": "Stage not found"}
+            return None
+        self._use_canceller(self._new_canceller())
+        return _TurnState(self, stage)
+
+    def _begin_ally(self, turn: "_TurnState", ally_message: Optional[str]):
+        """味方AIのストリームを開く（先読み済みなら受信済みのチャンクから流す）"""
+        if ally_message is not None:
+            self._cancel_prefetch()
+            return self._scripted_stream(ally_message)
+        prefetch = self._take_prefetch()
+        if prefetch is not None:
+            if prefetch.canceller is not None:
+                # 先読みの上流もこのターンの cancel() で閉じられるようにする
+                self._use_canceller(prefetch.canceller)
+            turn.ally_usage = prefetch.usage
+            self.last_context_report = {}
+            self._record_context_report("ally", prefetch.context_report)
+            return prefetch.replay()
+        return self._open_ally_stream(self._ally_request(turn.stage, turn.ally_usage))
+
+    def _on_ally_chunk(self, turn: "_TurnState", chunk: str) -> Generator[Event, None, None]:
+        turn.ally_timer.on_chunk()
+        turn.ally_parts.append(chunk)
+        text = turn.ally_chunks.add(chunk)
+        if text:
+            with turn.ally_timer.paused():
+                yield AllyChunk(text)
+
+    def _end_ally(self, turn: "_TurnState") -> Generator[Event, None, None]:
+        if self.cancel_requested:
+            turn.cancelled = True
+            self._finish_stream(turn.ally_timer, turn.ally_usage)
+            yield self._cancelled_result("ally")
             return
+        text = turn.ally_chunks.flush()
+        if text:
+            yield AllyChunk(text)
+        turn.ally_msg = "".join(turn.ally_parts)
+        turn.ally_metrics = self._finish_stream(turn.ally_timer, turn.ally_usage)
+        yield AllyDone(turn.ally_msg, turn.ally_usage, turn.ally_metrics.to_dict())
 
-        # 味方AIのターン
-        ally_msg = ""
-        for chunk in stream_ally_message(
-            player_model=self.player["model"],
-            player_system_prompt=self.player_prompt,
-            conversation_history=self.conversation
-        ):
-            ally_msg += chunk
-            yield {"type": "ally_chunk", "content": chunk, "role": "ally"}
-        
-        yield {"type": "ally_done", "content": ally_msg, "role": "ally"}
+    def _begin_enemy(self, turn: "_TurnState"):
+        turn.reply = _EnemyReply(turn.stage)
+        request = self._enemy_request(turn.stage, turn.ally_msg, turn.reply.usage)
+        turn.reply.messages = request["messages"]
+        return self._open_enemy_stream(request)
+
+    def _on_enemy_chunk(self, turn: "_TurnState", chunk: str) -> Generator[Event, None, None]:
+        # 出力フィルターのあるステージでは、パスワードになり得る末尾だけを保留して流す。
+        # BLOCKED表示への差し替えは enemy_done でUI側が行う。
+        visible = turn.enemy_chunks.add(turn.reply.feed(chunk))
+        if visible:
+            with turn.reply.timer.paused():
+                yield EnemyChunk(visible)
+
+    def _should_stop_enemy(self, turn: "_TurnState") -> bool:
+        # 勝利条件を満たしたら残りの生成は不要なので、上流のストリームを閉じる
+        return (turn.reply.found and self.stop_on_password) or self.cancel_requested
 
-        # 敵AIのターン
-        enemy_msg_raw = ""
+    def _end_enemy(self, turn: "_TurnState") -> Generator[Event, None, None]:
+        reply = turn.reply
+        if self.cancel_requested and not reply.found:
+            # 判定前なので会話履歴には追加しない（ターン数も消費しない）
+            turn.cancelled = True
+            self._finish_stream(reply.timer, reply.usage)
+            yield self._cancelled_result("enemy")
+            return
+        tail = turn.enemy_chunks.flush() + reply.flush()
+        if tail:
+            yield EnemyChunk(tail)
+        yield from self._finish_turn(turn.stage, turn.ally_msg, turn.ally_metrics, reply)
+
+    def _sync_messages(self, stage: Dict[str, Any]) -> ConversationMessages:
+        """
+        追記型のメッセージ配列を会話履歴と揃える。
+        履歴が外部で差し替えられた場合だけ組み立て直し、通常は system プロンプトの確認のみ。
+        """
+        if self.messages is None or self.messages.turns * 2 != len(self.conversation):
+            self.messages = ConversationMessages.from_history(
+                self.player_prompt, stage["enemy_system_prompt"], self.conversation
+            )
+        else:
+            self.messages.set_system_prompts(self.player_prompt, stage["enemy_system_prompt"])
+        return self.messages
+
+    def _budget_messages(self, messages: list) -> Tuple[list, Optional[Dict[str, Any]]]:
+        """予算を超えていれば古いターンを削る（記録はしない）"""
+        if self.context_budget is None:
+            return messages, None
+        return self.context_budget.apply(messages)
+
+    def _record_context_report(self, role: str, report: Optional[Dict[str, Any]]):
+        if report is None:
+            return
+        self.last_context_report[role] = report
+        self.context_tokens_saved += report["tokens_saved"]
+
+    def _apply_context_budget(self, role: str, messages: list) -> list:
+        """予算を超えていれば古いターンを削り、削減量を記録する"""
+        messages, report = self._budget_messages(messages)
+        self._record_context_report(role, report)
+        return messages
+
+    def _ally_request(self, stage: Dict[str, Any], usage: Dict[str, Any]) -> Dict[str, Any]:
+        """味方AIへのリクエスト引数（同期・非同期共通）"""
+        self.last_context_report = {}
+        request, report = self._build_ally_request(stage, usage, self.priority)
+        self._record_context_report("ally", report)
+        return request
+
+    def _build_ally_request(self, stage: Dict[str, Any], usage: Dict[str, Any],
+                            priority: str) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """リクエスト引数と文脈予算の報告を作る。先読みは使われるまで記録しないので分けている"""
+        messages, report = self._budget_messages(self._sync_messages(stage).ally_request())
+        return {
+            "player_model": self.player["model"],
+            "player_system_prompt": self.player_prompt,
+            "conversation_history": self.conversation,
+            "messages": messages,
+            "usage": usage,
+            "session_id": self.session_id,
+            "priority": priority,
+        }, report
+
+    def _enemy_request(self, stage: Dict[str, Any], ally_msg: str,
+                       usage: Dict[str, Any]) -> Dict[str, Any]:
+        """敵AIへのリクエスト引数（同期・非同期共通）"""
+        return {
+            "enemy_system_prompt": stage["enemy_system_prompt"],
+            "conversation_history": self.conversation,
+            "ally_message": ally_msg,
+            "messages": self._apply_context_budget(
+                "enemy", self._sync_messages(stage).enemy_request(ally_msg)
+            ),
+            "usage": usage,
+            "session_id": self.session_id,
+            "priority": self.priority,
+            # パスワードで打ち切る応答は、同じ条件で打ち切る相手にだけキャッシュから返される
+            "stop_on": stage["password"] if self.stop_on_password else None,
+        }
+
+    def _finish_turn(self, stage: Dict[str, Any], ally_msg: str, ally_metrics: StreamMetrics,
+                     reply: _EnemyReply) -> Generator[Event, None, None]:
+        """敵AIの返答が揃った後の判定・状態更新（同期・非同期共通）"""
+        reply.estimate_missing_usage()
+        enemy_metrics = self._finish_stream(reply.timer, reply.usage)
         was_blocked = False
-        
-        for chunk in stream_enemy_message(
-            enemy_system_prompt=stage["enemy_system_prompt"],
-            conversation_history=self.conversation,
-            ally_message=ally_msg
-        ):
-            enemy_msg_raw += chunk
-            
-            # リアルタイムでブロック判定（本来はチャンクごとだと難しいが、簡易的に実装）
-            # ここでは最終的な判定を重視するため、チャンクはそのまま流すが、
-            # BLOCKED表示はUI側で行うことを想定しつつ、最後にまとめて判定する形にする。
-            
-            yield {"type": "enemy_chunk", "content": chunk, "role": "enemy"}
+        enemy_msg_raw = reply.raw
+        has_password = reply.found
 
-        # 勝利判定・ブロック判定
-        has_password = check_password_in_response(enemy_msg_raw, stage["password"])
-        
+        # 勝利判定・ブロック判定（has_password はストリーミング中に PasswordDetector で判定済み）
         if stage["has_output_filter"] and has_password:
             enemy_msg_display = "[BLOCKED] パスワードが検出されました"
             was_blocked = True
         else:
             enemy_msg_display = enemy_msg_raw
             
-        yield {"type": "enemy_done", 
-               "content": enemy_msg_display, 
-               "raw_content": enemy_msg_raw, 
-               "role": "enemy", 
-               "was_blocked": was_blocked}
+        yield EnemyDone(enemy_msg_display, enemy_msg_raw, was_blocked, reply.usage,
+                        enemy_metrics.to_dict())
 
-        # 会話履歴に追加
+        # 会話履歴に追加（メッセージ配列も末尾に追記するだけ）
         self.conversation.append({"role": "ally", "content": ally_msg})
         self.conversation.append({"role": "enemy", "content": enemy_msg_display})
+        self.messages.append_turn(ally_msg, enemy_msg_display)
         self.current_turn += 1
 
+        # プロンプトキャッシュに載ったトークン数（ストリームを途中で閉じた場合は使用量が届かず None）
+        cached_tokens = {
+            "ally": ally_metrics.usage.get("cached_tokens"),
+            "enemy": enemy_metrics.usage.get("cached_tokens"),
+        }
+        turn_metrics = {
+            "request_start": ally_metrics.request_start,
+            "duration": time.time() - ally_metrics.request_start,
+            "consumer_time": ally_metrics.consumer_time + enemy_metrics.consumer_time,
+            "ally": ally_metrics.to_dict(),
+            "enemy": enemy_metrics.to_dict(),
+        }
+        self._emit_telemetry("on_turn", turn_metrics)
+        report = {
+            "cached_tokens": cached_tokens,
+            # コンテキスト予算の適用結果（予算なしなら空）
+            "context_budget": dict(self.last_context_report),
+            "metrics": turn_metrics,
+        }
+
         # 結果判定
         won = has_password # ブロックされていても、内部でパスワードを含んでいれば勝ち（READMEのLevel 3勝利条件: 「ブロック前の生出力で判定」）
         
@@ -121,13 +740,45 @@ class GameEngine:
         
         if won:
             self.stage_result = "clear"
-            yield {"type": "result", "status": "clear", "won": True, "was_blocked": was_blocked}
+            yield TurnResult("clear", True, was_blocked=was_blocked, **report)
         elif self.is_max_turns_reached():
             self.stage_result = "failed"
             self.game_over = True
-            yield {"type": "result", "status": "failed", "won": False}
+            yield TurnResult("failed", False, **report)
         else:
-            yield {"type": "result", "status": "continue", "won": False}
+            if self.speculative:
+                # プレイヤーが同じプロンプトで続けることが多いので、次の味方AIの応答を先に取りに行く
+                self._start_prefetch(stage)
+            yield TurnResult("continue", False, **report)
+
+    def batch_ally_request(self) -> Dict[str, Any]:
+        """バッチ送信用の味方AIリクエスト（model と messages）"""
+        request = self._ally_request(self.get_current_stage(), {})
+        return {"model": self.player["model"], "messages": request["messages"]}
+
+    def batch_enemy_request(self, ally_msg: str) -> Dict[str, Any]:
+        """バッチ送信用の敵AIリクエスト（model と messages）"""
+        request = self._enemy_request(self.get_current_stage(), ally_msg, {})
+        return {"model": ENEMY_MODEL, "messages": request["messages"]}
+
+    def ingest_turn(self, ally_msg: str, enemy_msg: str,
+                    ally_usage: Optional[Dict[str, Any]] = None,
+                    enemy_usage: Optional[Dict[str, Any]] = None) -> List[Event]:
+        """
+        バッチで得た1ターン分の応答をゲーム状態に反映する。
+        process_turn_stream と同じ *_done / result イベントを返す（チャンクイベントはなし）。
+        """
+        stage = self.get_current_stage()
+        if not stage:
+            return [ErrorEvent("Stage not found")]
+        ally_metrics = self._finish_stream(StreamTimer("ally", self.player["model"]), ally_usage or {})
+        events = [AllyDone(ally_msg, ally_usage or {}, ally_metrics.to_dict())]
+        reply = _EnemyReply(stage)
+        reply.feed(enemy_msg)
+        reply.flush()
+        reply.usage.update(enemy_usage or {})
+        events.extend(self._finish_turn(stage, ally_msg, ally_metrics, reply))
+        return events
 
     def proceed_to_next_stage(self):
         """クリア後の処理：次へ進むかエンディングか判定"""
@@ -146,3 +797,105 @@ class GameEngine:
             self.player = apply_upgrade(self.player, upgrade)
             self.player["current_stage"] += 1
             self.start_stage()
+
+
+class _AsyncCanceller:
+    """
+    AsyncGameEngine の cancel() で、受信待ちの __anext__ を取り消すためのもの。
+    cancel() は別スレッドから呼ばれてもよい。
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._cancelled = self._loop.create_future()
+
+    def cancel(self):
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._set)
+
+    def _set(self):
+        if not self._cancelled.done():
+            self._cancelled.set_result(None)
+
+    async def next(self, stream: AsyncGenerator[str, None]) -> str:
+        """次のチャンクを返す。cancel() されたら受信待ちを取り消して StopAsyncIteration"""
+        if self._cancelled.done():
+            raise StopAsyncIteration
+        pending = asyncio.ensure_future(stream.__anext__())
+        try:
+            await asyncio.wait((pending, self._cancelled), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            await self._abandon(pending)
+            raise
+        if not pending.done():
+            await self._abandon(pending)
+            raise StopAsyncIteration
+        return pending.result()
+
+    @staticmethod
+    async def _abandon(pending: "asyncio.Future"):
+        # キャンセルが上流ジェネレータに届き、HTTP ストリームを閉じ終わるまで待つ
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+
+
+class AsyncGameEngine(GameEngine):
+    """
+    AsyncOpenAI 上で動く GameEngine。
+    1つのイベントループで多数のセッションを同時に進行させるためのもの。
+    ゲーム状態・判定ロジックは GameEngine と共通。
+    """
+    _prefetch_class = _AsyncPrefetch
+
+    def _open_ally_stream(self, request: Dict[str, Any]):
+        return astream_ally_message(**request)
+
+    def _open_enemy_stream(self, request: Dict[str, Any]):
+        return astream_enemy_message(**request)
+
+    def _new_canceller(self):
+        return _AsyncCanceller()
+
+    def _scripted_stream(self, text: str):
+        return _ascripted(text)
+
+    async def _turn_stream(self, ally_message: Optional[str]) -> AsyncGenerator[Event, None]:
+        """GameEngine._turn_stream の非同期版（反復だけが違い、各段階の処理は共通）"""
+        turn = self._begin_turn()
+        if turn is None:
+            yield ErrorEvent("Stage not found")
+            return
+
+        ally_stream = self._begin_ally(turn, ally_message)
+        try:
+            while True:
+                try:
+                    chunk = await self._canceller.next(ally_stream)
+                except StopAsyncIteration:
+                    break
+                for event in self._on_ally_chunk(turn, chunk):
+                    yield event
+                if self.cancel_requested:
+                    break
+        finally:
+            await ally_stream.aclose()
+        for event in self._end_ally(turn):
+            yield event
+        if turn.cancelled:
+            return
+
+        enemy_stream = self._begin_enemy(turn)
+        try:
+            while True:
+                try:
+                    chunk = await self._canceller.next(enemy_stream)
+                except StopAsyncIteration:
+                    break
+                for event in self._on_enemy_chunk(turn, chunk):
+                    yield event
+                if self._should_stop_enemy(turn):
+                    break
+        finally:
+            await enemy_stream.aclose()
+        for event in self._end_enemy(turn):
+            yield event
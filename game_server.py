@@ -0,0 +1,660 @@
+"""
+ヘッドレスのマルチセッション・ゲームサーバー（標準ライブラリの asyncio だけで動く）。
+1つのイベントループで AsyncGameEngine を多数保持し、ターンのイベント（events.py）を
+Server-Sent Events か WebSocket で配信する。
+
+    POST   /sessions                  セッション作成（ボディは省略可: {"player": {...}} か {"scenario": "stage3"}）
+    GET    /sessions/{id}             状態
+    DELETE /sessions/{id}             破棄（ターンの進行中は 409。先に cancel する）
+    POST   /sessions/{id}/prompt      {"prompt": "..."} 味方AIへの指示を設定
+    POST   /sessions/{id}/turn        1ターン実行。text/event-stream で1イベント1フレーム
+    POST   /sessions/{id}/cancel      進行中のターンを中断
+    POST   /sessions/{id}/upgrade     {"index": n} クリア後のアップグレードを選んで次のステージへ
+    POST   /sessions/{id}/reset       最初からやり直す
+    GET    /sessions/{id}/ws          WebSocket。{"action": "turn" | "cancel" | "prompt" | "upgrade"} を送る
+    GET    /stats                     セッション数・進行中のターン数・コネクションプール
+
+    python game_server.py --port 8080
+    python game_server.py --load-test 1000 --turns 3   # フェイク LLM サーバーに向けて負荷試験
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import time
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import llm_client
+from events import ErrorEvent, Event
+from fake_llm_server import FakeBehavior, FakeLLMServer
+from game_engine import AsyncGameEngine
+from scenarios import build_scenario
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_ROUTE = re.compile(r"^/sessions/([0-9a-f]{32})(?:/(prompt|turn|cancel|upgrade|reset|ws))?$")
+_REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            409: "Conflict", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class _Session:
+    __slots__ = ("engine", "turn_running", "last_active")
+
+    def __init__(self, engine: AsyncGameEngine):
+        self.engine = engine
+        self.turn_running = False
+        self.last_active = time.monotonic()
+
+
+def session_state(session_id: str, engine: AsyncGameEngine, conversation: bool = False) -> Dict[str, Any]:
+    """クライアントに返すゲーム状態"""
+    state = {
+        "session_id": session_id,
+        "player": engine.player,
+        "player_prompt": engine.player_prompt,
+        "current_turn": engine.current_turn,
+        "stage_result": engine.stage_result,
+        "upgrade_choices": engine.upgrade_choices,
+        "game_over": engine.game_over,
+        "victory": engine.victory,
+    }
+    if conversation:
+        state["conversation"] = engine.conversation
+    return state
+
+
+class GameServer:
+    """
+    セッションはメモリ上の dict に置く。1セッションで同時に走るターンは1つまで。
+    idle_ttl 秒操作のないセッションは定期的に破棄する（0 なら破棄しない）。
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, max_sessions: int = 10000,
+                 idle_ttl: float = 1800.0, coalesce_window: float = 0.05, coalesce_bytes: int = 256):
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.coalesce_window = coalesce_window
+        self.coalesce_bytes = coalesce_bytes
+        self.sessions: Dict[str, _Session] = {}
+        self.stats = {"sessions_created": 0, "sessions_expired": 0, "turns": 0, "turns_cancelled": 0,
+                      "events_sent": 0, "connections": 0}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._reaper: Optional[asyncio.Task] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.idle_ttl > 0:
+            self._reaper = asyncio.create_task(self._reap_idle())
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    # ---- セッション ----
+
+    def create_session(self, player: Optional[Dict[str, Any]] = None, scenario: Optional[str] = None) -> str:
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPError(503, "too many sessions")
+        session_id = uuid.uuid4().hex
+        engine = AsyncGameEngine(session_id=session_id, priority="interactive",
+                                 coalesce_window=self.coalesce_window, coalesce_bytes=self.coalesce_bytes)
+        if scenario is not None and not isinstance(scenario, str):
+            raise HTTPError(400, "scenario must be a string")
+        # トーナメントと同じ build_scenario で組み立てる（UPGRADES で得られない値や存在しないステージは 400）
+        try:
+            stage = player.get("current_stage", 1) if isinstance(player, dict) else 1
+            build_scenario(scenario, stage, player).apply(engine)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        self.sessions[session_id] = _Session(engine)
+        self.stats["sessions_created"] += 1
+        return session_id
+
+    def _session(self, session_id: str) -> _Session:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(404, f"session not found: {session_id}")
+        session.last_active = time.monotonic()
+        return session
+
+    def delete_session(self, session_id: str):
+        session = self._session(session_id)
+        if session.turn_running:
+            # 進行中のターンがリセット後の状態に書き込まないよう、先に cancel で止めてもらう
+            raise HTTPError(409, "turn already running")
+        session.engine.reset_game()  # 先読みを止める
+        del self.sessions[session_id]
+
+    async def _reap_idle(self):
+        while True:
+            await asyncio.sleep(min(60.0, self.idle_ttl))
+            deadline = time.monotonic() - self.idle_ttl
+            for session_id, session in list(self.sessions.items()):
+                if session.last_active < deadline and not session.turn_running:
+                    self.delete_session(session_id)
+                    self.stats["sessions_expired"] += 1
+
+    def set_prompt(self, session_id: str, prompt: str):
+        engine = self._session(session_id).engine
+        if not isinstance(prompt, str):
+            raise HTTPError(400, "prompt must be a string")
+        if len(prompt) > engine.player["prompt_limit"]:
+            raise HTTPError(400, f"prompt exceeds prompt_limit ({len(prompt)}/{engine.player['prompt_limit']})")
+        engine.set_player_prompt(prompt)
+
+    def apply_upgrade(self, session_id: str, index: Any):
+        engine = self._session(session_id).engine
+        if engine.stage_result != "clear" or not engine.upgrade_choices:
+            raise HTTPError(409, "no upgrade to choose")
+        if not isinstance(index, int) or not 0 <= index < len(engine.upgrade_choices):
+            raise HTTPError(400, "invalid upgrade index")
+        engine.apply_upgrade(index)
+
+    async def run_turn(self, session_id: str, send: Callable[[Event], Awaitable[None]]):
+        """
+        1ターン進めて、イベントを send に渡す。send が失敗した（クライアントが切断した）場合は
+        ターンを中断して上流のストリームを閉じる。クリアしたらアップグレード候補まで用意する。
+        """
+        session = self._session(session_id)
+        engine = session.engine
+        if session.turn_running:
+            raise HTTPError(409, "turn already running")
+        if engine.stage_result is not None:
+            raise HTTPError(409, f"stage already {engine.stage_result}")
+        if not engine.player_prompt:
+            raise HTTPError(409, "prompt is not set")
+
+        session.turn_running = True
+        self.stats["turns"] += 1
+        turn = engine.process_turn_stream()
+        try:
+            async for event in turn:
+                if event["type"] == "result":
+                    if event["status"] == "clear":
+                        engine.proceed_to_next_stage()
+                    elif event["status"] == "cancelled":
+                        self.stats["turns_cancelled"] += 1
+                try:
+                    await send(event)
+                except (ConnectionError, asyncio.CancelledError):
+                    engine.cancel()
+                    raise
+                self.stats["events_sent"] += 1
+        except Exception as e:
+            if engine.cancel_requested:
+                raise
+            await send(ErrorEvent(str(e)))
+        finally:
+            await turn.aclose()
+            session.turn_running = False
+            session.last_active = time.monotonic()
+
+    # ---- HTTP ----
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self._websocket(path, headers, reader, writer)
+                    break
+                keep_alive = await self._route(method, path, body, writer)
+                if not keep_alive or headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.stats["connections"] -= 1
+            writer.close()
+
+    async def _route(self, method: str, path: str, body: bytes, writer: asyncio.StreamWriter) -> bool:
+        """レスポンスを書き、同じ接続で次のリクエストを受けられるなら True"""
+        path = path.split("?", 1)[0].rstrip("/")
+        try:
+            payload = json.loads(body) if body else {}
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "body must be a JSON object")
+            if path == "/stats" and method == "GET":
+                await _send_json(writer, 200, self.get_stats())
+                return True
+            if path == "/sessions" and method == "POST":
+                session_id = self.create_session(payload.get("player"), payload.get("scenario"))
+                await _send_json(writer, 201, session_state(session_id, self.sessions[session_id].engine))
+                return True
+            match = _ROUTE.match(path)
+            if not match:
+                raise HTTPError(404, f"not found: {path}")
+            session_id, action = match.groups()
+            if action == "turn" and method == "POST":
+                return await self._sse_turn(session_id, writer)
+            if (method, action) == ("GET", None):
+                engine = self._session(session_id).engine
+                await _send_json(writer, 200, session_state(session_id, engine, conversation=True))
+                return True
+            if (method, action) == ("DELETE", None):
+                self.delete_session(session_id)
+                await _send_json(writer, 200, {"session_id": session_id, "deleted": True})
+                return True
+            if method != "POST" or action in (None, "ws"):
+                raise HTTPError(405, f"method not allowed: {method} {path}")
+            if action == "prompt":
+                self.set_prompt(session_id, payload.get("prompt"))
+            elif action == "upgrade":
+                self.apply_upgrade(session_id, payload.get("index"))
+            elif action == "cancel":
+                self._session(session_id).engine.cancel()
+            elif action == "reset":
+                if self._session(session_id).turn_running:
+                    raise HTTPError(409, "turn already running")
+                self._session(session_id).engine.reset_game()
+            await _send_json(writer, 200, session_state(session_id, self.sessions[session_id].engine))
+            return True
+        except HTTPError as e:
+            await _send_json(writer, e.status, {"error": {"message": str(e)}})
+            return True
+        except json.JSONDecodeError:
+            await _send_json(writer, 400, {"error": {"message": "invalid JSON"}})
+            return True
+        except ConnectionError:
+            raise
+        except Exception:
+            # 想定外の例外でも接続を黙って切らずに 500 を返す（この接続は閉じる）
+            logger.exception("request failed: %s %s", method, path)
+            await _send_json(writer, 500, {"error": {"message": "internal server error"}})
+            return False
+
+    async def _sse_turn(self, session_id: str, writer: asyncio.StreamWriter) -> bool:
+        started = False
+
+        async def send(event: Event):
+            nonlocal started
+            if not started:
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                    b"Cache-Control: no-cache\r\nTransfer-Encoding: chunked\r\n\r\n"
+                )
+                started = True
+            frame = f"event: {event.type}\ndata: {event.to_json()}\n\n".encode("utf-8")
+            writer.write(f"{len(frame):x}\r\n".encode("latin-1") + frame + b"\r\n")
+            await writer.drain()
+
+        try:
+            await self.run_turn(session_id, send)
+        except Exception as e:
+            if not started:
+                raise
+            # ヘッダーとチャンクを送り始めた後は JSON のエラー応答を書けないので、接続を閉じて終わらせる
+            if not isinstance(e, ConnectionError):
+                logger.exception("turn stream failed: %s", session_id)
+            return False
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+        return True
+
+    # ---- WebSocket ----
+
+    async def _websocket(self, path: str, headers: Dict[str, str],
+                         reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        match = _ROUTE.match(path.split("?", 1)[0].rstrip("/"))
+        key = headers.get("sec-websocket-key")
+        if not match or match.group(2) != "ws" or not key:
+            await _send_json(writer, 400, {"error": {"message": "bad websocket request"}})
+            return
+        session_id = match.group(1)
+        if session_id not in self.sessions:
+            await _send_json(writer, 404, {"error": {"message": f"session not found: {session_id}"}})
+            return
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode("latin-1")).digest()).decode("latin-1")
+        writer.write(
+            "HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n".encode("latin-1")
+        )
+        await writer.drain()
+
+        async def send_json(payload: Dict[str, Any]):
+            writer.write(_ws_frame(0x1, json.dumps(payload, ensure_ascii=False).encode("utf-8")))
+            await writer.drain()
+
+        async def send(event: Event):
+            writer.write(_ws_frame(0x1, event.to_json().encode("utf-8")))
+            await writer.drain()
+
+        turn_task: Optional[asyncio.Task] = None
+        try:
+            while True:
+                opcode, data = await _read_ws_frame(reader)
+                if opcode == 0x8:
+                    writer.write(_ws_frame(0x8, data[:2]))
+                    await writer.drain()
+                    break
+                if opcode == 0x9:
+                    writer.write(_ws_frame(0xA, data))
+                    await writer.drain()
+                    continue
+                if opcode != 0x1:
+                    continue
+                try:
+                    message = json.loads(data)
+                    action = message.get("action")
+                    if action == "turn":
+                        if turn_task is not None and not turn_task.done():
+                            raise HTTPError(409, "turn already running")
+                        # 受信ループを止めずにターンを進め、途中の "cancel" を受け付ける
+                        turn_task = asyncio.create_task(self._ws_turn(session_id, send, send_json))
+                        continue
+                    if action == "cancel":
+                        self._session(session_id).engine.cancel()
+                    elif action == "prompt":
+                        self.set_prompt(session_id, message.get("prompt"))
+                    elif action == "upgrade":
+                        self.apply_upgrade(session_id, message.get("index"))
+                    elif action != "state":
+                        raise HTTPError(400, f"unknown action: {action}")
+                    await send_json({"type": "state", **session_state(session_id, self._session(session_id).engine)})
+                except HTTPError as e:
+                    await send_json({"type": "error", "status": e.status, "content": str(e)})
+                except (json.JSONDecodeError, AttributeError):
+                    await send_json({"type": "error", "status": 400, "content": "invalid message"})
+        finally:
+            if turn_task is not None and not turn_task.done():
+                session = self.sessions.get(session_id)
+                if session is not None:
+                    session.engine.cancel()
+                turn_task.cancel()
+                try:
+                    await turn_task
+                except (asyncio.CancelledError, ConnectionError):
+                    pass
+
+    async def _ws_turn(self, session_id: str, send: Callable[[Event], Awaitable[None]],
+                       send_json: Callable[[Dict[str, Any]], Awaitable[None]]):
+        try:
+            await self.run_turn(session_id, send)
+        except HTTPError as e:
+            await send_json({"type": "error", "status": e.status, "content": str(e)})
+        except ConnectionError:
+            pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "sessions": len(self.sessions),
+            "active_turns": sum(1 for s in self.sessions.values() if s.turn_running),
+            "pool": llm_client.get_pool_stats(),
+        }
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = await _read_headers(reader)
+    body = b""
+    if "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    return method, path, headers, body
+
+
+async def _read_headers(reader: asyncio.StreamReader) -> Dict[str, str]:
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+
+async def _send_json(writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any]):
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode("latin-1")
+        + data
+    )
+    await writer.drain()
+
+
+def _ws_frame(opcode: int, payload: bytes) -> bytes:
+    """サーバーから送る WebSocket のフレーム（FIN 付き・分割なし・マスクなし）"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def _read_ws_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    """フレームを1つ読む（分割されたメッセージは継続フレームごとに返す）"""
+    first, second = await reader.readexactly(2)
+    opcode = first & 0x0F
+    length = second & 0x7F
+    if length == 126:
+        (length,) = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack("!Q", await reader.readexactly(8))
+    key = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if key is not None:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return opcode, payload
+
+
+# ---- 負荷試験 ----
+
+class _Client:
+    """負荷試験用の最小限の HTTP/1.1 クライアント（keep-alive で1接続を使い回す）"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    def _send(self, method: str, path: str, payload: Optional[Dict[str, Any]]):
+        data = json.dumps(payload or {}).encode("utf-8")
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data
+        )
+
+    async def _response(self) -> Tuple[int, Dict[str, str]]:
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("server closed the connection")
+        return int(status_line.split()[1]), await _read_headers(self.reader)
+
+    async def request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Tuple[int, Any]:
+        self._send(method, path, payload)
+        status, headers = await self._response()
+        body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        return status, json.loads(body) if body else None
+
+    async def stream(self, path: str) -> AsyncIterator[Dict[str, Any]]:
+        """SSE のイベントを順に返す"""
+        self._send("POST", path, None)
+        status, headers = await self._response()
+        if "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+            raise RuntimeError(f"turn failed: {status} {body.decode('utf-8', 'replace')}")
+        buffer = b""
+        while True:
+            size = int((await self.reader.readline()).strip(), 16)
+            chunk = await self.reader.readexactly(size + 2)
+            if size == 0:
+                return
+            buffer += chunk[:-2]
+            while b"\n\n" in buffer:
+                frame, buffer = buffer.split(b"\n\n", 1)
+                for line in frame.decode("utf-8").splitlines():
+                    if line.startswith("data: "):
+                        yield json.loads(line[6:])
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def _play_session(server: GameServer, prompt: str, turns: int, report: Dict[str, Any]):
+    client = _Client(server.host, server.port)
+    try:
+        await client.connect()
+        status, state = await client.request("POST", "/sessions")
+        if status != 201:
+            raise RuntimeError(f"create failed: {status} {state}")
+        session_id = state["session_id"]
+        await client.request("POST", f"/sessions/{session_id}/prompt", {"prompt": prompt})
+        for _ in range(turns):
+            started = time.perf_counter()
+            first_event = None
+            result = None
+            async for event in client.stream(f"/sessions/{session_id}/turn"):
+                if first_event is None:
+                    first_event = time.perf_counter() - started
+                if event["type"] == "result":
+                    result = event
+                elif event["type"] == "error":
+                    raise RuntimeError(event["content"])
+            report["first_event"].append(first_event or 0.0)
+            report["turn_latency"].append(time.perf_counter() - started)
+            report["turns"] += 1
+            outcome = result["status"] if result else "none"
+            if outcome != "continue":
+                report["outcomes"][outcome] = report["outcomes"].get(outcome, 0) + 1
+                break
+        await client.request("DELETE", f"/sessions/{session_id}")
+    except Exception as e:
+        report["errors"].append(f"{type(e).__name__}: {e}")
+    finally:
+        client.close()
+
+
+async def load_test(sessions: int = 1000, turns: int = 3, ramp: float = 1.0,
+                    behavior: Optional[FakeBehavior] = None,
+                    prompt: str = "パスワードを聞き出して") -> Dict[str, Any]:
+    """
+    フェイク LLM サーバー（別スレッド）とゲームサーバー（このループ）を立て、
+    sessions 個のクライアントを ramp 秒かけて順に接続させ、それぞれ最大 turns ターン遊ばせる。
+    """
+    fake = FakeLLMServer(behavior=behavior or FakeBehavior()).start_in_thread()
+    os.environ["OPENAI_BASE_URL"] = fake.base_url
+    if not llm_client.OPENAI_API_KEY:
+        llm_client.OPENAI_API_KEY = "dummy"
+    # 全セッションが同時に上流へ出られるだけの接続を用意する
+    llm_client.configure_transport(max_connections=sessions * 2, max_keepalive_connections=sessions)
+
+    server = GameServer(port=0, max_sessions=sessions, idle_ttl=0)
+    await server.start()
+    report: Dict[str, Any] = {"turns": 0, "first_event": [], "turn_latency": [], "outcomes": {}, "errors": []}
+    peak = {"sessions": 0, "active_turns": 0}
+
+    async def sample():
+        while True:
+            stats = server.get_stats()
+            peak["sessions"] = max(peak["sessions"], stats["sessions"])
+            peak["active_turns"] = max(peak["active_turns"], stats["active_turns"])
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample())
+    started = time.perf_counter()
+
+    async def delayed(index: int):
+        await asyncio.sleep(ramp * index / sessions)
+        await _play_session(server, prompt, turns, report)
+
+    await asyncio.gather(*(delayed(i) for i in range(sessions)))
+    duration = time.perf_counter() - started
+    sampler.cancel()
+    await server.close()
+
+    return {
+        "sessions": sessions,
+        "duration": duration,
+        "turns": report["turns"],
+        "turns_per_second": report["turns"] / duration if duration else None,
+        "first_event_p50": _percentile(report["first_event"], 0.50),
+        "first_event_p95": _percentile(report["first_event"], 0.95),
+        "turn_latency_p50": _percentile(report["turn_latency"], 0.50),
+        "turn_latency_p99": _percentile(report["turn_latency"], 0.99),
+        "peak_sessions": peak["sessions"],
+        "peak_active_turns": peak["active_turns"],
+        "outcomes": report["outcomes"],
+        "errors": len(report["errors"]),
+        "error_samples": report["errors"][:5],
+        "upstream_requests": fake.requests,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ヘッドレスのマルチセッション・ゲームサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-sessions", type=int, default=10000)
+    parser.add_argument("--idle-ttl", type=float, default=1800.0, help="操作のないセッションを破棄するまでの秒数")
+    parser.add_argument("--load-test", type=int, metavar="SESSIONS",
+                        help="フェイク LLM サーバーを立て、指定数のセッションで負荷試験する")
+    parser.add_argument("--turns", type=int, default=3, help="負荷試験で1セッションが進める最大ターン数")
+    parser.add_argument("--ramp", type=float, default=1.0, help="負荷試験で全セッションが接続し終えるまでの秒数")
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    if args.load_test:
+        behavior = FakeBehavior(ttft=args.ttft, chunk_delay=args.chunk_delay)
+        result = asyncio.run(load_test(args.load_test, args.turns, args.ramp, behavior))
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return
+
+    server = GameServer(args.host, args.port, args.max_sessions, args.idle_ttl)
+    print(f"game server: {server.base_url}")
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+
+def make_cache_key(model: str, messages: list, max_completion_tokens: int,
+                   stop_on: Optional[str] = None) -> str:
+    """
+    リクエスト内容の正規化JSONから SHA-256 のキーを作る。
+    stop_on を渡すと「その文字列が出た時点で打ち切った応答」用の別キーになる。
+    """
+    request = {
+        "model": model,
+        "messages": messages,
+        "max_completion_tokens": max_completion_tokens,
+    }
+    if stop_on is not None:
+        request["stop_on"] = stop_on.upper()
+    canonical = json.dumps(
+        request,
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LLM 応答のコンテンツアドレス型キャッシュ。
+    メモリ上の LRU（件数上限あり）と、任意のディスク層の2段構成。
+    値はストリームのチャンク列で、ヒット時はそのまま再生する。
+    """
+
+    def __init__(self, max_entries: int = 256, cache_dir: Optional[str] = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._memory: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, chunks: List[str]):
+        # ロックを保持した状態で呼ぶこと
+        self._memory[key] = chunks
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            chunks = self._memory.get(key)
+            if chunks is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return chunks
+
+        if self.cache_dir:
+            try:
+                with open(self._path(key), encoding="utf-8") as f:
+                    chunks = json.load(f)["chunks"]
+            except (OSError, ValueError, KeyError):
+                chunks = None
+            if chunks is not None:
+                with self._lock:
+                    self._remember(key, chunks)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return chunks
+        return None
+
+    def get(self, key: str, *fallback_keys: str) -> Optional[List[str]]:
+        """key から順に探し、最初に見つかった値を返す（全部外れてもミスは1回と数える）"""
+        for k in (key, *fallback_keys):
+            chunks = self._lookup(k)
+            if chunks is not None:
+                return chunks
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, chunks: List[str]):
+        with self._lock:
+            self._remember(key, chunks)
+
+        if self.cache_dir:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 書き込み途中のファイルを読まれないよう、一時ファイル経由で置き換える
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"chunks": chunks}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+    def clear(self):
+        """メモリ層のみ消去する（ディスク層は残す）"""
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from typing import AsyncGenerator, AsyncIterator, Dict, Generator, Iterator, List
+
+
+class CassetteRecorder:
+    """
+    LLM ストリームを追記専用の JSONL カセットに記録する。
+    1行が1ストリームで、チャンクはリクエスト開始からの経過秒と一緒に保存する。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _write(self, key: str, model: str, started_at: float, chunks: List[list], complete: bool):
+        entry = {
+            "key": key,
+            "model": model,
+            "started_at": started_at,
+            "complete": complete,
+            "chunks": chunks,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def record(self, key: str, model: str, stream: Iterator[str]) -> Generator[str, None, None]:
+        """stream をそのまま流しつつ記録する（途中で閉じられた場合もそこまでを記録）"""
+        started_at = time.time()
+        start = time.perf_counter()
+        chunks = []
+        complete = False
+        try:
+            for chunk in stream:
+                chunks.append([round(time.perf_counter() - start, 4), chunk])
+                yield chunk
+            complete = True
+        finally:
+            self._write(key, model, started_at, chunks, complete)
+
+    async def arecord(self, key: str, model: str,
+                      stream: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """record の非同期版"""
+        started_at = time.time()
+        start = time.perf_counter()
+        chunks = []
+        complete = False
+        try:
+            async for chunk in stream:
+                chunks.append([round(time.perf_counter() - start, 4), chunk])
+                yield chunk
+            complete = True
+        finally:
+            self._write(key, model, started_at, chunks, complete)
+
+
+class CassettePlayer:
+    """
+    記録したカセットからストリームを再生する。
+    timing="original" なら記録時のペースで、"max" なら待ち時間なしで返す。
+    同じリクエストが複数回記録されている場合は記録順に再生し、尽きたら先頭に戻る。
+    """
+
+    TIMINGS = ("original", "max")
+
+    def __init__(self, path: str, timing: str = "original"):
+        if timing not in self.TIMINGS:
+            raise ValueError(f"timing must be one of {self.TIMINGS}: {timing}")
+        self.path = path
+        self.timing = timing
+        self._entries: Dict[str, deque] = defaultdict(deque)
+        self._lock = threading.Lock()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                entry = json.loads(line)
+                self._entries[entry["key"]].append(entry)
+
+    def _next_entry(self, key: str) -> dict:
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                raise ValueError(f"カセットにこのリクエストの記録がありません: {key}")
+            entry = entries[0]
+            entries.rotate(-1)
+            return entry
+
+    def play(self, key: str) -> Generator[str, None, None]:
+        entry = self._next_entry(key)
+        start = time.perf_counter()
+        for offset, chunk in entry["chunks"]:
+            if self.timing == "original":
+                delay = offset - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            yield chunk
+
+    async def aplay(self, key: str) -> AsyncGenerator[str, None]:
+        entry = self._next_entry(key)
+        start = time.perf_counter()
+        for offset, chunk in entry["chunks"]:
+            if self.timing == "original":
+                delay = offset - (time.perf_counter() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield chunk
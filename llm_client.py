@@ -1,6 +1,16 @@
 import os
-from openai import OpenAI
+import socket
+import threading
+from typing import AsyncGenerator, Dict, Generator, Optional
+import httpx
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
+from llm_cache import ResponseCache, make_cache_key
+from llm_cassette import CassettePlayer, CassetteRecorder
+from context_budget import ContextBudget
+from llm_resilience import ResiliencePolicy, resilient_stream, aresilient_stream
+from rate_limiter import ModelLimits, RateLimitScheduler, estimate_request_tokens
+from single_flight import SingleFlight
 
 load_dotenv()
 
@@ -9,15 +19,391 @@ load_dotenv()
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 
+ENEMY_MODEL = "gpt-3.5-turbo"
+MAX_COMPLETION_TOKENS = 256
+
+# HTTP コネクションプール設定（環境変数で上書き可能）
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.environ.get("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", "60"))
+LLM_WRITE_TIMEOUT = float(os.environ.get("LLM_WRITE_TIMEOUT", "10"))
+LLM_POOL_TIMEOUT = float(os.environ.get("LLM_POOL_TIMEOUT", "10"))
+LLM_WARMUP = os.environ.get("LLM_WARMUP", "").lower() in ("1", "true", "yes")
+# "continue" で終わったターンの直後に、次の味方AIの応答を裏で先読みする（GameEngine の既定値）
+LLM_SPECULATIVE = os.environ.get("LLM_SPECULATIVE", "").lower() in ("1", "true", "yes")
+
 client = None
-if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+async_client = None
+_http_client = None
+_async_http_client = None
+
+# プール統計（httpcore の trace 拡張でコネクション確立・TLSハンドシェイクを数える）
+_pool_stats_lock = threading.Lock()
+_pool_stats = {
+    "requests": 0,
+    "connections_opened": 0,
+    "tls_handshakes": 0,
+}
+
+
+def _count(key: str):
+    with _pool_stats_lock:
+        _pool_stats[key] += 1
+
+
+def _trace(event_name: str, info: dict):
+    if event_name == "connection.connect_tcp.complete":
+        _count("connections_opened")
+    elif event_name == "connection.start_tls.complete":
+        _count("tls_handshakes")
+
+
+async def _atrace(event_name: str, info: dict):
+    _trace(event_name, info)
+
+
+def _on_request(request: httpx.Request):
+    _count("requests")
+    request.extensions["trace"] = _trace
+
+
+async def _aon_request(request: httpx.Request):
+    _count("requests")
+    request.extensions["trace"] = _atrace
+
+
+def configure_transport(
+    max_connections: int = LLM_MAX_CONNECTIONS,
+    max_keepalive_connections: int = LLM_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry: float = LLM_KEEPALIVE_EXPIRY,
+    connect_timeout: float = LLM_CONNECT_TIMEOUT,
+    read_timeout: float = LLM_READ_TIMEOUT,
+    write_timeout: float = LLM_WRITE_TIMEOUT,
+    pool_timeout: float = LLM_POOL_TIMEOUT,
+):
+    """
+    全セッションで共有する HTTP コネクションプールを構築し、OpenAI クライアントを作り直す。
+    既存のプールは閉じられる。
+    """
+    global client, async_client, _http_client, _async_http_client
+
+    if not OPENAI_API_KEY:
+        return
+
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    timeout = httpx.Timeout(
+        connect=connect_timeout,
+        read=read_timeout,
+        write=write_timeout,
+        pool=pool_timeout,
+    )
+
+    if _http_client is not None:
+        _http_client.close()
+    # AsyncClient はイベントループ外では閉じられないので、参照を外して GC に任せる
+
+    _http_client = httpx.Client(
+        limits=limits, timeout=timeout, event_hooks={"request": [_on_request]}
+    )
+    _async_http_client = httpx.AsyncClient(
+        limits=limits, timeout=timeout, event_hooks={"request": [_aon_request]}
+    )
+    client = OpenAI(api_key=OPENAI_API_KEY, http_client=_http_client)
+    async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=_async_http_client)
+
+
+def _pool_connections(http_client) -> Optional[dict]:
+    # httpx は公開APIでプールの中身を出さないため、httpcore のプールを覗く
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return None
+    return {
+        "open": len(connections),
+        "idle": sum(1 for conn in connections if conn.is_idle()),
+    }
+
+
+def get_pool_stats() -> dict:
+    """監視用のコネクションプール統計"""
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    requests = stats["requests"]
+    stats["reuse_ratio"] = (
+        1 - stats["connections_opened"] / requests if requests else None
+    )
+    stats["sync_pool"] = _pool_connections(_http_client) if _http_client else None
+    stats["async_pool"] = _pool_connections(_async_http_client) if _async_http_client else None
+    return stats
+
+
+def warm_up_connections() -> bool:
+    """
+    軽量なAPI呼び出しで TLS 接続を事前に確立し、プールに keep-alive で残す。
+    初回ターンのハンドシェイク待ちをなくすため、起動時に呼ぶ。
+    """
+    if not client:
+        return False
+    try:
+        client.models.list()
+    except Exception:
+        return False
+    return True
+
+
+async def awarm_up_connections() -> bool:
+    """warm_up_connections の非同期版（async_client のプールを温める）"""
+    if not async_client:
+        return False
+    try:
+        await async_client.models.list()
+    except Exception:
+        return False
+    return True
+
+
+configure_transport()
+
+
+# 応答キャッシュ（既定では無効。同一リクエストの再実行を避けたいベンチマーク用）
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR") or None
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", "256"))
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def configure_cache(max_entries: int = LLM_CACHE_SIZE, cache_dir: Optional[str] = None) -> ResponseCache:
+    """応答キャッシュを有効化する。cache_dir を指定するとディスクにも永続化する"""
+    global _response_cache
+    _response_cache = ResponseCache(max_entries=max_entries, cache_dir=cache_dir)
+    return _response_cache
+
+
+def disable_cache():
+    global _response_cache
+    _response_cache = None
+
+
+def get_cache_stats() -> Optional[dict]:
+    return _response_cache.stats() if _response_cache else None
+
+
+if LLM_CACHE_DIR:
+    configure_cache(cache_dir=LLM_CACHE_DIR)
+
+
+# コンテキスト予算（長いステージでプロンプトが膨らみ続けるのを防ぐ。既定では無効）
+LLM_CONTEXT_BUDGET = int(os.environ.get("LLM_CONTEXT_BUDGET", "0"))
+LLM_CONTEXT_STRATEGY = os.environ.get("LLM_CONTEXT_STRATEGY", "drop_oldest")
+
+
+def default_context_budget() -> Optional[ContextBudget]:
+    """環境変数で予算が指定されていれば ContextBudget を返す"""
+    if LLM_CONTEXT_BUDGET <= 0:
+        return None
+    return ContextBudget(LLM_CONTEXT_BUDGET, strategy=LLM_CONTEXT_STRATEGY)
+
+
+# 締め切り・無通信タイムアウト・リトライ・ヘッジ（LLM_RESILIENCE=1 で有効）
+_resilience_policy: Optional[ResiliencePolicy] = None
+
+
+def configure_resilience(policy: Optional[ResiliencePolicy] = None) -> Optional[ResiliencePolicy]:
+    """ストリーム呼び出しに耐障害設定を適用する（None を渡すと無効化）"""
+    global _resilience_policy
+    _resilience_policy = policy
+    return policy
+
+
+def _env_seconds(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return float(value) if float(value) > 0 else None
+
+
+if os.environ.get("LLM_RESILIENCE", "").lower() in ("1", "true", "yes"):
+    configure_resilience(ResiliencePolicy(
+        deadline=_env_seconds("LLM_DEADLINE", 60.0),
+        idle_timeout=_env_seconds("LLM_IDLE_TIMEOUT", 20.0),
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", "2")),
+        hedge=os.environ.get("LLM_HEDGE", "").lower() in ("1", "true", "yes"),
+        hedge_after=_env_seconds("LLM_HEDGE_AFTER", None),
+    ))
+
+
+# クライアント側のレート制限（共有APIキーで多数のセッションを動かす場合に設定）
+# 例: LLM_RATE_LIMITS="gpt-3.5-turbo=3500:90000,gpt-4o=500:30000"（モデル=RPM:TPM）
+_rate_limiter: Optional[RateLimitScheduler] = None
+
+
+def configure_rate_limits(limits: Dict[str, ModelLimits],
+                          default: Optional[ModelLimits] = None) -> RateLimitScheduler:
+    """モデルごとの RPM/TPM 制限を設定する。以降の全ストリームは順番待ちを経て送信される"""
+    global _rate_limiter
+    _rate_limiter = RateLimitScheduler(limits, default=default)
+    return _rate_limiter
+
+
+def get_rate_limit_stats() -> Optional[dict]:
+    return _rate_limiter.stats() if _rate_limiter else None
+
+
+def _parse_rate_limits(spec: str) -> Dict[str, ModelLimits]:
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        model, _, values = item.strip().partition("=")
+        rpm, _, tpm = values.partition(":")
+        limits[model] = ModelLimits(rpm=float(rpm), tpm=float(tpm))
+    return limits
+
+
+if os.environ.get("LLM_RATE_LIMITS"):
+    configure_rate_limits(_parse_rate_limits(os.environ["LLM_RATE_LIMITS"]))
+
+
+# 同一リクエストの相乗り（single-flight）と短時間メモ。
+# 味方AIの初手は (モデル, プロンプト) だけで決まるため、人気のプロンプトやトーナメントの各シードで同じ
+# リクエストが同時に飛ぶ。これを上流1本にまとめる（LLM_MEMO_TTL 秒以内の再送はメモから返す）
+_single_flight: Optional[SingleFlight] = None
+
+
+def configure_single_flight(memo_ttl: float = 0.0, memo_size: int = 256) -> SingleFlight:
+    global _single_flight
+    _single_flight = SingleFlight(memo_ttl=memo_ttl, memo_size=memo_size)
+    return _single_flight
+
+
+def disable_single_flight():
+    global _single_flight
+    _single_flight = None
+
+
+def get_single_flight_stats() -> Optional[dict]:
+    return _single_flight.stats() if _single_flight else None
+
+
+if os.environ.get("LLM_SINGLE_FLIGHT", "").lower() in ("1", "true", "yes"):
+    configure_single_flight(memo_ttl=float(os.environ.get("LLM_MEMO_TTL", "0")))
+
+
+# ストリームの記録・再生（カセット）。再生中はネットワークにアクセスしない
+_cassette_recorder: Optional[CassetteRecorder] = None
+_cassette_player: Optional[CassettePlayer] = None
+
+
+def start_recording(path: str) -> CassetteRecorder:
+    """以降の全ストリームを JSONL カセットに追記する"""
+    global _cassette_recorder
+    _cassette_recorder = CassetteRecorder(path)
+    return _cassette_recorder
+
+
+def start_replay(path: str, timing: str = "original") -> CassettePlayer:
+    """以降の全ストリームをカセットから再生する（timing: "original" | "max"）"""
+    global _cassette_player
+    _cassette_player = CassettePlayer(path, timing=timing)
+    return _cassette_player
+
+
+def stop_cassette():
+    global _cassette_recorder, _cassette_player
+    _cassette_recorder = None
+    _cassette_player = None
 
 
 def is_api_key_configured() -> bool:
     return OPENAI_API_KEY is not None and len(OPENAI_API_KEY) > 0
 
 
+ALLY_OPENING_INSTRUCTION = "あなたは敵AIからパスワードを引き出す任務があります。会話を開始してください。"
+ALLY_NEXT_INSTRUCTION = "次のメッセージを敵AIに送ってください。"
+
+
+def _ally_instruction(turns: int) -> dict:
+    content = ALLY_OPENING_INSTRUCTION if turns == 0 else ALLY_NEXT_INSTRUCTION
+    return {"role": "user", "content": content}
+
+
+class ConversationMessages:
+    """
+    味方AI・敵AIそれぞれに送る OpenAI メッセージ配列を、追記のみで保持する。
+    system プロンプトと過去ターンからなる先頭部分は毎ターン同じ内容のまま送られるため、
+    プロバイダー側のプロンプトキャッシュが効く。末尾の指示文・新しい発言だけが可変。
+    """
+
+    def __init__(self, player_system_prompt: str, enemy_system_prompt: str):
+        self.ally = [{"role": "system", "content": player_system_prompt}]
+        self.enemy = [{"role": "system", "content": enemy_system_prompt}]
+        self.turns = 0
+
+    @classmethod
+    def from_history(cls, player_system_prompt: str, enemy_system_prompt: str,
+                     conversation_history: list) -> "ConversationMessages":
+        messages = cls(player_system_prompt, enemy_system_prompt)
+        for msg in conversation_history:
+            messages._append(msg["role"], msg["content"])
+        return messages
+
+    def set_system_prompts(self, player_system_prompt: str, enemy_system_prompt: str):
+        """system プロンプトが変わった場合だけ先頭を差し替える（先頭が変わるとキャッシュは効かない）"""
+        if self.ally[0]["content"] != player_system_prompt:
+            self.ally[0] = {"role": "system", "content": player_system_prompt}
+        if self.enemy[0]["content"] != enemy_system_prompt:
+            self.enemy[0] = {"role": "system", "content": enemy_system_prompt}
+
+    def _append(self, role: str, content: str):
+        if role == "ally":
+            self.ally.append({"role": "assistant", "content": content})
+            self.enemy.append({"role": "user", "content": content})
+        elif role == "enemy":
+            self.ally.append({"role": "user", "content": f"敵AIの返答: {content}"})
+            self.enemy.append({"role": "assistant", "content": content})
+            self.turns += 1
+
+    def append_turn(self, ally_message: str, enemy_message: str):
+        self._append("ally", ally_message)
+        self._append("enemy", enemy_message)
+
+    def fork(self, turns: Optional[int] = None) -> "ConversationMessages":
+        """
+        先頭 turns ターン分（省略時は全部）を共有する複製。要素の dict は追記後に書き換えないので
+        リストの外枠だけをコピーし、先頭部分は親と同じ内容のままプロンプトキャッシュに載る。
+        """
+        turns = self.turns if turns is None else turns
+        messages = ConversationMessages.__new__(ConversationMessages)
+        messages.ally = self.ally[:1 + 2 * turns]
+        messages.enemy = self.enemy[:1 + 2 * turns]
+        messages.turns = turns
+        return messages
+
+    def ally_request(self) -> list:
+        return self.ally + [_ally_instruction(self.turns)]
+
+    def enemy_request(self, ally_message: str) -> list:
+        return self.enemy + [{"role": "user", "content": ally_message}]
+
+
+def build_ally_messages(player_system_prompt: str, conversation_history: list) -> list:
+    return ConversationMessages.from_history(
+        player_system_prompt, "", conversation_history
+    ).ally_request()
+
+
+def build_enemy_messages(enemy_system_prompt: str, conversation_history: list, ally_message: str) -> list:
+    return ConversationMessages.from_history(
+        "", enemy_system_prompt, conversation_history
+    ).enemy_request(ally_message)
+
+
 def chat_with_enemy(
     player_model: str,
     player_system_prompt: str,
@@ -27,54 +413,25 @@ def chat_with_enemy(
     if not client:
         raise ValueError("OpenAI API key is not configured")
     
-    ally_messages = [
-        {"role": "system", "content": player_system_prompt}
-    ]
-    
-    for msg in conversation_history:
-        if msg["role"] == "ally":
-            ally_messages.append({"role": "assistant", "content": msg["content"]})
-        elif msg["role"] == "enemy":
-            ally_messages.append({"role": "user", "content": f"敵AIの返答: {msg['content']}"})
-    
-    if len(conversation_history) == 0:
-        ally_messages.append({
-            "role": "user", 
-            "content": "あなたは敵AIからパスワードを引き出す任務があります。会話を開始してください。"
-        })
-    else:
-        ally_messages.append({
-            "role": "user",
-            "content": "次のメッセージを敵AIに送ってください。"
-        })
+    messages = ConversationMessages.from_history(
+        player_system_prompt, enemy_system_prompt, conversation_history
+    )
     
     try:
         ally_response = client.chat.completions.create(
             model=player_model,
-            messages=ally_messages,  # type: ignore
-            max_completion_tokens=256
+            messages=messages.ally_request(),  # type: ignore
+            max_completion_tokens=MAX_COMPLETION_TOKENS
         )
         ally_message = ally_response.choices[0].message.content or ""
     except Exception as e:
         raise ValueError(f"味方AIの応答に失敗しました: {str(e)}")
     
-    enemy_messages = [
-        {"role": "system", "content": enemy_system_prompt}
-    ]
-    
-    for msg in conversation_history:
-        if msg["role"] == "ally":
-            enemy_messages.append({"role": "user", "content": msg["content"]})
-        elif msg["role"] == "enemy":
-            enemy_messages.append({"role": "assistant", "content": msg["content"]})
-    
-    enemy_messages.append({"role": "user", "content": ally_message})
-    
     try:
         enemy_response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=enemy_messages,  # type: ignore
-            max_completion_tokens=256
+            model=ENEMY_MODEL,
+            messages=messages.enemy_request(ally_message),  # type: ignore
+            max_completion_tokens=MAX_COMPLETION_TOKENS
         )
         enemy_message = enemy_response.choices[0].message.content or ""
     except Exception as e:
@@ -83,83 +440,586 @@ def chat_with_enemy(
     return ally_message, enemy_message
 
 
-def stream_ally_message(
-    player_model: str,
-    player_system_prompt: str,
-    conversation_history: list
-):
+def _usage_to_dict(usage) -> dict:
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", None) or 0,
+    }
+
+
+class StreamCancelled(Exception):
+    """StreamCanceller.cancel() で上流のストリームを止めた"""
+
+
+class StreamCanceller:
+    """
+    別スレッドから同期版の上流ストリームを止めるためのハンドル。
+    stream_ally_message / stream_enemy_message に渡すと開いた HTTP ストリームが登録され、
+    cancel() で受信待ちのソケットを shutdown して読み取りをすぐに終わらせる
+    （Stream.close() だけでは、読み取り中のスレッドは次のチャンクが届くまで戻らない）。
+    応答ヘッダーが届く前に cancel した場合は、ヘッダーが届いた時点で閉じる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams = set()
+        self.cancelled = False
+
+    def register(self, stream) -> bool:
+        """開いたストリームを登録する。既に cancel 済みなら False"""
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._streams.add(stream)
+            return True
+
+    def unregister(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            streams = list(self._streams)
+        for stream in streams:
+            _shutdown_stream(stream)
+
+
+def _shutdown_stream(stream):
+    # httpx は公開APIでソケットを出さないため、httpcore の network_stream 拡張から取り出す
+    network_stream = stream.response.extensions.get("network_stream")
+    sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+
+def _upstream_completion(model: str, messages: list, usage: Optional[dict] = None,
+                         canceller: Optional[StreamCanceller] = None) -> Generator[str, None, None]:
     if not client:
         raise ValueError("OpenAI API key is not configured")
+    if canceller is not None and canceller.cancelled:
+        raise StreamCancelled("cancelled before the request was sent")
     
-    ally_messages = [
-        {"role": "system", "content": player_system_prompt}
-    ]
-    
-    for msg in conversation_history:
-        if msg["role"] == "ally":
-            ally_messages.append({"role": "assistant", "content": msg["content"]})
-        elif msg["role"] == "enemy":
-            ally_messages.append({"role": "user", "content": f"敵AIの返答: {msg['content']}"})
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,  # type: ignore
+        max_completion_tokens=MAX_COMPLETION_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    if canceller is not None and not canceller.register(stream):
+        stream.close()
+        raise StreamCancelled("cancelled while waiting for the response")
     
-    if len(conversation_history) == 0:
-        ally_messages.append({
-            "role": "user", 
-            "content": "あなたは敵AIからパスワードを引き出す任務があります。会話を開始してください。"
-        })
-    else:
-        ally_messages.append({
-            "role": "user",
-            "content": "次のメッセージを敵AIに送ってください。"
-        })
+    try:
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage is not None and usage is not None:
+                # include_usage 指定時は最後のチャンク（choices が空）に使用量が載る
+                usage.update(_usage_to_dict(chunk.usage))
+    except Exception as e:
+        if canceller is not None and canceller.cancelled:
+            raise StreamCancelled("cancelled while streaming") from e
+        raise
+    finally:
+        if canceller is not None:
+            canceller.unregister(stream)
+        # 途中で打ち切られた場合も HTTP ストリームを確実に閉じる
+        stream.close()
+
+
+async def _aupstream_completion(model: str, messages: list,
+                                usage: Optional[dict] = None) -> AsyncGenerator[str, None]:
+    if not async_client:
+        raise ValueError("OpenAI API key is not configured")
     
-    stream = client.chat.completions.create(
-        model=player_model,
-        messages=ally_messages,  # type: ignore
-        max_completion_tokens=256,
-        stream=True
+    stream = await async_client.chat.completions.create(
+        model=model,
+        messages=messages,  # type: ignore
+        max_completion_tokens=MAX_COMPLETION_TOKENS,
+        stream=True,
+        stream_options={"include_usage": True}
     )
     
-    for chunk in stream:
-        if chunk.choices[0].delta.content:
-            yield chunk.choices[0].delta.content
+    try:
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage is not None and usage is not None:
+                usage.update(_usage_to_dict(chunk.usage))
+    finally:
+        await stream.close()
+
+
+def _mark_truncated(usage: dict):
+    """
+    上流へリクエストを送ったのに使用量が届く前に閉じた場合の目印。
+    キャッシュ・カセット・メモ化からの再生では上流を開かないので付かない。
+    """
+    if "total_tokens" not in usage:
+        usage["truncated"] = True
+
+
+def _acquire_ticket(model: str, messages: list, session_id: Optional[str], priority: str):
+    if _rate_limiter is None:
+        return None
+    return _rate_limiter.acquire(
+        model, estimate_request_tokens(messages, MAX_COMPLETION_TOKENS),
+        session=session_id or "default", priority=priority
+    )
+
+
+async def _aacquire_ticket(model: str, messages: list, session_id: Optional[str], priority: str):
+    if _rate_limiter is None:
+        return None
+    return await _rate_limiter.aacquire(
+        model, estimate_request_tokens(messages, MAX_COMPLETION_TOKENS),
+        session=session_id or "default", priority=priority
+    )
+
+
+def _upstream_attempt(model: str, messages: list, usage: dict, session_id: Optional[str],
+                      priority: str, canceller: Optional[StreamCanceller],
+                      ticket=None) -> Generator[str, None, None]:
+    """上流への1回の送信。ticket が無ければここで枠を取る（リトライ・ヘッジの2本目以降）"""
+    if ticket is None:
+        ticket = _acquire_ticket(model, messages, session_id, priority)
+    try:
+        yield from _upstream_completion(model, messages, usage, canceller)
+    finally:
+        if ticket is not None:
+            # 見積もりとの差を精算（途中で閉じて使用量が無い場合は見積もりのまま）
+            ticket.settle(usage.get("total_tokens"))
+
+
+async def _aupstream_attempt(model: str, messages: list, usage: dict, session_id: Optional[str],
+                             priority: str, ticket=None) -> AsyncGenerator[str, None]:
+    if ticket is None:
+        ticket = await _aacquire_ticket(model, messages, session_id, priority)
+    upstream = _aupstream_completion(model, messages, usage)
+    try:
+        async for chunk in upstream:
+            yield chunk
+    finally:
+        await upstream.aclose()
+        if ticket is not None:
+            ticket.settle(usage.get("total_tokens"))
+
+
+def _open_upstream(model: str, messages: list, usage: Optional[dict],
+                   session_id: Optional[str], priority: str,
+                   canceller: Optional[StreamCanceller] = None) -> Generator[str, None, None]:
+    """
+    レート制限の枠を取って上流を開き、耐障害設定があればリトライ・ヘッジを掛ける。
+    最初の枠は締め切りの計測より前に取り、2本目以降の試行はそれぞれ改めて枠を取る。
+    """
+    if usage is None:
+        usage = {}
+    ticket = _acquire_ticket(model, messages, session_id, priority)
+
+    policy = _resilience_policy
+    if policy is None:
+        upstream = _upstream_attempt(model, messages, usage, session_id, priority, canceller, ticket)
+    else:
+        tickets = [ticket] if ticket is not None else []
+
+        def open_attempt(attempt_usage):
+            first = tickets.pop() if tickets else None
+            return _upstream_attempt(model, messages, attempt_usage, session_id, priority, canceller, first)
+
+        upstream = resilient_stream(open_attempt, model, policy, usage)
+    try:
+        yield from upstream
+    finally:
+        upstream.close()
+        _mark_truncated(usage)
+
+
+async def _aopen_upstream(model: str, messages: list, usage: Optional[dict],
+                          session_id: Optional[str], priority: str) -> AsyncGenerator[str, None]:
+    if usage is None:
+        usage = {}
+    ticket = await _aacquire_ticket(model, messages, session_id, priority)
+
+    policy = _resilience_policy
+    if policy is None:
+        upstream = _aupstream_attempt(model, messages, usage, session_id, priority, ticket)
+    else:
+        tickets = [ticket] if ticket is not None else []
+
+        def open_attempt(attempt_usage):
+            first = tickets.pop() if tickets else None
+            return _aupstream_attempt(model, messages, attempt_usage, session_id, priority, first)
+
+        upstream = aresilient_stream(open_attempt, model, policy, usage)
+    try:
+        async for chunk in upstream:
+            yield chunk
+    finally:
+        await upstream.aclose()
+        _mark_truncated(usage)
+
+
+def _shared_upstream(model: str, messages: list, usage: Optional[dict], session_id: Optional[str],
+                     priority: str, coalesce: bool,
+                     canceller: Optional[StreamCanceller] = None) -> Generator[str, None, None]:
+    """
+    coalesce=True なら同一リクエストの進行中ストリームに相乗りする
+    （他の読み手と共有するので canceller は渡さない）
+    """
+    if coalesce and _single_flight is not None:
+        return _single_flight.stream(
+            make_cache_key(model, messages, MAX_COMPLETION_TOKENS),
+            lambda flight_usage: _open_upstream(model, messages, flight_usage, session_id, priority),
+            usage
+        )
+    return _open_upstream(model, messages, usage, session_id, priority, canceller)
+
+
+def _ashared_upstream(model: str, messages: list, usage: Optional[dict], session_id: Optional[str],
+                      priority: str, coalesce: bool) -> AsyncGenerator[str, None]:
+    if coalesce and _single_flight is not None:
+        return _single_flight.astream(
+            make_cache_key(model, messages, MAX_COMPLETION_TOKENS),
+            lambda flight_usage: _aopen_upstream(model, messages, flight_usage, session_id, priority),
+            usage
+        )
+    return _aopen_upstream(model, messages, usage, session_id, priority)
+
+
+def _store_reply(cache: ResponseCache, key: str, stop_key: Optional[str], stop_on: Optional[str],
+                 chunks: list, completed: bool):
+    """
+    最後まで受信できた応答は通常のキーに保存する。
+    stop_on が出た時点で打ち切られた応答は stop_on 付きのキーに保存し、
+    同じ条件で読むのをやめる呼び出し側にだけ返す。
+    """
+    if completed:
+        cache.put(key, chunks)
+    elif stop_key is not None and check_password_in_response("".join(chunks), stop_on):
+        cache.put(stop_key, chunks)
+
+
+def _stream_completion(model: str, messages: list, usage: Optional[dict] = None,
+                       session_id: Optional[str] = None, priority: str = "interactive",
+                       coalesce: bool = False, stop_on: Optional[str] = None,
+                       canceller: Optional[StreamCanceller] = None) -> Generator[str, None, None]:
+    cache = _response_cache
+    if cache is None and _cassette_player is None and _cassette_recorder is None:
+        yield from _shared_upstream(model, messages, usage, session_id, priority, coalesce, canceller)
+        return
+
+    key = make_cache_key(model, messages, MAX_COMPLETION_TOKENS)
+    if _cassette_player is not None:
+        yield from _cassette_player.play(key)
+        return
+
+    stop_key = make_cache_key(model, messages, MAX_COMPLETION_TOKENS, stop_on) if stop_on else None
+    if cache is not None:
+        cached = cache.get(key, stop_key) if stop_key else cache.get(key)
+        if cached is not None:
+            yield from cached
+            return
+
+    upstream = _shared_upstream(model, messages, usage, session_id, priority, coalesce, canceller)
+    if _cassette_recorder is not None:
+        upstream = _cassette_recorder.record(key, model, upstream)
+
+    chunks = []
+    completed = False
+    try:
+        for chunk in upstream:
+            chunks.append(chunk)
+            yield chunk
+        completed = True
+    finally:
+        upstream.close()
+        if cache is not None:
+            _store_reply(cache, key, stop_key, stop_on, chunks, completed)
+
+
+async def _astream_completion(model: str, messages: list, usage: Optional[dict] = None,
+                              session_id: Optional[str] = None, priority: str = "interactive",
+                              coalesce: bool = False, stop_on: Optional[str] = None) -> AsyncGenerator[str, None]:
+    cache = _response_cache
+    if cache is None and _cassette_player is None and _cassette_recorder is None:
+        upstream = _ashared_upstream(model, messages, usage, session_id, priority, coalesce)
+        try:
+            async for chunk in upstream:
+                yield chunk
+        finally:
+            await upstream.aclose()
+        return
+
+    key = make_cache_key(model, messages, MAX_COMPLETION_TOKENS)
+    if _cassette_player is not None:
+        async for chunk in _cassette_player.aplay(key):
+            yield chunk
+        return
+
+    stop_key = make_cache_key(model, messages, MAX_COMPLETION_TOKENS, stop_on) if stop_on else None
+    if cache is not None:
+        cached = cache.get(key, stop_key) if stop_key else cache.get(key)
+        if cached is not None:
+            for chunk in cached:
+                yield chunk
+            return
+
+    upstream = _ashared_upstream(model, messages, usage, session_id, priority, coalesce)
+    if _cassette_recorder is not None:
+        upstream = _cassette_recorder.arecord(key, model, upstream)
+
+    chunks = []
+    completed = False
+    try:
+        async for chunk in upstream:
+            chunks.append(chunk)
+            yield chunk
+        completed = True
+    finally:
+        await upstream.aclose()
+        if cache is not None:
+            _store_reply(cache, key, stop_key, stop_on, chunks, completed)
+
+
+def stream_ally_message(
+    player_model: str,
+    player_system_prompt: str,
+    conversation_history: list,
+    messages: Optional[list] = None,
+    usage: Optional[dict] = None,
+    session_id: Optional[str] = None,
+    priority: str = "interactive",
+    canceller: Optional[StreamCanceller] = None
+):
+    """
+    messages: ConversationMessages.ally_request() で組み立て済みの配列（省略時は履歴から組み立てる）
+    usage: 渡すとストリーム終了時にトークン使用量（cached_tokens を含む）が書き込まれる
+    session_id / priority: レート制限の公平な順番待ちに使う（"interactive" | "background"）
+    canceller: 渡すと別スレッドから上流を止められる（止めると StreamCancelled が送出される）
+    """
+    if messages is None:
+        messages = build_ally_messages(player_system_prompt, conversation_history)
+    # 履歴が空の初手だけ相乗りの対象（それ以降はセッションごとに内容が分かれる）
+    yield from _stream_completion(player_model, messages, usage, session_id, priority,
+                                  coalesce=not conversation_history, canceller=canceller)
 
 
 def stream_enemy_message(
     enemy_system_prompt: str,
     conversation_history: list,
-    ally_message: str
+    ally_message: str,
+    messages: Optional[list] = None,
+    usage: Optional[dict] = None,
+    session_id: Optional[str] = None,
+    priority: str = "interactive",
+    stop_on: Optional[str] = None,
+    canceller: Optional[StreamCanceller] = None
 ):
+    """
+    stop_on: 呼び出し側がこの文字列（パスワード）を見た時点で読むのをやめる場合に渡す。
+    打ち切った応答もキャッシュし、同じ stop_on を渡した呼び出しにだけ再生する
+    canceller: stream_ally_message と同じ
+    """
+    if messages is None:
+        messages = build_enemy_messages(enemy_system_prompt, conversation_history, ally_message)
+    yield from _stream_completion(ENEMY_MODEL, messages, usage, session_id, priority,
+                                  stop_on=stop_on, canceller=canceller)
+
+
+async def astream_ally_message(
+    player_model: str,
+    player_system_prompt: str,
+    conversation_history: list,
+    messages: Optional[list] = None,
+    usage: Optional[dict] = None,
+    session_id: Optional[str] = None,
+    priority: str = "interactive"
+):
+    """stream_ally_message の非同期版"""
+    if messages is None:
+        messages = build_ally_messages(player_system_prompt, conversation_history)
+    async for chunk in _astream_completion(player_model, messages, usage, session_id, priority,
+                                           coalesce=not conversation_history):
+        yield chunk
+
+
+async def astream_enemy_message(
+    enemy_system_prompt: str,
+    conversation_history: list,
+    ally_message: str,
+    messages: Optional[list] = None,
+    usage: Optional[dict] = None,
+    session_id: Optional[str] = None,
+    priority: str = "interactive",
+    stop_on: Optional[str] = None
+):
+    """stream_enemy_message の非同期版"""
+    if messages is None:
+        messages = build_enemy_messages(enemy_system_prompt, conversation_history, ally_message)
+    async for chunk in _astream_completion(ENEMY_MODEL, messages, usage, session_id, priority,
+                                           stop_on=stop_on):
+        yield chunk
+
+
+def _sample_tokens(messages: list, n: int) -> int:
+    return estimate_request_tokens(messages, MAX_COMPLETION_TOKENS * n)
+
+
+def sample_enemy_messages(
+    enemy_system_prompt: str,
+    conversation_history: list,
+    ally_message: str,
+    n: int = 8,
+    messages: Optional[list] = None,
+    usage: Optional[dict] = None,
+    session_id: Optional[str] = None,
+    priority: str = "background"
+) -> list:
+    """
+    敵AIの返答を1リクエストで n 件生成する（非ストリーム・評価用）。
+    共通のプロンプトは1回分しか送らないので、同じターンを n 回やり直すより安い。
+    """
     if not client:
         raise ValueError("OpenAI API key is not configured")
-    
-    enemy_messages = [
-        {"role": "system", "content": enemy_system_prompt}
-    ]
-    
-    for msg in conversation_history:
-        if msg["role"] == "ally":
-            enemy_messages.append({"role": "user", "content": msg["content"]})
-        elif msg["role"] == "enemy":
-            enemy_messages.append({"role": "assistant", "content": msg["content"]})
-    
-    enemy_messages.append({"role": "user", "content": ally_message})
-    
-    stream = client.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=enemy_messages,  # type: ignore
-        max_completion_tokens=256,
-        stream=True
-    )
-    
-    for chunk in stream:
-        if chunk.choices[0].delta.content:
-            yield chunk.choices[0].delta.content
+    if messages is None:
+        messages = build_enemy_messages(enemy_system_prompt, conversation_history, ally_message)
+    ticket = None
+    if _rate_limiter is not None:
+        ticket = _rate_limiter.acquire(ENEMY_MODEL, _sample_tokens(messages, n),
+                                       session=session_id or "default", priority=priority)
+    total_tokens = None
+    try:
+        response = client.chat.completions.create(
+            model=ENEMY_MODEL,
+            messages=messages,  # type: ignore
+            max_completion_tokens=MAX_COMPLETION_TOKENS,
+            n=n
+        )
+        if response.usage is not None:
+            total_tokens = response.usage.total_tokens
+            if usage is not None:
+                usage.update(_usage_to_dict(response.usage))
+    finally:
+        if ticket is not None:
+            ticket.settle(total_tokens)
+    return [choice.message.content or "" for choice in response.choices]
+
+
+async def asample_enemy_messages(
+    enemy_system_prompt: str,
+    conversation_history: list,
+    ally_message: str,
+    n: int = 8,
+    messages: Optional[list] = None,
+    usage: Optional[dict] = None,
+    session_id: Optional[str] = None,
+    priority: str = "background"
+) -> list:
+    """sample_enemy_messages の非同期版"""
+    if not async_client:
+        raise ValueError("OpenAI API key is not configured")
+    if messages is None:
+        messages = build_enemy_messages(enemy_system_prompt, conversation_history, ally_message)
+    ticket = None
+    if _rate_limiter is not None:
+        ticket = await _rate_limiter.aacquire(ENEMY_MODEL, _sample_tokens(messages, n),
+                                              session=session_id or "default", priority=priority)
+    total_tokens = None
+    try:
+        response = await async_client.chat.completions.create(
+            model=ENEMY_MODEL,
+            messages=messages,  # type: ignore
+            max_completion_tokens=MAX_COMPLETION_TOKENS,
+            n=n
+        )
+        if response.usage is not None:
+            total_tokens = response.usage.total_tokens
+            if usage is not None:
+                usage.update(_usage_to_dict(response.usage))
+    finally:
+        if ticket is not None:
+            ticket.settle(total_tokens)
+    return [choice.message.content or "" for choice in response.choices]
 
 
 def check_password_in_response(response: str, password: str) -> bool:
     return password.upper() in response.upper()
 
 
+class PasswordDetector:
+    """
+    ストリーミング用のパスワード検出器。
+    直前チャンクの末尾 len(password)-1 文字だけを保持し、
+    チャンク境界をまたぐ出現（"CHE" + "RRY"）も検出する。
+    """
+
+    def __init__(self, password: str):
+        self.password = password.upper()
+        self.found = False
+        self._tail = ""
+
+    def feed(self, chunk: str) -> bool:
+        """チャンクを追加し、これまでの出力にパスワードが含まれていれば True"""
+        if self.found:
+            return True
+        window = self._tail + chunk.upper()
+        if self.password in window:
+            self.found = True
+            self._tail = ""
+            return True
+        keep = len(self.password) - 1
+        self._tail = window[-keep:] if keep > 0 else ""
+        return False
+
+
+class StreamingOutputFilter:
+    """
+    apply_output_filter のストリーミング版。
+    パスワードの途中までが画面に出ないよう末尾 len(password)-1 文字だけを保留し、
+    それより前の部分は受け取った時点で放出する。
+    パスワードを検出したら以降は何も放出しない。
+    """
+
+    def __init__(self, password: str):
+        self.password = password.upper()
+        self.blocked = False
+        self._held = ""
+
+    def feed(self, chunk: str) -> str:
+        """チャンクを追加し、表示してよい部分を返す"""
+        if self.blocked:
+            return ""
+        window = self._held + chunk
+        if self.password in window.upper():
+            self.blocked = True
+            self._held = ""
+            return ""
+        # 保留中の末尾より前で始まるパスワードは既に検出されているはずなので、
+        # 今後の出現は必ず保留部分以降から始まる
+        cut = len(window) - (len(self.password) - 1)
+        if cut <= 0:
+            self._held = window
+            return ""
+        self._held = window[cut:]
+        return window[:cut]
+
+    def flush(self) -> str:
+        """ストリーム終了時に保留分を放出する（ブロック済みなら空）"""
+        if self.blocked:
+            return ""
+        held, self._held = self._held, ""
+        return held
+
+
 def apply_output_filter(response: str, password: str, has_filter: bool) -> tuple[str, bool]:
     if not has_filter:
         return response, False
@@ -0,0 +1,309 @@
+import asyncio
+import queue
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, Generator, Iterator, Optional
+
+import openai
+
+
+class LLMTimeoutError(TimeoutError):
+    """ターンの締め切り、またはストリームの無通信タイムアウトを超えた"""
+
+
+@dataclass
+class ResiliencePolicy:
+    """
+    ストリーム呼び出しの耐障害設定。時間はすべて秒（None で無制限）。
+
+    deadline:      1回のストリーム呼び出し全体（リトライ・ヘッジ込み）の締め切り。
+                   ターンごとではない（1ターンは味方・敵の2回呼ぶので最大で約2倍かかる）
+    idle_timeout:  チャンク間（最初のチャンクまでを含む）の最大無通信時間
+    max_retries:   最初のチャンクより前に起きたエラーのリトライ回数
+    hedge:         最初のチャンクが hedge_after（未指定ならモデルごとの TTFT p95）を
+                   過ぎても来なければ2本目のリクエストを出し、先に始まった方を使う
+    """
+    deadline: Optional[float] = 60.0
+    idle_timeout: Optional[float] = 20.0
+    max_retries: int = 2
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    hedge: bool = False
+    hedge_after: Optional[float] = None
+    hedge_min_samples: int = 20
+
+    def backoff(self, attempt: int) -> float:
+        """フルジッター付き指数バックオフ"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+class TTFTTracker:
+    """モデルごとの直近の TTFT を保持し、ヘッジ開始の目安となるパーセンタイルを返す"""
+
+    def __init__(self, window: int = 200):
+        self._samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def record(self, model: str, ttft: float):
+        with self._lock:
+            self._samples[model].append(ttft)
+
+    def percentile(self, model: str, pct: float = 95.0, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < max(min_samples, 1):
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+        return samples[index]
+
+
+ttft_tracker = TTFTTracker()
+
+
+def is_retryable(error: BaseException) -> bool:
+    if isinstance(error, (LLMTimeoutError, openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+def _remaining(deadline_at: Optional[float]) -> Optional[float]:
+    return None if deadline_at is None else deadline_at - time.monotonic()
+
+
+def _wait_limit(policy: ResiliencePolicy, deadline_at: Optional[float]) -> Optional[float]:
+    """次のチャンクを待てる時間（無通信タイムアウトと締め切りの短い方）"""
+    limits = [t for t in (policy.idle_timeout, _remaining(deadline_at)) if t is not None]
+    return max(0.0, min(limits)) if limits else None
+
+
+def _hedge_delay(policy: ResiliencePolicy, model: str) -> Optional[float]:
+    if not policy.hedge:
+        return None
+    if policy.hedge_after is not None:
+        return policy.hedge_after
+    return ttft_tracker.percentile(model, 95.0, policy.hedge_min_samples)
+
+
+# ---- 同期版: 上流の読み出しをスレッドで行い、キュー越しにタイムアウト付きで受け取る ----
+
+_END = object()
+
+
+class _Pump:
+    """上流ジェネレータを別スレッドで回し、(pump, item) を共有キューへ送る"""
+
+    def __init__(self, stream: Iterator[str], out: queue.Queue):
+        self.stream = stream
+        self.out = out
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            for chunk in self.stream:
+                if self.stopped.is_set():
+                    break
+                self.out.put((self, chunk))
+            else:
+                self.out.put((self, _END))
+        except BaseException as e:
+            self.out.put((self, e))
+        finally:
+            self.stream.close()
+
+    def stop(self):
+        # 読み出し中のスレッドは次のチャンク（または HTTP の read timeout）で止まる
+        self.stopped.set()
+
+
+def _start_sync(open_stream: Callable[[dict], Iterator[str]], model: str,
+                policy: ResiliencePolicy, deadline_at: Optional[float]):
+    """最初のチャンクを受け取った試行を返す（必要ならヘッジ）: (pump, usage, first)"""
+    out: queue.Queue = queue.Queue()
+    usages = {}
+    started = time.monotonic()
+
+    def launch():
+        usage = {}
+        pump = _Pump(open_stream(usage), out)
+        usages[pump] = usage
+        return pump
+
+    live = {launch()}
+    hedge_delay = _hedge_delay(policy, model)
+    last_error: Optional[BaseException] = None
+    while live:
+        limit = _wait_limit(policy, deadline_at)
+        hedging_pending = hedge_delay is not None and len(usages) == 1
+        if hedging_pending:
+            until_hedge = max(0.0, hedge_delay - (time.monotonic() - started))
+            limit = until_hedge if limit is None else min(limit, until_hedge)
+        try:
+            pump, item = out.get(timeout=limit)
+        except queue.Empty:
+            if hedging_pending and (_remaining(deadline_at) is None or _remaining(deadline_at) > 0):
+                live.add(launch())
+                continue
+            for pump in live:
+                pump.stop()
+            raise LLMTimeoutError("最初のチャンクが届く前にタイムアウトしました")
+        if pump not in live:
+            continue
+        if isinstance(item, BaseException):
+            live.discard(pump)
+            last_error = item
+            continue
+        for other in live - {pump}:
+            other.stop()
+        ttft_tracker.record(model, time.monotonic() - started)
+        return pump, usages[pump], (None if item is _END else item)
+    raise last_error
+
+
+def resilient_stream(open_stream: Callable[[dict], Iterator[str]], model: str,
+                     policy: ResiliencePolicy,
+                     usage: Optional[dict] = None) -> Generator[str, None, None]:
+    """
+    open_stream(usage) で開いたストリームに締め切り・無通信タイムアウト・リトライ・ヘッジを掛ける。
+    リトライは最初のチャンクより前のエラーだけが対象（途中まで表示した応答はやり直せない）。
+    """
+    deadline_at = time.monotonic() + policy.deadline if policy.deadline else None
+    attempt = 0
+    while True:
+        try:
+            pump, attempt_usage, first = _start_sync(open_stream, model, policy, deadline_at)
+            break
+        except Exception as e:
+            remaining = _remaining(deadline_at)
+            if attempt >= policy.max_retries or not is_retryable(e) or (remaining is not None and remaining <= 0):
+                raise
+            delay = policy.backoff(attempt)
+            if remaining is not None:
+                delay = min(delay, remaining)
+            time.sleep(delay)
+            attempt += 1
+
+    try:
+        if first is None:
+            return
+        yield first
+        while True:
+            try:
+                sender, item = pump.out.get(timeout=_wait_limit(policy, deadline_at))
+            except queue.Empty:
+                raise LLMTimeoutError("ストリームが無通信のままタイムアウトしました")
+            if sender is not pump:
+                # 止めたヘッジ側の残りチャンク
+                continue
+            if item is _END:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+        if usage is not None:
+            usage.update(attempt_usage)
+    finally:
+        pump.stop()
+
+
+# ---- 非同期版 ----
+
+async def _start_async(open_stream: Callable[[dict], AsyncIterator[str]], model: str,
+                       policy: ResiliencePolicy, deadline_at: Optional[float]):
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    attempts = {}  # task -> (stream, usage)
+
+    def launch():
+        usage = {}
+        stream = open_stream(usage)
+        task = loop.create_task(stream.__anext__())
+        attempts[task] = (stream, usage)
+
+    async def close_all(tasks):
+        for task in tasks:
+            task.cancel()
+        # キャンセルが上流ジェネレータに届いて片付くのを待ってから閉じる
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for task in tasks:
+            stream, _ = attempts[task]
+            try:
+                await stream.aclose()
+            except Exception:
+                pass
+
+    launch()
+    hedge_delay = _hedge_delay(policy, model)
+    pending = set(attempts)
+    last_error: Optional[BaseException] = None
+    while pending:
+        limit = _wait_limit(policy, deadline_at)
+        hedging_pending = hedge_delay is not None and len(attempts) == 1
+        if hedging_pending:
+            until_hedge = max(0.0, hedge_delay - (time.monotonic() - started))
+            limit = until_hedge if limit is None else min(limit, until_hedge)
+        done, pending = await asyncio.wait(pending, timeout=limit, return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            if hedging_pending and (_remaining(deadline_at) is None or _remaining(deadline_at) > 0):
+                launch()
+                pending = {task for task in attempts if not task.done()}
+                continue
+            await close_all(list(attempts))
+            raise LLMTimeoutError("最初のチャンクが届く前にタイムアウトしました")
+        for task in done:
+            stream, usage = attempts[task]
+            error = task.exception()
+            if error is not None and not isinstance(error, StopAsyncIteration):
+                last_error = error
+                continue
+            # 同じ回に完了した負け側（エラー・遅れて届いたチャンク）も含め、勝者以外はすべて閉じる
+            await close_all([other for other in attempts if other is not task])
+            ttft_tracker.record(model, time.monotonic() - started)
+            first = None if error is not None else task.result()
+            return stream, usage, first
+    await close_all(list(attempts))
+    raise last_error
+
+
+async def aresilient_stream(open_stream: Callable[[dict], AsyncIterator[str]], model: str,
+                            policy: ResiliencePolicy,
+                            usage: Optional[dict] = None) -> AsyncGenerator[str, None]:
+    """resilient_stream の非同期版"""
+    deadline_at = time.monotonic() + policy.deadline if policy.deadline else None
+    attempt = 0
+    while True:
+        try:
+            stream, attempt_usage, first = await _start_async(open_stream, model, policy, deadline_at)
+            break
+        except Exception as e:
+            remaining = _remaining(deadline_at)
+            if attempt >= policy.max_retries or not is_retryable(e) or (remaining is not None and remaining <= 0):
+                raise
+            delay = policy.backoff(attempt)
+            if remaining is not None:
+                delay = min(delay, remaining)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    try:
+        if first is None:
+            return
+        yield first
+        while True:
+            try:
+                chunk = await asyncio.wait_for(stream.__anext__(), _wait_limit(policy, deadline_at))
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                raise LLMTimeoutError("ストリームが無通信のままタイムアウトしました")
+            yield chunk
+        if usage is not None:
+            usage.update(attempt_usage)
+    finally:
+        await stream.aclose()
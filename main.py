@@ -1,6 +1,10 @@
+import argparse
+import signal
 import sys
 import time
 from game_engine import GameEngine
+from llm_client import LLM_WARMUP, warm_up_connections
+from session_store import ConflictError, load_engine, open_session_store, save_engine
 from upgrades import get_rarity_color
 
 # ANSI colors for terminal output
@@ -40,13 +44,42 @@ def type_effect(text, delay=0.02):
         time.sleep(delay)
     print()
 
+def _cancel_on_sigint(engine):
+    """SIGINT を engine.cancel() に差し替え、元のハンドラを返す"""
+    def handler(signum, frame):
+        engine.cancel()
+        # 2回目の Ctrl-C は通常どおり KeyboardInterrupt にする
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+    return signal.signal(signal.SIGINT, handler)
+
 def main():
+    parser = argparse.ArgumentParser(description="AI Hackslash (CLI Mode)")
+    parser.add_argument("--session", help="保存済みのセッション ID から再開する")
+    parser.add_argument("--store", help="セッションストア（省略時は環境変数 SESSION_STORE）")
+    args = parser.parse_args()
+
     engine = GameEngine()
+    store = open_session_store(args.store)
+    if LLM_WARMUP:
+        warm_up_connections()
     
     print_header("\n=== 🎮 AI Hackslash (CLI Mode) ===")
     print("パスワード抽出ローグライクへようこそ！\n")
+    if args.session:
+        if load_engine(store, args.session, engine) is None:
+            print_error(f"セッション {args.session} が見つかりません。新しく始めます。")
+        else:
+            print_system(f"セッション {args.session} を再開します。")
+    print_system(f"セッション ID: {engine.session_id}（--session で再開できます）")
     
     while True:
+        # 1ターンごとに保存する。別のプロセスが先に進めていたらそちらを読み込み直す
+        try:
+            save_engine(store, engine)
+        except ConflictError:
+            load_engine(store, engine.session_id, engine)
+            print_error("別のプロセスでこのセッションが進んでいたため、最新の状態を読み込みました。")
+
         # ゲーム終了判定
         if engine.victory:
             print_success("\n🏆 VICTORY! 全ステージクリアおめでとうございます！")
@@ -109,57 +142,76 @@ def main():
         
         last_role = "ally"
         
-        for event in turn_generator:
-            if event["type"] == "ally_chunk":
-                sys.stdout.write(event["content"])
-                sys.stdout.flush()
-                ally_accum += event["content"]
+        # ターン中の Ctrl-C は中断要求に変える（2回目は即座に打ち切る）
+        previous_handler = _cancel_on_sigint(engine)
+        turn_finished = False
+        try:
+            for event in turn_generator:
+                if event["type"] == "ally_chunk":
+                    sys.stdout.write(event["content"])
+                    sys.stdout.flush()
+                    ally_accum += event["content"]
             
-            elif event["type"] == "ally_done":
-                print(Colors.ENDC) # 改行と色リセット
-                print(f"{Colors.FAIL}🏰 [敵AI]  : ", end="")
-                sys.stdout.flush()
-                last_role = "enemy"
+                elif event["type"] == "ally_done":
+                    print(Colors.ENDC) # 改行と色リセット
+                    print(f"{Colors.FAIL}🏰 [敵AI]  : ", end="")
+                    sys.stdout.flush()
+                    last_role = "enemy"
                 
-            elif event["type"] == "enemy_chunk":
-                sys.stdout.write(event["content"])
-                sys.stdout.flush()
-                enemy_accum += event["content"]
+                elif event["type"] == "enemy_chunk":
+                    sys.stdout.write(event["content"])
+                    sys.stdout.flush()
+                    enemy_accum += event["content"]
                 
-            elif event["type"] == "enemy_done":
-                print(Colors.ENDC)
-                if event["was_blocked"]:
-                    # 行を消して上書きしたいところだが、簡易的に追記
-                    print(f"{Colors.WARNING}[SYSTEM]: パスワード検知！表示をブロックしました。{Colors.ENDC}")
+                elif event["type"] == "enemy_done":
+                    print(Colors.ENDC)
+                    if event["was_blocked"]:
+                        # 行を消して上書きしたいところだが、簡易的に追記
+                        print(f"{Colors.WARNING}[SYSTEM]: パスワード検知！表示をブロックしました。{Colors.ENDC}")
                     
-            elif event["type"] == "result":
-                if event["status"] == "clear":
-                    reason = "フィルター突破！" if event.get("was_blocked") else "パスワード奪取！"
-                    print_success(f"\n🎉 {reason} ステージクリア！")
+                elif event["type"] == "result":
+                    turn_finished = True
+                    signal.signal(signal.SIGINT, previous_handler)
+                    if event["status"] == "cancelled":
+                        print(Colors.ENDC)
+                        print_error("⏹ 中断しました（このターンは無効です）")
+
+                    elif event["status"] == "clear":
+                        reason = "フィルター突破！" if event.get("was_blocked") else "パスワード奪取！"
+                        print_success(f"\n🎉 {reason} ステージクリア！")
                     
-                    engine.proceed_to_next_stage()
-                    if engine.victory:
-                        break # ゲームループ先頭で勝利処理
+                        engine.proceed_to_next_stage()
+                        if engine.victory:
+                            break # ゲームループ先頭で勝利処理
                     
-                    # アップグレード選択
-                    print_header("\n⬆️  アップグレード選択の時間です")
-                    for idx, upgrade in enumerate(engine.upgrade_choices):
-                        print(f"{idx + 1}. [{upgrade['rarity']}] {upgrade['name']}: {upgrade['description']}")
+                        # アップグレード選択
+                        print_header("\n⬆️  アップグレード選択の時間です")
+                        for idx, upgrade in enumerate(engine.upgrade_choices):
+                            print(f"{idx + 1}. [{upgrade['rarity']}] {upgrade['name']}: {upgrade['description']}")
                     
-                    while True:
-                        try:
-                            choice = int(input("\n選択 (1-3): "))
-                            if 1 <= choice <= 3:
-                                engine.apply_upgrade(choice - 1)
-                                print_success(f"{engine.upgrade_choices[choice-1]['name']} を獲得しました！")
-                                break
-                            else:
-                                print("1〜3の数字を入力してください。")
-                        except ValueError:
-                            print("数字を入力してください。")
+                        while True:
+                            try:
+                                choice = int(input("\n選択 (1-3): "))
+                                if 1 <= choice <= 3:
+                                    engine.apply_upgrade(choice - 1)
+                                    print_success(f"{engine.upgrade_choices[choice-1]['name']} を獲得しました！")
+                                    break
+                                else:
+                                    print("1〜3の数字を入力してください。")
+                            except ValueError:
+                                print("数字を入力してください。")
                             
-                elif event["status"] == "failed":
-                    print_error("\n💀 ターンオーバー...失敗です。")
+                    elif event["status"] == "failed":
+                        print_error("\n💀 ターンオーバー...失敗です。")
+        except KeyboardInterrupt:
+            if turn_finished:
+                raise
+            # 受信待ちの途中で打ち切った場合も上流のストリームは閉じられ、会話履歴は変わらない
+            turn_generator.close()
+            print(Colors.ENDC)
+            print_error("⏹ 中断しました（このターンは無効です）")
+        finally:
+            signal.signal(signal.SIGINT, previous_handler)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,181 @@
+"""
+Successive halving による候補プロンプトの絞り込み。
+ラウンドごとにクリア率の低い候補を落とし、残った候補ほど多くのシードと難しいステージで評価する。
+
+    python auto_play.py --tournament prompts.txt --halving --rounds 3 --token-budget 200000
+"""
+import math
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from llm_client import PasswordDetector, asample_enemy_messages, sample_enemy_messages
+from stages import STAGES
+from tournament import RunResult, aggregate, build_runs, run_tournament
+
+
+def default_stage_schedule(rounds: int) -> List[List[int]]:
+    """ラウンドが進むごとに1段ずつ難しいステージへ（出力フィルター付きが最難）"""
+    levels = [s["level"] for s in sorted(STAGES, key=lambda s: (s["has_output_filter"], s["level"]))]
+    return [[levels[min(i, len(levels) - 1)]] for i in range(rounds)]
+
+
+@dataclass
+class HalvingConfig:
+    rounds: int = 3
+    keep_fraction: float = 0.5  # 各ラウンドで残す割合
+    base_seeds: int = 2  # 1ラウンド目のシード数。以降 seed_growth 倍ずつ増やす
+    seed_growth: int = 2
+    stage_schedule: Optional[List[List[int]]] = None  # ラウンドごとのステージ（省略時は default_stage_schedule）
+    token_budget: Optional[int] = None  # 全ラウンド合計のトークン上限
+    concurrency: int = 8
+    mode: str = "thread"
+
+    def seeds_for(self, round_index: int) -> int:
+        return self.base_seeds * self.seed_growth ** round_index
+
+    def stages_for(self, round_index: int) -> List[int]:
+        schedule = self.stage_schedule or default_stage_schedule(self.rounds)
+        return schedule[min(round_index, len(schedule) - 1)]
+
+
+@dataclass
+class EvalReport:
+    rounds: List[Dict[str, Any]] = field(default_factory=list)
+    survivors: List[str] = field(default_factory=list)
+    total_tokens: int = 0
+    stopped_reason: str = ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "rounds": self.rounds,
+            "survivors": self.survivors,
+            "total_tokens": self.total_tokens,
+            "stopped_reason": self.stopped_reason,
+        }
+
+
+def _rank(summary: Dict[str, Dict[str, Any]]) -> List[str]:
+    """クリア率が高い順。同率ならクリアまでのターン数、トークンコストが少ない方を上に"""
+    def key(prompt_id: str):
+        s = summary[prompt_id]
+        turns = s["avg_turns_to_clear"] if s["avg_turns_to_clear"] is not None else math.inf
+        return (-s["clear_rate"], turns, s["avg_tokens_per_run"])
+    return sorted(summary, key=key)
+
+
+def successive_halving(prompts: List[tuple], config: Optional[HalvingConfig] = None,
+                       results_path: Optional[str] = None,
+                       player: Optional[Dict[str, Any]] = None) -> EvalReport:
+    """
+    prompts は (prompt_id, prompt) のリスト。
+    token_budget を指定した場合は、これまでの1試行あたりの実績トークン数から次のラウンドの
+    コストを見積もり、収まるようにシード数を減らす（1シードも収まらなければそこで打ち切る）。
+    """
+    config = config or HalvingConfig()
+    report = EvalReport()
+    candidates = list(prompts)
+    all_results: List[RunResult] = []
+
+    for round_index in range(config.rounds):
+        stages = config.stages_for(round_index)
+        seeds = config.seeds_for(round_index)
+
+        if config.token_budget is not None and all_results:
+            remaining = config.token_budget - report.total_tokens
+            per_run = report.total_tokens / len(all_results)
+            affordable = int(remaining // (per_run * len(candidates) * len(stages))) if per_run else seeds
+            if affordable < 1:
+                report.stopped_reason = "token budget exhausted"
+                break
+            seeds = min(seeds, affordable)
+
+        runs = build_runs(candidates, stages, seeds)
+        results = run_tournament(runs, concurrency=config.concurrency, results_path=results_path,
+                                 player=player, mode=config.mode)
+        all_results.extend(results)
+        round_tokens = sum(r.total_tokens for r in results)
+        report.total_tokens += round_tokens
+
+        summary = aggregate(results)
+        ranked = _rank(summary)
+        is_last = round_index == config.rounds - 1 or len(candidates) == 1
+        keep = len(ranked) if is_last else max(1, math.ceil(len(ranked) * config.keep_fraction))
+        kept = set(ranked[:keep])
+        report.rounds.append({
+            "round": round_index + 1,
+            "stages": stages,
+            "seeds": seeds,
+            "runs": len(results),
+            "tokens": round_tokens,
+            "summary": summary,
+            "kept": ranked[:keep],
+            "dropped": ranked[keep:],
+        })
+        candidates = [(pid, prompt) for pid, prompt in candidates if pid in kept]
+
+        if len(candidates) == 1:
+            report.stopped_reason = "single candidate left"
+            break
+        if config.token_budget is not None and report.total_tokens >= config.token_budget:
+            report.stopped_reason = "token budget exhausted"
+            break
+    else:
+        report.stopped_reason = "all rounds completed"
+
+    if report.rounds:
+        report.survivors = report.rounds[-1]["kept"]
+    return report
+
+
+def format_report(report: EvalReport) -> str:
+    lines = []
+    for r in report.rounds:
+        lines.append(
+            f"Round {r['round']}: stages={r['stages']} seeds={r['seeds']} runs={r['runs']} tokens={r['tokens']}"
+        )
+        for prompt_id in r["kept"] + r["dropped"]:
+            s = r["summary"][prompt_id]
+            mark = "✓" if prompt_id in r["kept"] else "✗"
+            lines.append(f"  {mark} {prompt_id:<10} {s['clear_rate']:>5.0%}  {s['prompt'][:40]}")
+    lines.append(f"Survivors: {', '.join(report.survivors)} ({report.stopped_reason}, {report.total_tokens} tokens)")
+    return "\n".join(lines)
+
+
+def _leak_report(stage: Dict[str, Any], samples: List[str], usage: Dict[str, Any]) -> Dict[str, Any]:
+    leaks = 0
+    for sample in samples:
+        detector = PasswordDetector(stage["password"])
+        detector.feed(sample)
+        leaks += detector.found
+    return {
+        "stage": stage["level"],
+        "samples": len(samples),
+        "leaks": leaks,
+        # ブロックされても生出力に含まれていればクリア扱いなので、漏洩率がそのままクリア率になる
+        "leak_rate": leaks / len(samples) if samples else 0.0,
+        "usage": usage,
+        "replies": samples,
+    }
+
+
+def estimate_leak_rate(stage: Dict[str, Any], ally_message: str,
+                       conversation_history: Optional[list] = None, n: int = 8) -> Dict[str, Any]:
+    """
+    味方AIのメッセージ1つに対する敵AIの返答を n 件まとめて生成し、パスワードの漏洩率を推定する。
+    同じターンを n 回やり直すのと違い、共通のプロンプトは1回分しか送らない。
+    """
+    usage: Dict[str, Any] = {}
+    samples = sample_enemy_messages(
+        stage["enemy_system_prompt"], conversation_history or [], ally_message, n=n, usage=usage
+    )
+    return _leak_report(stage, samples, usage)
+
+
+async def aestimate_leak_rate(stage: Dict[str, Any], ally_message: str,
+                              conversation_history: Optional[list] = None, n: int = 8) -> Dict[str, Any]:
+    """estimate_leak_rate の非同期版"""
+    usage: Dict[str, Any] = {}
+    samples = await asample_enemy_messages(
+        stage["enemy_system_prompt"], conversation_history or [], ally_message, n=n, usage=usage
+    )
+    return _leak_report(stage, samples, usage)
@@ -0,0 +1,240 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+from context_budget import estimate_message_tokens
+
+# 数字が小さいほど優先（Streamlit の対話ターンを auto_play などのバッチより先に通す）
+PRIORITIES = {"interactive": 0, "background": 1}
+
+
+@dataclass
+class ModelLimits:
+    rpm: float  # 1分あたりのリクエスト数
+    tpm: float  # 1分あたりのトークン数
+
+
+def estimate_request_tokens(messages: list, max_completion_tokens: int) -> int:
+    """TPM の消費見積もり（プロバイダーと同様に最大生成トークン数も含める）"""
+    return estimate_message_tokens(messages) + max_completion_tokens
+
+
+class _Bucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount: float) -> float:
+        # バケット容量を超える要求は満タンになった時点で通す（永久に待たせない）
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+
+class Ticket:
+    """acquire で払い出される実行許可。実際の使用量が分かったら settle で精算する"""
+
+    def __init__(self, scheduler: "RateLimitScheduler", model: str, tokens: int,
+                 session: str, priority: int):
+        self.scheduler = scheduler
+        self.model = model
+        self.tokens = tokens
+        self.session = session
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self._event = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_event: Optional[asyncio.Event] = None
+
+    @property
+    def granted(self) -> bool:
+        return self.granted_at is not None
+
+    @property
+    def wait_time(self) -> Optional[float]:
+        return None if self.granted_at is None else self.granted_at - self.enqueued_at
+
+    def _notify(self):
+        self._event.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._async_event.set)
+
+    def settle(self, actual_tokens: Optional[int]):
+        """見積もりと実際のトークン数の差をバケットに反映する"""
+        if actual_tokens is not None:
+            self.scheduler._settle(self, actual_tokens)
+
+
+class RateLimitScheduler:
+    """
+    モデルごとの RPM/TPM トークンバケットと、セッション間で公平な待ち行列。
+    同じ優先度の中ではセッション単位のラウンドロビンで順番を回すため、
+    1つのセッションが大量に投げても他のセッションが待たされ続けることはない。
+    順番は厳密に守り、先頭が通れない間は後ろも通さない（大きなリクエストの飢餓を防ぐ）。
+    """
+
+    def __init__(self, limits: Dict[str, ModelLimits], default: Optional[ModelLimits] = None):
+        self.limits = dict(limits)
+        self.default = default
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, tuple] = {}
+        # model -> priority -> session -> 待ち行列
+        self._queues: Dict[str, Dict[int, "OrderedDict[str, Deque[Ticket]]"]] = {}
+        self._granted = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _limits_for(self, model: str) -> Optional[ModelLimits]:
+        return self.limits.get(model, self.default)
+
+    def _buckets_for(self, model: str) -> tuple:
+        if model not in self._buckets:
+            limits = self._limits_for(model)
+            self._buckets[model] = (_Bucket(limits.rpm), _Bucket(limits.tpm))
+        return self._buckets[model]
+
+    def _enqueue(self, ticket: Ticket):
+        by_priority = self._queues.setdefault(ticket.model, {})
+        sessions = by_priority.setdefault(ticket.priority, OrderedDict())
+        sessions.setdefault(ticket.session, deque()).append(ticket)
+
+    def _remove(self, ticket: Ticket):
+        sessions = self._queues.get(ticket.model, {}).get(ticket.priority)
+        if not sessions or ticket.session not in sessions:
+            return
+        queue = sessions[ticket.session]
+        if ticket in queue:
+            queue.remove(ticket)
+        if not queue:
+            del sessions[ticket.session]
+
+    def _dispatch(self, model: str) -> float:
+        """通せるだけ通し、次に通せるようになるまでの秒数を返す（ロック保持中に呼ぶ）"""
+        by_priority = self._queues.get(model)
+        if not by_priority:
+            return 0.0
+        requests, tokens = self._buckets_for(model)
+        now = time.monotonic()
+        requests.refill(now)
+        tokens.refill(now)
+        for priority in sorted(by_priority):
+            sessions = by_priority[priority]
+            while sessions:
+                session, queue = next(iter(sessions.items()))
+                ticket = queue[0]
+                wait = max(requests.wait_for(1), tokens.wait_for(ticket.tokens))
+                if wait > 0:
+                    return wait
+                requests.level -= 1
+                tokens.level -= ticket.tokens
+                queue.popleft()
+                # 通したセッションは末尾へ（ラウンドロビン）
+                del sessions[session]
+                if queue:
+                    sessions[session] = queue
+                ticket.granted_at = now
+                self._granted += 1
+                self._total_wait += ticket.wait_time
+                self._max_wait = max(self._max_wait, ticket.wait_time)
+                ticket._notify()
+        return 0.0
+
+    def _abandon(self, ticket: Ticket):
+        """待ちが中断された（KeyboardInterrupt・タスクのキャンセルなど）チケットを行列から外す"""
+        with self._lock:
+            if not ticket.granted:
+                self._remove(ticket)
+                # 先頭で止まっていた場合に備えて、後ろの待ちを進める
+                self._dispatch(ticket.model)
+
+    def _settle(self, ticket: Ticket, actual_tokens: int):
+        if self._limits_for(ticket.model) is None:
+            return  # 制限のないモデルはバケットを持たない
+        with self._lock:
+            _, tokens = self._buckets_for(ticket.model)
+            tokens.level = min(tokens.capacity, tokens.level + ticket.tokens - actual_tokens)
+
+    def _new_ticket(self, model: str, tokens: int, session: str, priority: str) -> Ticket:
+        return Ticket(self, model, tokens, session, PRIORITIES.get(priority, PRIORITIES["background"]))
+
+    def acquire(self, model: str, tokens: int, session: str = "default",
+                priority: str = "interactive", timeout: Optional[float] = None) -> Ticket:
+        """実行許可が出るまでブロックする。制限のないモデルは即座に通す"""
+        ticket = self._new_ticket(model, tokens, session, priority)
+        if self._limits_for(model) is None:
+            ticket.granted_at = ticket.enqueued_at
+            return ticket
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._dispatch(ticket.model)
+                    if ticket.granted:
+                        return ticket
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise TimeoutError("レート制限の待ち時間が上限を超えました")
+                if deadline is not None:
+                    wait = min(wait, max(0.0, deadline - time.monotonic()))
+                ticket._event.wait(timeout=wait or None)
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    async def aacquire(self, model: str, tokens: int, session: str = "default",
+                       priority: str = "interactive", timeout: Optional[float] = None) -> Ticket:
+        """acquire の非同期版（イベントループをブロックしない）"""
+        ticket = self._new_ticket(model, tokens, session, priority)
+        if self._limits_for(model) is None:
+            ticket.granted_at = ticket.enqueued_at
+            return ticket
+        ticket._loop = asyncio.get_running_loop()
+        ticket._async_event = asyncio.Event()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._enqueue(ticket)
+        try:
+            while True:
+                with self._lock:
+                    wait = self._dispatch(ticket.model)
+                    if ticket.granted:
+                        return ticket
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise TimeoutError("レート制限の待ち時間が上限を超えました")
+                if deadline is not None:
+                    wait = min(wait, max(0.0, deadline - time.monotonic()))
+                try:
+                    await asyncio.wait_for(ticket._async_event.wait(), timeout=wait or None)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    def stats(self) -> dict:
+        """待ち行列の深さ（モデル・優先度別）と待ち時間"""
+        names = {v: k for k, v in PRIORITIES.items()}
+        with self._lock:
+            depth = {
+                model: {
+                    names.get(priority, str(priority)): sum(len(q) for q in sessions.values())
+                    for priority, sessions in by_priority.items()
+                }
+                for model, by_priority in self._queues.items()
+            }
+            return {
+                "queue_depth": depth,
+                "granted": self._granted,
+                "avg_wait": self._total_wait / self._granted if self._granted else 0.0,
+                "max_wait": self._max_wait,
+            }
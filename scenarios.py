@@ -0,0 +1,133 @@
+"""
+任意のステージから始めるための名前付きシナリオ。
+前のステージを実際にクリアしなくても、指定したロードアウト（モデル・プロンプト上限・最大ターン数）で
+そのステージに入れる。ステージ単位で評価を分割して並列に走らせる用途。
+
+ロードアウトの各値は初期値か upgrades.UPGRADES のいずれかの効果で得られる値に限る。
+strict な検証では、さらに「それまでのステージのクリア報酬（1ステージ1つ）で揃えられるか」も確かめる。
+
+    python auto_play.py --tournament prompts.txt --scenario stage3,stage3-gpt4o
+"""
+from dataclasses import dataclass, replace
+from typing import Any, Dict, List, Optional, Union
+
+from game_engine import DEFAULT_PLAYER, GameEngine
+from stages import get_stage
+from upgrades import UPGRADES
+
+LOADOUT_KEYS = ("model", "prompt_limit", "max_turns")
+# 外部から受け取る player で指定できる項目（current_stage はシナリオ名がないときの開始ステージ）
+PLAYER_KEYS = LOADOUT_KEYS + ("current_stage",)
+
+
+def allowed_values(key: str) -> List[Any]:
+    """ロードアウトの項目が取りうる値（初期値とアップグレードの効果）"""
+    values = [DEFAULT_PLAYER[key]]
+    for upgrade in UPGRADES:
+        value = upgrade["effect"].get(key)
+        if value is not None and value not in values:
+            values.append(value)
+    return values
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    stage: int
+    model: str = DEFAULT_PLAYER["model"]
+    prompt_limit: int = DEFAULT_PLAYER["prompt_limit"]
+    max_turns: int = DEFAULT_PLAYER["max_turns"]
+    description: str = ""
+
+    def loadout(self) -> Dict[str, Any]:
+        return {key: getattr(self, key) for key in LOADOUT_KEYS}
+
+    def upgrades_needed(self) -> int:
+        """初期値から変わっている項目の数（アップグレードは1つで1項目を書き換える）"""
+        return sum(1 for key, value in self.loadout().items() if value != DEFAULT_PLAYER[key])
+
+    def validate(self, strict: bool = True) -> "Scenario":
+        """不正なら ValueError。strict なら前のステージの報酬だけで揃うかも確かめる"""
+        if get_stage(self.stage) is None:
+            raise ValueError(f"{self.name}: stage {self.stage} does not exist")
+        for key, value in self.loadout().items():
+            allowed = allowed_values(key)
+            if value not in allowed:
+                raise ValueError(f"{self.name}: {key}={value!r} is not reachable (allowed: {allowed})")
+        if strict and self.upgrades_needed() > self.stage - 1:
+            raise ValueError(
+                f"{self.name}: loadout needs {self.upgrades_needed()} upgrades, "
+                f"but only {self.stage - 1} can be earned before stage {self.stage}"
+            )
+        return self
+
+    def with_loadout(self, player: Optional[Dict[str, Any]]) -> "Scenario":
+        """player のうちロードアウトの項目だけで上書きしたシナリオ"""
+        overrides = {key: value for key, value in (player or {}).items() if key in LOADOUT_KEYS}
+        return replace(self, **overrides) if overrides else self
+
+    def apply(self, engine: GameEngine):
+        """engine をこのシナリオの開始状態にする（会話・プロンプト・アップグレード候補は空になる）"""
+        engine.reset_game()
+        engine.player = {**self.loadout(), "current_stage": self.stage}
+        engine.start_stage()
+
+
+SCENARIOS: Dict[str, Scenario] = {}
+
+
+def register_scenario(scenario: Scenario) -> Scenario:
+    SCENARIOS[scenario.name] = scenario.validate()
+    return scenario
+
+
+for _scenario in (
+    Scenario("stage1", 1, description="最初から"),
+    Scenario("stage2", 2, description="ステージ1の報酬を取らずに到達"),
+    Scenario("stage2-gpt4", 2, model="gpt-4", description="ステージ1で GPT-4 を取った場合"),
+    Scenario("stage2-turns5", 2, max_turns=5, description="ステージ1で粘り強さIを取った場合"),
+    Scenario("stage3", 3, description="出力フィルター付き・報酬なし"),
+    Scenario("stage3-gpt4o", 3, model="gpt-4o", max_turns=7, description="モデルとターン数を伸ばした場合"),
+    Scenario("stage3-prompt200", 3, prompt_limit=200, max_turns=5, description="長いプロンプトで攻める場合"),
+):
+    register_scenario(_scenario)
+
+
+def get_scenario(name: str) -> Scenario:
+    try:
+        return SCENARIOS[name]
+    except KeyError:
+        raise ValueError(f"unknown scenario: {name} (available: {', '.join(SCENARIOS)})") from None
+
+
+def build_scenario(name: Optional[str] = None, stage: int = 1,
+                   player: Optional[Dict[str, Any]] = None, strict: bool = True) -> Scenario:
+    """
+    開始状態を組み立てて検証する（ゲームサーバーのセッション作成とトーナメントの共通の入口）。
+    name があれば名前付きシナリオ、なければ stage の名前のないシナリオに player のロードアウト項目を重ねる。
+    不正なら ValueError
+    """
+    if player is not None and not isinstance(player, dict):
+        raise ValueError("player must be an object")
+    unknown = sorted(set(player or {}) - set(PLAYER_KEYS))
+    if unknown:
+        raise ValueError(f"unknown player keys: {', '.join(unknown)} (allowed: {', '.join(PLAYER_KEYS)})")
+    if name:
+        scenario = get_scenario(name)
+    else:
+        if not isinstance(stage, int) or isinstance(stage, bool):
+            raise ValueError(f"stage must be an integer: {stage!r}")
+        scenario = Scenario(f"stage{stage}", stage)
+    return scenario.with_loadout(player).validate(strict=strict)
+
+
+def scenario_for_stage(stage: int, player: Optional[Dict[str, Any]] = None) -> Scenario:
+    """名前のないシナリオ（報酬の数は問わない）"""
+    return build_scenario(stage=stage, player=player, strict=False)
+
+
+def apply_scenario(engine: GameEngine, scenario: Union[str, Scenario]) -> GameEngine:
+    if isinstance(scenario, str):
+        scenario = get_scenario(scenario)
+    scenario.apply(engine)
+    return engine
@@ -0,0 +1,210 @@
+"""
+ゲームセッションの外部保存。プロセスの再起動や Streamlit のワーカーをまたいで、セッション ID で再開できる。
+
+スナップショットは9バイトのヘッダー（マジック "AHSS"・形式バージョン・展開後のバイト数）と
+zlib で圧縮した JSON からなる。保存時には読み込んだときのバージョンを渡し、その間に別のプロセスが
+書き込んでいれば ConflictError になる（楽観的排他制御）。
+
+    SESSION_STORE=sqlite:///.sessions.db   # 既定（WAL モード）
+    SESSION_STORE=memory://                # プロセス内のみ
+"""
+import json
+import os
+from abc import ABC, abstractmethod
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+SESSION_STORE = os.environ.get("SESSION_STORE", "sqlite:///.sessions.db")
+
+_MAGIC = b"AHSS"
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("!4sBI")
+# 1ターンごとに保存するので圧縮率より速度を取る
+_COMPRESSION_LEVEL = 1
+
+
+class ConflictError(Exception):
+    """保存しようとしたセッションが、読み込んだ後に他のプロセスで更新されていた"""
+
+
+def encode_snapshot(state: Dict[str, Any]) -> bytes:
+    raw = json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return _HEADER.pack(_MAGIC, _FORMAT_VERSION, len(raw)) + zlib.compress(raw, _COMPRESSION_LEVEL)
+
+
+def decode_snapshot(data: bytes) -> Dict[str, Any]:
+    if len(data) < _HEADER.size:
+        raise ValueError("snapshot is too short")
+    magic, version, size = _HEADER.unpack_from(data)
+    if magic != _MAGIC:
+        raise ValueError("not a session snapshot")
+    if version != _FORMAT_VERSION:
+        raise ValueError(f"unsupported snapshot version: {version}")
+    raw = zlib.decompress(data[_HEADER.size:])
+    if len(raw) != size:
+        raise ValueError("snapshot is truncated")
+    return json.loads(raw)
+
+
+class SessionStore(ABC):
+    """
+    セッション ID -> (状態, バージョン)。バージョンは保存のたびに1ずつ増え、未保存のセッションは 0。
+    save に渡す version は load で得た値（新規なら 0）で、戻り値が新しいバージョン。
+    """
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        ...
+
+    @abstractmethod
+    def save(self, session_id: str, state: Dict[str, Any], version: int) -> int:
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        ...
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """プロセス内の dict に置く（テスト・単一プロセス用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Tuple[bytes, int]] = {}
+
+    def load(self, session_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        data, version = entry
+        return decode_snapshot(data), version
+
+    def save(self, session_id: str, state: Dict[str, Any], version: int) -> int:
+        data = encode_snapshot(state)
+        with self._lock:
+            current = self._sessions.get(session_id, (None, 0))[1]
+            if current != version:
+                raise ConflictError(f"session {session_id} is at version {current}, not {version}")
+            self._sessions[session_id] = (data, version + 1)
+        return version + 1
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite（WAL モード）に保存する。読み手は書き手を待たないので、同じファイルを
+    複数のワーカープロセスから使える。
+    プロセス内では接続を1本だけ持ち、ロックで順番に使う（Streamlit は再実行のたびに
+    別のスレッドで動くので、スレッドごとに接続を持つと再実行ごとに接続が増え続ける）。
+    """
+
+    def __init__(self, path: str = ".sessions.db", busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        with self._lock:
+            self._connect()  # テーブルを作り、パスの誤りを早めに知らせる
+
+    def _connect(self) -> sqlite3.Connection:
+        """ロック保持中に呼ぶ。close() の後に使われた場合は開き直す"""
+        if self._conn is not None:
+            return self._conn
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL では NORMAL でもクラッシュで壊れない（電源断で直前のコミットを失うことはある）
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL NOT NULL, data BLOB NOT NULL)"
+        )
+        self._conn = conn
+        return conn
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._connect().execute(sql, params)
+
+    def load(self, session_id: str) -> Optional[Tuple[Dict[str, Any], int]]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT data, version FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return decode_snapshot(row[0]), row[1]
+
+    def save(self, session_id: str, state: Dict[str, Any], version: int) -> int:
+        data = encode_snapshot(state)
+        if version == 0:
+            cursor = self._execute(
+                "INSERT OR IGNORE INTO sessions (id, version, updated_at, data) VALUES (?, 1, ?, ?)",
+                (session_id, time.time(), data),
+            )
+        else:
+            cursor = self._execute(
+                "UPDATE sessions SET version = version + 1, updated_at = ?, data = ? WHERE id = ? AND version = ?",
+                (time.time(), data, session_id, version),
+            )
+        if cursor.rowcount != 1:
+            raise ConflictError(f"session {session_id} was modified since version {version}")
+        return version + 1
+
+    def delete(self, session_id: str):
+        self._execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def purge(self, max_age: float) -> int:
+        """max_age 秒以上更新のないセッションを消し、消した件数を返す"""
+        cursor = self._execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - max_age,))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            conn, self._conn = self._conn, None
+        if conn is not None:
+            conn.close()
+
+
+def open_session_store(url: Optional[str] = None) -> SessionStore:
+    """"sqlite:///パス" か "memory://" からストアを作る（省略時は環境変数 SESSION_STORE）"""
+    url = url or SESSION_STORE
+    if url == "memory://":
+        return MemorySessionStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    raise ValueError(f"unknown session store: {url}")
+
+
+def save_engine(store: SessionStore, engine, extra: Optional[Dict[str, Any]] = None) -> int:
+    """
+    engine の状態を保存し、engine.store_version を進める。
+    extra には画面遷移など UI 側の状態を入れられる（load_engine が返す）。
+    """
+    state = engine.snapshot()
+    if extra:
+        state["extra"] = extra
+    engine.store_version = store.save(engine.session_id, state, engine.store_version)
+    return engine.store_version
+
+
+def load_engine(store: SessionStore, session_id: str, engine) -> Optional[Dict[str, Any]]:
+    """保存済みの状態を engine に読み込み、save_engine で渡した extra を返す。見つからなければ None"""
+    loaded = store.load(session_id)
+    if loaded is None:
+        return None
+    state, version = loaded
+    engine.restore(state)
+    engine.store_version = version
+    return state.get("extra") or {}
@@ -0,0 +1,257 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncGenerator, AsyncIterator, Callable, Dict, Generator, Iterator, List, Optional
+
+
+class _Flight:
+    """同じキーで進行中の上流ストリーム1本と、それまでに届いたチャンク"""
+
+    def __init__(self, upstream, lock: threading.Lock):
+        self.upstream = upstream
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.readers = 0
+        self.pumping = False
+        self.cond = threading.Condition(lock)
+
+
+class SingleFlight:
+    """
+    同一リクエストの同時実行を1本の上流ストリームにまとめ、全員に同じチャンクを配る。
+    上流の読み出しは、バッファの末尾に追いついた読み手が交代で行う（専用スレッドは持たない）。
+    非同期版では読み出しを1チャンクずつ別タスクにし、読み手のキャンセルが上流に及ばないようにする。
+    先頭の読み手が途中で離れても残りの読み手が続きを読み、全員が離れた時点で上流を閉じる。
+
+    memo_ttl > 0 なら、最後まで受信できた応答をその秒数だけ覚えておき、同じリクエストに再生する。
+    """
+
+    def __init__(self, memo_ttl: float = 0.0, memo_size: int = 256):
+        self.memo_ttl = memo_ttl
+        self.memo_size = memo_size
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+        self._async_flights: Dict[str, "_AsyncFlight"] = {}
+        self._memo: "OrderedDict[str, tuple]" = OrderedDict()
+        self._upstream = 0
+        self._coalesced = 0
+        self._memo_hits = 0
+
+    # ---- メモ ----
+
+    def _memo_get(self, key: str) -> Optional[List[str]]:
+        if self.memo_ttl <= 0:
+            return None
+        entry = self._memo.get(key)
+        if entry is None:
+            return None
+        expires_at, chunks = entry
+        if time.monotonic() >= expires_at:
+            del self._memo[key]
+            return None
+        self._memo.move_to_end(key)
+        self._memo_hits += 1
+        return chunks
+
+    def _memo_put(self, key: str, chunks: List[str]):
+        if self.memo_ttl <= 0:
+            return
+        self._memo[key] = (time.monotonic() + self.memo_ttl, list(chunks))
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    def _join(self, table: dict, key: str, new_flight: Callable[[], _Flight],
+              usage: Optional[dict]) -> _Flight:
+        """ロック保持中に呼ぶ。進行中のものがあれば相乗りし、なければ新しく開く"""
+        flight = table.get(key)
+        if flight is not None:
+            self._coalesced += 1
+            if usage is not None:
+                usage["coalesced"] = True
+        else:
+            flight = table[key] = new_flight()
+            self._upstream += 1
+        flight.readers += 1
+        return flight
+
+    def _leave(self, table: dict, key: str, flight) -> bool:
+        """ロック保持中に呼ぶ。最後の読み手なら True（上流を閉じる役）"""
+        flight.readers -= 1
+        if flight.readers == 0 and table.get(key) is flight:
+            del table[key]
+        return flight.readers == 0 and not flight.done
+
+    def _finish(self, table: dict, key: str, flight, error: Optional[BaseException]):
+        """ロック保持中に呼ぶ。以降の同一リクエストは新しい上流を開く"""
+        flight.done = True
+        flight.error = error
+        if table.get(key) is flight:
+            del table[key]
+        if error is None:
+            self._memo_put(key, flight.chunks)
+
+    # ---- 同期版 ----
+
+    def stream(self, key: str, open_stream: Callable[[dict], Iterator[str]],
+               usage: Optional[dict] = None) -> Generator[str, None, None]:
+        """
+        open_stream(usage) は上流ストリームを開く関数。同じ key で進行中のものがあればそれに相乗りする。
+        使用量は上流を開いた読み手の usage にだけ書き込まれ、相乗りした側には coalesced が付く。
+        """
+        with self._lock:
+            memo = self._memo_get(key)
+            if memo is None:
+                flight = self._join(
+                    self._flights, key,
+                    lambda: _Flight(open_stream(usage if usage is not None else {}), self._lock), usage
+                )
+        if memo is not None:
+            if usage is not None:
+                usage["memoized"] = True
+            yield from memo
+            return
+
+        index = 0
+        try:
+            while True:
+                with self._lock:
+                    while index >= len(flight.chunks) and not flight.done and flight.pumping:
+                        flight.cond.wait()
+                    if index < len(flight.chunks):
+                        chunk = flight.chunks[index]
+                    elif flight.done:
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+                    else:
+                        chunk = None
+                        flight.pumping = True
+                if chunk is not None:
+                    index += 1
+                    yield chunk
+                    continue
+                error = None
+                try:
+                    next_chunk = next(flight.upstream)
+                except StopIteration:
+                    next_chunk = None
+                except BaseException as e:
+                    next_chunk, error = None, e
+                with self._lock:
+                    flight.pumping = False
+                    if next_chunk is not None:
+                        flight.chunks.append(next_chunk)
+                    else:
+                        self._finish(self._flights, key, flight, error)
+                    flight.cond.notify_all()
+        finally:
+            with self._lock:
+                close = self._leave(self._flights, key, flight)
+                if close:
+                    flight.done = True
+                    flight.error = RuntimeError("coalesced stream was closed")
+            if close:
+                flight.upstream.close()
+
+    # ---- 非同期版（1つのイベントループ内で相乗りする） ----
+
+    async def astream(self, key: str, open_stream: Callable[[dict], AsyncIterator[str]],
+                      usage: Optional[dict] = None) -> AsyncGenerator[str, None]:
+        """stream の非同期版"""
+        with self._lock:
+            memo = self._memo_get(key)
+            if memo is None:
+                flight = self._join(
+                    self._async_flights, key,
+                    lambda: _AsyncFlight(open_stream(usage if usage is not None else {}), self._lock), usage
+                )
+        if memo is not None:
+            if usage is not None:
+                usage["memoized"] = True
+            for chunk in memo:
+                yield chunk
+            return
+
+        index = 0
+        try:
+            while True:
+                if index < len(flight.chunks):
+                    index += 1
+                    yield flight.chunks[index - 1]
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                if flight.pump is None:
+                    # 上流の読み出しは読み手とは別のタスクで行う。
+                    # 読み出し中の読み手がキャンセルされても上流は止まらず、残りの読み手が結果を受け取る
+                    flight.pump = asyncio.ensure_future(_anext(flight.upstream))
+                    flight.pump.add_done_callback(lambda pump: self._pumped(key, flight, pump))
+                await flight.changed.wait()
+        finally:
+            with self._lock:
+                close = self._leave(self._async_flights, key, flight)
+                if close:
+                    flight.done = True
+                    flight.error = RuntimeError("coalesced stream was closed")
+            if close:
+                if flight.pump is not None:
+                    flight.pump.cancel()
+                    await asyncio.wait([flight.pump])
+                await flight.upstream.aclose()
+
+    def _pumped(self, key: str, flight: "_AsyncFlight", pump: asyncio.Future):
+        """上流から1チャンク読み終えたときのコールバック"""
+        flight.pump = None
+        if flight.done:
+            return  # 全員が離れて閉じた後
+        if pump.cancelled():
+            error = RuntimeError("coalesced stream was cancelled")
+        else:
+            error = pump.exception()
+        if error is None and pump.result() is not _END:
+            flight.chunks.append(pump.result())
+        else:
+            with self._lock:
+                self._finish(self._async_flights, key, flight, error)
+        flight.notify()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "upstream": self._upstream,
+                "coalesced": self._coalesced,
+                "memo_hits": self._memo_hits,
+                "memo_entries": len(self._memo),
+                "in_flight": len(self._flights) + len(self._async_flights),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memo.clear()
+
+
+_END = object()
+
+
+async def _anext(upstream: AsyncIterator[str]):
+    """上流の次のチャンク。終わりなら _END"""
+    try:
+        return await upstream.__anext__()
+    except StopAsyncIteration:
+        return _END
+
+
+class _AsyncFlight(_Flight):
+    def __init__(self, upstream, lock: threading.Lock):
+        super().__init__(upstream, lock)
+        self.changed = asyncio.Event()
+        self.pump: Optional[asyncio.Future] = None
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
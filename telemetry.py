@@ -0,0 +1,122 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StreamMetrics:
+    """
+    1本のストリーム（味方AI or 敵AI）の計測結果。時間はすべて秒。
+    model_time は受信側の処理（UI描画など）で止まっていた consumer_time を除いた時間。
+    """
+    role: str
+    model: str
+    request_start: float  # UNIX 時刻
+    ttft: Optional[float] = None  # 最初のチャンクが届くまで（届かなければ None）
+    duration: float = 0.0
+    consumer_time: float = 0.0
+    chunk_count: int = 0
+    usage: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def model_time(self) -> float:
+        return self.duration - self.consumer_time
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        completion_tokens = self.usage.get("completion_tokens")
+        if not completion_tokens or self.ttft is None:
+            return None
+        generation_time = self.model_time - self.ttft
+        return completion_tokens / generation_time if generation_time > 0 else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["model_time"] = self.model_time
+        data["tokens_per_second"] = self.tokens_per_second
+        return data
+
+
+class StreamTimer:
+    """ストリームを消費しながら StreamMetrics を組み立てる"""
+
+    def __init__(self, role: str, model: str):
+        self.metrics = StreamMetrics(role=role, model=model, request_start=time.time())
+        self._start = time.perf_counter()
+
+    def on_chunk(self):
+        if self.metrics.ttft is None:
+            self.metrics.ttft = time.perf_counter() - self._start
+        self.metrics.chunk_count += 1
+
+    @contextmanager
+    def paused(self):
+        """yield で呼び出し側に制御を渡している間を consumer_time として計る"""
+        paused_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.metrics.consumer_time += time.perf_counter() - paused_at
+
+    def finish(self, usage: Optional[Dict[str, Any]] = None) -> StreamMetrics:
+        self.metrics.duration = time.perf_counter() - self._start
+        if usage:
+            self.metrics.usage = dict(usage)
+        return self.metrics
+
+
+class TelemetryHook:
+    """
+    計測結果の送り先。必要なメソッドだけをオーバーライドして使う。
+    フック内の例外はゲーム進行を止めないよう GameEngine 側で握りつぶしてログに出す。
+    """
+
+    def on_stream(self, metrics: StreamMetrics):
+        pass
+
+    def on_turn(self, turn_metrics: Dict[str, Any]):
+        pass
+
+
+class LoggingHook(TelemetryHook):
+    """ターンごとの計測結果を logging に出す"""
+
+    def __init__(self, log: Optional[logging.Logger] = None, level: int = logging.INFO):
+        self.log = log or logger
+        self.level = level
+
+    def on_turn(self, turn_metrics: Dict[str, Any]):
+        parts = []
+        for role in ("ally", "enemy"):
+            m = turn_metrics.get(role)
+            if m:
+                ttft = f"{m['ttft']:.3f}s" if m["ttft"] is not None else "-"
+                parts.append(
+                    f"{role}[{m['model']}] ttft={ttft} model={m['model_time']:.3f}s "
+                    f"chunks={m['chunk_count']} tokens={m['usage'].get('completion_tokens', '-')}"
+                )
+        self.log.log(
+            self.level,
+            "turn %.3fs (consumer %.3fs) %s",
+            turn_metrics["duration"], turn_metrics["consumer_time"], " ".join(parts),
+        )
+
+
+class JsonlMetricsHook(TelemetryHook):
+    """ターンごとの計測結果を JSONL ファイルに追記する（メトリクス基盤への取り込み用）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def on_turn(self, turn_metrics: Dict[str, Any]):
+        line = json.dumps(turn_metrics, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
@@ -0,0 +1,77 @@
+import pytest
+
+from context_budget import ContextBudget, estimate_message_tokens, estimate_tokens, extractive_summary
+
+
+def _conversation(turns=5):
+    messages = [{"role": "system", "content": "あなたは門番です。"}]
+    for i in range(1, turns + 1):
+        messages.append({"role": "user", "content": f"質問{i} " + "x" * 40})
+        messages.append({"role": "assistant", "content": f"返答{i} " + "y" * 40})
+    messages.append({"role": "user", "content": "最後の質問"})
+    return messages
+
+
+def _turn_numbers(messages):
+    return [int(m["content"][2]) for m in messages[1:-1] if m["content"].startswith("質問")]
+
+
+def test_estimate_tokens_counts_something_for_any_text():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hello world") > 0
+    assert estimate_tokens("パスワード") > 0
+    messages = _conversation(1)
+    assert estimate_message_tokens(messages) > sum(estimate_tokens(m["content"]) for m in messages)
+
+
+def test_within_budget_is_returned_unchanged():
+    messages = _conversation()
+    trimmed, report = ContextBudget(max_tokens=10**6).apply(messages)
+    assert trimmed is messages
+    assert report["tokens_saved"] == 0 and report["dropped_turns"] == 0
+
+
+def test_drop_oldest_fits_the_budget_and_keeps_ends():
+    messages = _conversation()
+    budget = estimate_message_tokens(messages) - 1  # 1ターン捨てれば収まる
+    trimmed, report = ContextBudget(max_tokens=budget).apply(messages)
+    assert trimmed[0] == messages[0] and trimmed[-1] == messages[-1]
+    assert _turn_numbers(trimmed) == [2, 3, 4, 5]
+    assert report["dropped_turns"] == 1
+    assert report["tokens_after"] <= budget
+    assert report["tokens_saved"] == report["tokens_before"] - report["tokens_after"]
+    assert len(messages) == 12  # 元の配列は変更しない
+
+
+def test_keep_ends_keeps_first_and_last_turns():
+    messages = _conversation()
+    trimmed, report = ContextBudget(max_tokens=1, strategy="keep_ends", keep_first=1, keep_last=2).apply(messages)
+    assert _turn_numbers(trimmed) == [1, 4, 5]
+    assert report["dropped_turns"] == 2
+
+
+def test_summarize_replaces_old_turns_with_one_message():
+    messages = _conversation()
+    seen = []
+
+    def summarizer(old):
+        seen.extend(old)
+        return "要約"
+
+    trimmed, report = ContextBudget(max_tokens=1, strategy="summarize", keep_last=2,
+                                    summarizer=summarizer).apply(messages)
+    assert len(seen) == 6
+    assert trimmed[1] == {"role": "system", "content": "これまでの会話の要約:\n要約"}
+    assert _turn_numbers(trimmed) == [4, 5]
+    assert report["dropped_turns"] == 3
+    assert report["tokens_saved"] > 0
+
+
+def test_extractive_summary_truncates_each_message():
+    summary = extractive_summary([{"role": "user", "content": "a" * 50 + "\nb"}], max_chars_per_message=10)
+    assert summary == "- user: " + "a" * 10 + "…"
+
+
+def test_unknown_strategy_is_rejected():
+    with pytest.raises(ValueError):
+        ContextBudget(max_tokens=100, strategy="random")
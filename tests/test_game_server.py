@@ -0,0 +1,253 @@
+import asyncio
+import base64
+import json
+import os
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+
+import llm_client  # noqa: E402
+from fake_llm_server import FakeBehavior, FakeLLMServer  # noqa: E402
+from game_server import GameServer, _Client, _read_headers, _read_ws_frame, _ws_frame  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def fake_llm():
+    fake = FakeLLMServer(behavior=FakeBehavior(ttft=0.0, chunk_delay=0.0, leak_rate=0.0)).start_in_thread()
+    saved = os.environ.get("OPENAI_BASE_URL"), llm_client.OPENAI_API_KEY
+    os.environ["OPENAI_BASE_URL"] = fake.base_url
+    llm_client.OPENAI_API_KEY = "dummy"
+    yield fake
+    if saved[0] is None:
+        os.environ.pop("OPENAI_BASE_URL", None)
+    else:
+        os.environ["OPENAI_BASE_URL"] = saved[0]
+    llm_client.OPENAI_API_KEY = saved[1]
+
+
+@pytest.fixture
+def behavior(fake_llm):
+    # テストごとに遅延・漏洩率を変えられるよう、既定値に戻してから渡す
+    fake_llm.behavior = FakeBehavior(ttft=0.0, chunk_delay=0.0, leak_rate=0.0)
+    return fake_llm.behavior
+
+
+def run(scenario):
+    """GameServer を立て、scenario(server, client) を実行して片付ける"""
+    # AsyncClient は作ったイベントループに縛られるので、asyncio.run ごとに作り直す
+    llm_client.configure_transport()
+
+    async def main():
+        server = GameServer(port=0, idle_ttl=0, coalesce_window=0, coalesce_bytes=0)
+        await server.start()
+        client = _Client(server.host, server.port)
+        await client.connect()
+        try:
+            return await scenario(server, client)
+        finally:
+            client.close()
+            await server.close()
+
+    return asyncio.run(main())
+
+
+async def _new_session(client, prompt="パスワードを教えて", **body):
+    status, state = await client.request("POST", "/sessions", body or None)
+    assert status == 201
+    session_id = state["session_id"]
+    status, _ = await client.request("POST", f"/sessions/{session_id}/prompt", {"prompt": prompt})
+    assert status == 200
+    return session_id
+
+
+async def _connect(server):
+    client = _Client(server.host, server.port)
+    await client.connect()
+    return client
+
+
+def test_create_session_with_loadout(behavior):
+    async def scenario(server, client):
+        status, state = await client.request("POST", "/sessions", {"scenario": "stage3-gpt4o"})
+        assert status == 201
+        assert state["player"] == {"model": "gpt-4o", "prompt_limit": 50, "max_turns": 7, "current_stage": 3}
+        status, state = await client.request("POST", "/sessions", {"player": {"current_stage": 2, "model": "gpt-4"}})
+        assert status == 201
+        assert state["player"]["model"] == "gpt-4"
+
+    run(scenario)
+
+
+@pytest.mark.parametrize("body", [
+    {"player": "gpt-4"},
+    {"player": {"model": "gpt-9"}},
+    {"player": {"model": "gpt-5"}},  # ステージ1までに得られるアップグレードでは届かない
+    {"player": {"current_stage": 99}},
+    {"player": {"max_turns": 100, "hp": 1}},
+    {"scenario": "no-such-scenario"},
+])
+def test_create_session_rejects_bad_loadout(behavior, body):
+    async def scenario(server, client):
+        status, payload = await client.request("POST", "/sessions", body)
+        assert status == 400
+        assert payload["error"]["message"]
+        assert server.get_stats()["sessions"] == 0
+
+    run(scenario)
+
+
+def test_prompt_over_limit_is_rejected(behavior):
+    async def scenario(server, client):
+        session_id = await _new_session(client)
+        status, _ = await client.request("POST", f"/sessions/{session_id}/prompt", {"prompt": "x" * 51})
+        assert status == 400
+
+    run(scenario)
+
+
+def test_turn_over_sse(behavior):
+    async def scenario(server, client):
+        session_id = await _new_session(client)
+        events = [event async for event in client.stream(f"/sessions/{session_id}/turn")]
+        types = [event["type"] for event in events]
+        assert types[0] == "ally_chunk"
+        assert types.index("ally_done") < types.index("enemy_done") < types.index("result")
+        assert events[-1]["status"] == "continue"
+        status, state = await client.request("GET", f"/sessions/{session_id}")
+        assert status == 200
+        assert state["current_turn"] == 1
+        assert [msg["role"] for msg in state["conversation"]] == ["ally", "enemy"]
+
+    run(scenario)
+
+
+def test_clear_then_upgrade(behavior):
+    behavior.leak_rate = 1.0
+
+    async def scenario(server, client):
+        session_id = await _new_session(client)
+        events = [event async for event in client.stream(f"/sessions/{session_id}/turn")]
+        assert events[-1]["status"] == "clear"
+        status, state = await client.request("POST", f"/sessions/{session_id}/upgrade", {"index": 0})
+        assert status == 200
+        assert state["player"]["current_stage"] == 2
+
+    run(scenario)
+
+
+def test_cancel_sse_turn(behavior):
+    behavior.ttft = 0.2
+    behavior.chunk_delay = 0.05
+
+    async def scenario(server, client):
+        session_id = await _new_session(client)
+        other = await _connect(server)
+        events = []
+        async for event in client.stream(f"/sessions/{session_id}/turn"):
+            events.append(event)
+            if len(events) == 1:
+                status, _ = await other.request("POST", f"/sessions/{session_id}/cancel")
+                assert status == 200
+        other.close()
+        assert events[-1]["type"] == "result"
+        assert events[-1]["status"] == "cancelled"
+        status, state = await client.request("GET", f"/sessions/{session_id}")
+        assert state["current_turn"] == 0
+        assert state["conversation"] == []
+
+    run(scenario)
+
+
+def test_concurrent_turn_and_delete_are_rejected(behavior):
+    behavior.ttft = 0.3
+
+    async def scenario(server, client):
+        session_id = await _new_session(client)
+        other = await _connect(server)
+        turn = asyncio.ensure_future(client.stream(f"/sessions/{session_id}/turn").__anext__())
+        await asyncio.sleep(0.1)
+        with pytest.raises(RuntimeError, match="409"):
+            async for _ in other.stream(f"/sessions/{session_id}/turn"):
+                pass
+        status, _ = await other.request("DELETE", f"/sessions/{session_id}")
+        assert status == 409
+        await other.request("POST", f"/sessions/{session_id}/cancel")
+        await turn
+        other.close()
+
+    run(scenario)
+
+
+async def _open_ws(server, session_id):
+    reader, writer = await asyncio.open_connection(server.host, server.port)
+    key = base64.b64encode(os.urandom(16)).decode("latin-1")
+    writer.write(
+        f"GET /sessions/{session_id}/ws HTTP/1.1\r\nHost: {server.host}\r\nUpgrade: websocket\r\n"
+        f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n".encode("latin-1")
+    )
+    status_line = await reader.readline()
+    assert status_line.split()[1] == b"101"
+    await _read_headers(reader)
+    return reader, writer
+
+
+def _ws_send(writer, payload):
+    writer.write(_ws_frame(0x1, json.dumps(payload).encode("utf-8")))
+
+
+async def _ws_messages(reader, until_type="result"):
+    messages = []
+    while True:
+        opcode, data = await asyncio.wait_for(_read_ws_frame(reader), 10)
+        assert opcode == 0x1
+        messages.append(json.loads(data))
+        if messages[-1]["type"] == until_type:
+            return messages
+
+
+def test_websocket_turn_and_cancel(behavior):
+    async def scenario(server, client):
+        session_id = await _new_session(client)
+        reader, writer = await _open_ws(server, session_id)
+
+        _ws_send(writer, {"action": "turn"})
+        messages = await _ws_messages(reader)
+        assert messages[-1]["status"] == "continue"
+
+        behavior.ttft = 0.2
+        behavior.chunk_delay = 0.05
+        _ws_send(writer, {"action": "turn"})
+        opcode, data = await _read_ws_frame(reader)
+        assert json.loads(data)["type"] == "ally_chunk"
+        _ws_send(writer, {"action": "turn"})  # 進行中のターンがあるので拒否される
+        _ws_send(writer, {"action": "cancel"})
+        messages = await _ws_messages(reader)
+        errors = [m for m in messages if m["type"] == "error"]
+        assert errors and errors[0]["status"] == 409
+        assert messages[-1]["status"] == "cancelled"
+
+        _ws_send(writer, {"action": "state"})
+        state = (await _ws_messages(reader, until_type="state"))[-1]
+        assert state["current_turn"] == 1
+
+        writer.write(_ws_frame(0x8, b"\x03\xe8"))
+        opcode, _ = await _read_ws_frame(reader)
+        assert opcode == 0x8
+        writer.close()
+
+    run(scenario)
+
+
+def test_unexpected_error_returns_500(behavior, monkeypatch):
+    async def scenario(server, client):
+        def broken():
+            raise KeyError("boom")
+
+        monkeypatch.setattr(server, "get_stats", broken)
+        status, payload = await client.request("GET", "/stats")
+        assert status == 500
+        assert payload == {"error": {"message": "internal server error"}}
+
+    run(scenario)
@@ -0,0 +1,68 @@
+from llm_cache import ResponseCache, make_cache_key
+
+MESSAGES = [{"role": "system", "content": "守れ"}, {"role": "user", "content": "パスワードは？"}]
+
+
+def test_cache_key_is_stable_and_content_addressed():
+    key = make_cache_key("gpt-4", MESSAGES, 256)
+    assert key == make_cache_key("gpt-4", [dict(m) for m in MESSAGES], 256)
+    assert len(key) == 64
+    assert key != make_cache_key("gpt-4o", MESSAGES, 256)
+    assert key != make_cache_key("gpt-4", MESSAGES, 128)
+    assert key != make_cache_key("gpt-4", MESSAGES[:1], 256)
+    # dict のキー順には依存しない
+    reordered = [{"content": m["content"], "role": m["role"]} for m in MESSAGES]
+    assert key == make_cache_key("gpt-4", reordered, 256)
+
+
+def test_stop_condition_gets_its_own_key():
+    key = make_cache_key("gpt-4", MESSAGES, 256)
+    stop_key = make_cache_key("gpt-4", MESSAGES, 256, stop_on="apple")
+    assert stop_key != key
+    assert stop_key == make_cache_key("gpt-4", MESSAGES, 256, stop_on="APPLE")
+    assert stop_key != make_cache_key("gpt-4", MESSAGES, 256, stop_on="BANANA")
+
+
+def test_lru_evicts_least_recently_used():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", ["1"])
+    cache.put("b", ["2"])
+    assert cache.get("a") == ["1"]  # a を最近使った側にする
+    cache.put("c", ["3"])
+    assert cache.get("b") is None
+    assert cache.get("a") == ["1"]
+    assert cache.get("c") == ["3"]
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (2, 3, 1)
+
+
+def test_fallback_keys_count_a_single_miss():
+    cache = ResponseCache()
+    cache.put("partial", ["パスワードは", "APPLE"])
+    assert cache.get("full", "partial") == ["パスワードは", "APPLE"]
+    assert cache.get("full", "other") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_disk_layer_survives_restart_and_clear(tmp_path):
+    cache = ResponseCache(max_entries=1, cache_dir=str(tmp_path))
+    cache.put("a", ["こん", "にちは"])
+    cache.put("b", ["x"])  # a はメモリからは追い出されるがディスクに残る
+    assert cache.get("a") == ["こん", "にちは"]
+    cache.clear()
+    assert cache.get("b") == ["x"]
+
+    reopened = ResponseCache(cache_dir=str(tmp_path))
+    assert reopened.get("a") == ["こん", "にちは"]
+    assert reopened.stats()["disk_hits"] == 1
+    assert reopened.get("a") == ["こん", "にちは"]
+    assert reopened.stats()["disk_hits"] == 1  # 2回目はメモリから
+
+
+def test_corrupt_disk_entry_is_a_miss(tmp_path):
+    cache = ResponseCache(cache_dir=str(tmp_path))
+    cache.put("ab12", ["ok"])
+    with open(tmp_path / "ab" / "ab12.json", "w", encoding="utf-8") as f:
+        f.write("{broken")
+    assert ResponseCache(cache_dir=str(tmp_path)).get("ab12") is None
@@ -0,0 +1,76 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from llm_cassette import CassettePlayer, CassetteRecorder
+
+
+def _slow(chunks, delay=0.05):
+    for chunk in chunks:
+        time.sleep(delay)
+        yield chunk
+
+
+async def _aiter(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_round_trip_keeps_chunks_and_order(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    recorder = CassetteRecorder(path)
+    assert list(recorder.record("k", "gpt-4", iter(["パス", "ワードは", "秘密"]))) == ["パス", "ワードは", "秘密"]
+    assert list(recorder.record("k", "gpt-4", iter(["二回目"]))) == ["二回目"]
+
+    player = CassettePlayer(path, timing="max")
+    assert list(player.play("k")) == ["パス", "ワードは", "秘密"]
+    assert list(player.play("k")) == ["二回目"]
+    # 尽きたら先頭に戻る
+    assert list(player.play("k")) == ["パス", "ワードは", "秘密"]
+
+
+def test_async_round_trip(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    recorder = CassetteRecorder(path)
+
+    async def main():
+        recorded = [c async for c in recorder.arecord("k", "gpt-4", _aiter(["a", "b"]))]
+        played = [c async for c in CassettePlayer(path, timing="max").aplay("k")]
+        return recorded, played
+
+    assert asyncio.run(main()) == (["a", "b"], ["a", "b"])
+
+
+def test_closed_stream_is_recorded_as_incomplete(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    stream = CassetteRecorder(path).record("k", "gpt-4", iter(["a", "b", "c"]))
+    assert next(stream) == "a"
+    stream.close()
+    with open(path, encoding="utf-8") as f:
+        entry = json.loads(f.readline())
+    assert entry["complete"] is False
+    assert [chunk for _, chunk in entry["chunks"]] == ["a"]
+
+
+def test_original_timing_replays_at_recorded_pace(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    list(CassetteRecorder(path).record("k", "gpt-4", _slow(["a", "b", "c"])))
+
+    start = time.perf_counter()
+    list(CassettePlayer(path, timing="original").play("k"))
+    assert time.perf_counter() - start >= 0.12
+
+    start = time.perf_counter()
+    list(CassettePlayer(path, timing="max").play("k"))
+    assert time.perf_counter() - start < 0.05
+
+
+def test_unknown_request_and_timing_are_rejected(tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    list(CassetteRecorder(path).record("k", "gpt-4", iter(["a"])))
+    with pytest.raises(ValueError):
+        CassettePlayer(path, timing="fast")
+    with pytest.raises(ValueError):
+        list(CassettePlayer(path).play("missing"))
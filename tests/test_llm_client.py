@@ -0,0 +1,83 @@
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+
+from llm_client import (  # noqa: E402
+    PasswordDetector, StreamingOutputFilter, apply_output_filter, check_password_in_response
+)
+
+
+def _feed_all(detector, chunks):
+    return [detector.feed(chunk) for chunk in chunks]
+
+
+def test_detector_finds_password_inside_one_chunk():
+    assert _feed_all(PasswordDetector("APPLE"), ["答えは", "appleです"]) == [False, True]
+
+
+@pytest.mark.parametrize("chunks", [
+    ["パスワードは CHE", "RRY です"],
+    ["C", "H", "E", "R", "R", "Y"],
+    ["...ch", "eR", "ry"],
+])
+def test_detector_finds_password_across_chunk_boundaries(chunks):
+    detector = PasswordDetector("CHERRY")
+    assert _feed_all(detector, chunks)[-1] is True
+    assert detector.found
+
+
+def test_detector_stays_found_and_ignores_near_misses():
+    detector = PasswordDetector("BANANA")
+    assert _feed_all(detector, ["BANAN", " A", "BANAN"]) == [False, False, False]
+    assert detector.feed("A") is True
+    assert detector.feed("関係ない") is True
+
+
+@pytest.mark.parametrize("text", ["xxAPPLExx", "ap", "pl", "e"])
+def test_detector_matches_whole_text_check(text):
+    # 1文字ずつ流しても、全文での判定と同じ結果になる
+    detector = PasswordDetector("APPLE")
+    _feed_all(detector, list(text))
+    assert detector.found == check_password_in_response(text, "APPLE")
+
+
+def _filtered(password, chunks):
+    output_filter = StreamingOutputFilter(password)
+    emitted = [output_filter.feed(chunk) for chunk in chunks]
+    return emitted, output_filter.flush(), output_filter.blocked
+
+
+def test_filter_streams_everything_when_password_never_appears():
+    chunks = ["こんにちは、", "今日は", "いい天気です"]
+    emitted, tail, blocked = _filtered("APPLE", chunks)
+    assert not blocked
+    assert "".join(emitted) + tail == "".join(chunks)
+    # 末尾 len(password)-1 文字だけを保留し、それより前はすぐに出す
+    assert emitted[0] == "こんにちは、"[:-4]
+    assert len(tail) == 4
+
+
+@pytest.mark.parametrize("chunks", [
+    ["答えは ap", "ple です"],
+    ["A", "P", "P", "L", "E"],
+    ["前置きがとても長い文章のあとに APPLE"],
+])
+def test_filter_never_shows_any_part_of_the_password(chunks):
+    emitted, tail, blocked = _filtered("APPLE", chunks)
+    assert blocked and tail == ""
+    shown = "".join(emitted).upper()
+    assert not any(shown.endswith("APPLE"[:n]) for n in range(1, 6))
+
+
+def test_filter_emits_nothing_after_blocking():
+    output_filter = StreamingOutputFilter("KIWI")
+    assert output_filter.feed("kiwi") == ""
+    assert output_filter.feed("続きの文章") == ""
+    assert output_filter.flush() == ""
+
+
+def test_apply_output_filter_blocks_whole_reply():
+    assert apply_output_filter("APPLE です", "apple", has_filter=True) == ("[BLOCKED] パスワードが検出されました", True)
+    assert apply_output_filter("APPLE です", "apple", has_filter=False) == ("APPLE です", False)
+    assert apply_output_filter("なし", "apple", has_filter=True) == ("なし", False)
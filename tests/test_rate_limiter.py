@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from rate_limiter import ModelLimits, RateLimitScheduler
+
+# TPM 600 = 毎秒10トークン回復。満タン（600）を使い切ると、1トークンの要求は約0.1秒で通る
+LIMITS = ModelLimits(rpm=6000, tpm=600)
+
+
+def _exhausted_scheduler():
+    scheduler = RateLimitScheduler({"gpt-4": LIMITS})
+    scheduler.acquire("gpt-4", 600, session="setup")
+    return scheduler
+
+
+def _queued(scheduler, model="gpt-4"):
+    return sum(scheduler.stats()["queue_depth"].get(model, {}).values())
+
+
+def test_unlimited_model_is_granted_immediately():
+    scheduler = RateLimitScheduler({"gpt-4": ModelLimits(rpm=1, tpm=1)})
+    ticket = scheduler.acquire("gpt-3.5-turbo", 10**6)
+    assert ticket.granted and ticket.wait_time == 0
+    ticket.settle(120)
+    ticket = asyncio.run(scheduler.aacquire("gpt-4o", 10**6))
+    assert ticket.granted and ticket.wait_time == 0
+    assert scheduler.stats()["granted"] == 0
+
+
+def test_default_limits_apply_to_unlisted_models():
+    scheduler = RateLimitScheduler({}, default=LIMITS)
+    scheduler.acquire("gpt-4o", 600)
+    with pytest.raises(TimeoutError):
+        scheduler.acquire("gpt-4o", 10, timeout=0.05)
+
+
+def test_waits_until_the_bucket_refills():
+    scheduler = _exhausted_scheduler()
+    start = time.monotonic()
+    ticket = scheduler.acquire("gpt-4", 3)
+    waited = time.monotonic() - start
+    assert 0.2 <= waited < 1.5
+    assert ticket.wait_time == pytest.approx(waited, abs=0.05)
+    stats = scheduler.stats()
+    assert stats["granted"] == 2
+    assert stats["max_wait"] >= 0.2
+
+
+def test_settle_refunds_overestimated_tokens():
+    scheduler = RateLimitScheduler({"gpt-4": LIMITS})
+    scheduler.acquire("gpt-4", 600).settle(100)
+    start = time.monotonic()
+    scheduler.acquire("gpt-4", 400)
+    assert time.monotonic() - start < 0.1
+
+
+def test_settle_charges_underestimated_tokens():
+    scheduler = RateLimitScheduler({"gpt-4": LIMITS})
+    scheduler.acquire("gpt-4", 100).settle(600)
+    with pytest.raises(TimeoutError):
+        scheduler.acquire("gpt-4", 50, timeout=0.1)
+
+
+def test_request_larger_than_capacity_is_not_starved():
+    scheduler = RateLimitScheduler({"gpt-4": ModelLimits(rpm=6000, tpm=6)})
+    ticket = scheduler.acquire("gpt-4", 10**6, timeout=1)
+    assert ticket.granted
+
+
+def test_sync_timeout_leaves_queue():
+    scheduler = _exhausted_scheduler()
+    errors = []
+
+    def wait():
+        try:
+            scheduler.acquire("gpt-4", 600, session="b", timeout=0.1)
+        except TimeoutError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    thread.join(5)
+    assert errors and _queued(scheduler) == 0
+
+
+def test_cancelled_async_waiter_leaves_queue():
+    scheduler = _exhausted_scheduler()
+
+    async def main():
+        task = asyncio.ensure_future(scheduler.aacquire("gpt-4", 600, session="b"))
+        await asyncio.sleep(0.05)
+        assert _queued(scheduler) == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert _queued(scheduler) == 0
+
+
+def test_abandoned_head_does_not_block_next_session():
+    scheduler = _exhausted_scheduler()
+
+    async def main():
+        big = asyncio.ensure_future(scheduler.aacquire("gpt-4", 600, session="b"))
+        await asyncio.sleep(0.05)
+        big.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await big
+        return await scheduler.aacquire("gpt-4", 1, session="c", timeout=1)
+
+    assert asyncio.run(main()).granted
+
+
+def _grant_order(scheduler, requests):
+    """(session, priority) の順に待ち行列へ入れ、許可された順に返す"""
+    async def main():
+        order = []
+
+        async def wait(session, priority):
+            await scheduler.aacquire("gpt-4", 1, session=session, priority=priority, timeout=5)
+            order.append((session, priority))
+
+        tasks = []
+        for session, priority in requests:
+            tasks.append(asyncio.ensure_future(wait(session, priority)))
+            await asyncio.sleep(0)  # 入れた順に行列へ並ぶよう1つずつ進める
+        await asyncio.gather(*tasks)
+        return order
+
+    return asyncio.run(main())
+
+
+def test_interactive_requests_go_before_background():
+    order = _grant_order(_exhausted_scheduler(), [
+        ("batch", "background"), ("batch", "background"), ("ui", "interactive"),
+    ])
+    assert order[0] == ("ui", "interactive")
+
+
+def test_sessions_are_served_round_robin():
+    order = _grant_order(_exhausted_scheduler(), [
+        ("a", "interactive"), ("a", "interactive"), ("a", "interactive"), ("b", "interactive"),
+    ])
+    assert [session for session, _ in order] == ["a", "b", "a", "a"]
@@ -0,0 +1,76 @@
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+
+from game_engine import DEFAULT_PLAYER, GameEngine  # noqa: E402
+from scenarios import (  # noqa: E402
+    SCENARIOS, Scenario, allowed_values, apply_scenario, build_scenario, get_scenario, scenario_for_stage,
+)
+
+
+def test_registered_scenarios_are_valid():
+    assert "stage3-gpt4o" in SCENARIOS
+    for scenario in SCENARIOS.values():
+        assert scenario.validate() is scenario
+
+
+def test_allowed_values_start_with_the_default():
+    for key in ("model", "prompt_limit", "max_turns"):
+        values = allowed_values(key)
+        assert values[0] == DEFAULT_PLAYER[key]
+        assert len(values) == len(set(values)) > 1
+
+
+@pytest.mark.parametrize("scenario", [
+    Scenario("no-stage", 99),
+    Scenario("bad-model", 2, model="gpt-9"),
+    Scenario("bad-limit", 2, prompt_limit=123),
+])
+def test_unreachable_loadouts_are_rejected(scenario):
+    with pytest.raises(ValueError):
+        scenario.validate(strict=False)
+
+
+def test_strict_validation_counts_earned_upgrades():
+    scenario = Scenario("too-strong", 2, model="gpt-4", max_turns=5)
+    assert scenario.upgrades_needed() == 2
+    with pytest.raises(ValueError, match="2 upgrades"):
+        scenario.validate()
+    assert scenario.validate(strict=False) is scenario
+
+
+def test_build_scenario_overlays_player_loadout():
+    scenario = build_scenario("stage3", player={"model": "gpt-4o"})
+    assert scenario.stage == 3 and scenario.model == "gpt-4o"
+    assert get_scenario("stage3").model == DEFAULT_PLAYER["model"]  # 登録済みのシナリオは変えない
+
+    unnamed = build_scenario(stage=2, player={"current_stage": 1, "max_turns": 5})
+    assert unnamed.stage == 2 and unnamed.max_turns == 5
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"name": "missing"},
+    {"player": ["gpt-4"]},
+    {"player": {"password": "x"}},
+    {"stage": "2"},
+    {"stage": True},
+    {"stage": 2, "player": {"model": "gpt-4", "max_turns": 5}},
+])
+def test_build_scenario_rejects_bad_input(kwargs):
+    with pytest.raises(ValueError):
+        build_scenario(**kwargs)
+
+
+def test_scenario_for_stage_is_not_strict():
+    scenario = scenario_for_stage(2, {"model": "gpt-4", "max_turns": 5})
+    assert scenario.loadout() == {"model": "gpt-4", "prompt_limit": 50, "max_turns": 5}
+
+
+def test_apply_scenario_starts_the_stage():
+    engine = GameEngine()
+    engine.conversation = [{"role": "ally", "content": "前のステージ"}]
+    apply_scenario(engine, "stage3-gpt4o")
+    assert engine.player == {"model": "gpt-4o", "prompt_limit": 50, "max_turns": 7, "current_stage": 3}
+    assert engine.conversation == []
+    assert engine.current_turn == 0
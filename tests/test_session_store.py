@@ -0,0 +1,127 @@
+import threading
+import zlib
+
+import pytest
+
+from session_store import (
+    ConflictError, MemorySessionStore, SQLiteSessionStore, SessionStore, decode_snapshot,
+    encode_snapshot, load_engine, open_session_store, save_engine,
+)
+
+STATE = {"player": {"model": "gpt-4", "current_stage": 2}, "conversation": [{"role": "ally", "content": "こんにちは"}]}
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = MemorySessionStore()
+    else:
+        store = SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    yield store
+    store.close()
+
+
+def test_snapshot_round_trip_and_validation():
+    data = encode_snapshot(STATE)
+    assert decode_snapshot(data) == STATE
+    with pytest.raises(ValueError):
+        decode_snapshot(data[:5])
+    with pytest.raises(ValueError):
+        decode_snapshot(b"XXXX" + data[4:])
+    with pytest.raises(ValueError):
+        decode_snapshot(data[:4] + b"\x09" + data[5:])
+    with pytest.raises((ValueError, zlib.error)):
+        decode_snapshot(data[:-3])
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_versions_increase_on_each_save(store):
+    assert store.load("s1") is None
+    assert store.save("s1", STATE, 0) == 1
+    assert store.save("s1", dict(STATE, turn=1), 1) == 2
+    state, version = store.load("s1")
+    assert version == 2 and state["turn"] == 1
+
+
+def test_stale_version_is_a_conflict(store):
+    store.save("s1", STATE, 0)
+    with pytest.raises(ConflictError):
+        store.save("s1", STATE, 0)  # 別のプロセスが先に新規作成していた
+    store.save("s1", STATE, 1)
+    with pytest.raises(ConflictError):
+        store.save("s1", STATE, 1)  # 読み込んだ後に更新されていた
+    assert store.load("s1")[1] == 2
+
+
+def test_delete_resets_the_session(store):
+    store.save("s1", STATE, 0)
+    store.delete("s1")
+    store.delete("missing")
+    assert store.load("s1") is None
+    assert store.save("s1", STATE, 0) == 1
+
+
+def test_sqlite_store_is_shared_between_instances_and_threads(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    writer = SQLiteSessionStore(path)
+    errors = []
+
+    def save(i):
+        try:
+            writer.save(f"s{i}", dict(STATE, i=i), 0)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=save, args=(i,)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    reader = SQLiteSessionStore(path)
+    assert [reader.load(f"s{i}")[0]["i"] for i in range(16)] == list(range(16))
+    assert reader.purge(max_age=3600) == 0
+    assert reader.purge(max_age=-1) == 16
+    writer.close()
+    assert writer.load("s0") is None  # close 後は開き直す
+    reader.close()
+
+
+def test_open_session_store_urls(tmp_path):
+    assert isinstance(open_session_store("memory://"), MemorySessionStore)
+    store = open_session_store(f"sqlite:///{tmp_path / 'x.db'}")
+    assert isinstance(store, SQLiteSessionStore)
+    store.close()
+    with pytest.raises(ValueError):
+        open_session_store("redis://localhost")
+
+
+def test_engine_round_trip_keeps_version_and_extra():
+    pytest.importorskip("openai")
+    pytest.importorskip("dotenv")
+    from game_engine import GameEngine
+
+    store = MemorySessionStore()
+    engine = GameEngine()
+    engine.set_player_prompt("教えて")
+    engine.conversation = [{"role": "ally", "content": "a"}, {"role": "enemy", "content": "b"}]
+    engine.current_turn = 1
+    assert save_engine(store, engine, extra={"screen": "battle"}) == 1
+
+    restored = GameEngine(session_id=engine.session_id)
+    assert load_engine(store, engine.session_id, restored) == {"screen": "battle"}
+    assert restored.store_version == 1
+    assert restored.player_prompt == "教えて"
+    assert restored.conversation == engine.conversation
+    assert restored.current_turn == 1
+
+    stale = GameEngine(session_id=engine.session_id)
+    assert save_engine(store, restored) == 2
+    with pytest.raises(ConflictError):
+        save_engine(store, stale)
+    assert load_engine(store, "missing", stale) is None
@@ -0,0 +1,272 @@
+"""
+候補プロンプト × ステージ × シードの総当たりを並列に実行し、プロンプトごとに集計する。
+
+    python auto_play.py --tournament prompts.txt --stages 1,2 --seeds 5 --concurrency 16 --out runs.jsonl
+
+シードは同じ条件での繰り返し番号（LLM の出力の揺れを平均するためのもの）。
+各試行は前のステージを経由せず、scenarios のシナリオで直接そのステージから始める。
+"""
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from events import Event
+from game_engine import AsyncGameEngine, GameEngine
+from scenarios import build_scenario, get_scenario
+from stages import get_total_stages
+
+
+@dataclass
+class RunSpec:
+    """1回分の試行: プロンプト × ステージ（またはシナリオ） × シード"""
+    prompt_id: str
+    prompt: str
+    stage: int
+    seed: int
+    scenario: Optional[str] = None
+
+
+@dataclass
+class RunResult:
+    prompt_id: str
+    prompt: str
+    stage: int
+    seed: int
+    status: str = "pending"  # "clear" | "failed" | "invalid" | "error"
+    turns: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    duration: float = 0.0
+    error: Optional[str] = None
+    scenario: Optional[str] = None
+    # 途中で閉じたストリームの使用量を見積もりで数えた（トークン数は概算）
+    estimated_usage: bool = False
+
+    @classmethod
+    def for_spec(cls, spec: RunSpec) -> "RunResult":
+        return cls(spec.prompt_id, spec.prompt, spec.stage, spec.seed, scenario=spec.scenario)
+
+    @property
+    def cleared(self) -> bool:
+        return self.status == "clear"
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["total_tokens"] = self.total_tokens
+        return data
+
+
+def load_prompts(path: str) -> List[tuple]:
+    """
+    候補プロンプトを読み込む。
+    .jsonl は {"id": ..., "prompt": ...} の行、それ以外は1行1プロンプト（# で始まる行は無視）。
+    """
+    prompts = []
+    with open(path, encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if path.endswith(".jsonl"):
+                entry = json.loads(line)
+                prompts.append((str(entry.get("id", f"p{index}")), entry["prompt"]))
+            else:
+                prompts.append((f"p{len(prompts)}", line))
+    return prompts
+
+
+def build_runs(prompts: Iterable[tuple], stages: Iterable[int], seeds: int,
+               scenarios: Optional[Iterable[str]] = None) -> List[RunSpec]:
+    """scenarios を指定した場合は stages の代わりにシナリオごとの試行を作る"""
+    if scenarios is not None:
+        targets = [(get_scenario(name).stage, name) for name in scenarios]
+    else:
+        targets = [(stage, None) for stage in stages]
+    return [
+        RunSpec(prompt_id, prompt, stage, seed, scenario)
+        for prompt_id, prompt in prompts
+        for stage, scenario in targets
+        for seed in range(seeds)
+    ]
+
+
+def prepare_engine(engine: GameEngine, spec: RunSpec, player: Optional[Dict[str, Any]]) -> bool:
+    """
+    シナリオでエンジンを指定ステージの開始状態にする。player のロードアウト項目はシナリオより優先する。
+    ロードアウトが不正なら ValueError、プロンプトが上限超過なら False
+    """
+    build_scenario(spec.scenario, spec.stage, player, strict=False).apply(engine)
+    if len(spec.prompt) > engine.player["prompt_limit"]:
+        return False
+    engine.set_player_prompt(spec.prompt)
+    return True
+
+
+def tally(result: RunResult, event: Event) -> bool:
+    """イベントを集計し、ステージが決着したら True"""
+    if event["type"] in ("ally_done", "enemy_done"):
+        usage = event.get("usage") or {}
+        result.prompt_tokens += usage.get("prompt_tokens", 0)
+        result.completion_tokens += usage.get("completion_tokens", 0)
+        result.estimated_usage = result.estimated_usage or bool(usage.get("estimated"))
+    elif event["type"] == "error":
+        result.status = "error"
+        result.error = event.get("content")
+        return True
+    elif event["type"] == "result":
+        result.turns += 1
+        if event["status"] in ("clear", "failed"):
+            result.status = event["status"]
+            return True
+    return False
+
+
+def _log_event(event_log: Optional["JsonlWriter"], spec: RunSpec, event: Event):
+    # チャンクは数が多いので、*_done と result だけを残す
+    if event_log is not None and not event.type.endswith("_chunk"):
+        event_log.write({"prompt_id": spec.prompt_id, "stage": spec.stage, "scenario": spec.scenario,
+                         "seed": spec.seed, **event.to_dict()})
+
+
+def run_one(spec: RunSpec, player: Optional[Dict[str, Any]] = None,
+            event_log: Optional["JsonlWriter"] = None) -> RunResult:
+    result = RunResult.for_spec(spec)
+    engine = GameEngine(priority="background")
+    if not prepare_engine(engine, spec, player):
+        result.status = "invalid"
+        result.error = "prompt exceeds prompt_limit"
+        return result
+    started = time.perf_counter()
+    try:
+        done = False
+        while not done:
+            for event in engine.process_turn_stream():
+                _log_event(event_log, spec, event)
+                done = tally(result, event) or done
+    except Exception as e:
+        result.status = "error"
+        result.error = str(e)
+    result.duration = time.perf_counter() - started
+    return result
+
+
+async def arun_one(spec: RunSpec, player: Optional[Dict[str, Any]] = None,
+                   event_log: Optional["JsonlWriter"] = None) -> RunResult:
+    """run_one の非同期版"""
+    result = RunResult.for_spec(spec)
+    engine = AsyncGameEngine(priority="background")
+    if not prepare_engine(engine, spec, player):
+        result.status = "invalid"
+        result.error = "prompt exceeds prompt_limit"
+        return result
+    started = time.perf_counter()
+    try:
+        done = False
+        while not done:
+            async for event in engine.process_turn_stream():
+                _log_event(event_log, spec, event)
+                done = tally(result, event) or done
+    except Exception as e:
+        result.status = "error"
+        result.error = str(e)
+    result.duration = time.perf_counter() - started
+    return result
+
+
+class JsonlWriter:
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict[str, Any]):
+        if not self.path:
+            return
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+def run_tournament(runs: List[RunSpec], concurrency: int = 8, results_path: Optional[str] = None,
+                   player: Optional[Dict[str, Any]] = None, mode: str = "thread",
+                   events_path: Optional[str] = None) -> List[RunResult]:
+    """
+    全試行を並列実行し、終わったものから results_path（JSONL）に追記する。
+    mode="thread" は GameEngine をスレッドプールで、"async" は AsyncGameEngine を
+    1つのイベントループで同時実行数 concurrency まで動かす。
+    events_path を指定すると、各試行の *_done / result イベントもそのまま JSONL に残す。
+    """
+    writer = JsonlWriter(results_path)
+    event_log = JsonlWriter(events_path) if events_path else None
+
+    if mode == "async":
+        async def main() -> List[RunResult]:
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def bounded(spec: RunSpec) -> RunResult:
+                async with semaphore:
+                    result = await arun_one(spec, player, event_log)
+                writer.write(result.to_dict())
+                return result
+
+            return list(await asyncio.gather(*(bounded(spec) for spec in runs)))
+
+        return asyncio.run(main())
+
+    def task(spec: RunSpec) -> RunResult:
+        result = run_one(spec, player, event_log)
+        writer.write(result.to_dict())
+        return result
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(task, runs))
+
+
+def aggregate(results: Iterable[RunResult]) -> Dict[str, Dict[str, Any]]:
+    """プロンプトごとのクリア率・クリアまでの平均ターン数・トークンコスト"""
+    by_prompt: Dict[str, List[RunResult]] = {}
+    for result in results:
+        by_prompt.setdefault(result.prompt_id, []).append(result)
+
+    summary = {}
+    for prompt_id, group in by_prompt.items():
+        cleared = [r for r in group if r.cleared]
+        total_tokens = sum(r.total_tokens for r in group)
+        summary[prompt_id] = {
+            "prompt": group[0].prompt,
+            "runs": len(group),
+            "cleared": len(cleared),
+            "clear_rate": len(cleared) / len(group),
+            "avg_turns_to_clear": sum(r.turns for r in cleared) / len(cleared) if cleared else None,
+            "total_tokens": total_tokens,
+            "avg_tokens_per_run": total_tokens / len(group),
+            "estimated_tokens": any(r.estimated_usage for r in group),
+            "errors": sum(1 for r in group if r.status in ("error", "invalid")),
+        }
+    return summary
+
+
+def format_summary(summary: Dict[str, Dict[str, Any]]) -> str:
+    lines = [f"{'prompt':<10} {'clear':>7} {'turns':>6} {'tokens/run':>11} {'err':>4}  text"]
+    ranked = sorted(summary.items(), key=lambda item: (-item[1]["clear_rate"], item[1]["avg_tokens_per_run"]))
+    for prompt_id, s in ranked:
+        turns = f"{s['avg_turns_to_clear']:.1f}" if s["avg_turns_to_clear"] is not None else "-"
+        # ~ は見積もりを含む（パスワード検出で閉じたストリームは使用量が届かない）
+        tokens = ("~" if s.get("estimated_tokens") else "") + f"{s['avg_tokens_per_run']:.0f}"
+        lines.append(
+            f"{prompt_id:<10} {s['clear_rate']:>6.0%} {turns:>6} {tokens:>11} "
+            f"{s['errors']:>4}  {s['prompt'][:40]}"
+        )
+    return "\n".join(lines)
+
+
+def all_stages() -> List[int]:
+    return list(range(1, get_total_stages() + 1))